@@ -0,0 +1,82 @@
+# conftest.py
+# Корень репозитория попадает в sys.path, тесты импортируют модули бота как есть.
+
+import os
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+# db.requests собирает URL подключения при импорте; сами тесты к БД не подключаются
+os.environ.setdefault("DB_PORT", "5432")
+
+
+class FakeResult:
+    def __init__(self, rows=(), rowcount=None):
+        self.rows = list(rows)
+        self.rowcount = len(self.rows) if rowcount is None else rowcount
+
+    def all(self):
+        return self.rows
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def scalar(self):
+        return self.rows[0][0] if self.rows else None
+
+    scalar_one_or_none = scalar
+
+    def scalar_one(self):
+        (row,) = self.rows
+        return row[0]
+
+
+class FakeConnection:
+    """Запоминает выполненные запросы и отдает заранее заданные результаты по очереди."""
+
+    def __init__(self):
+        self.statements = []
+        self.results = []
+        self.commits = 0
+
+    async def execute(self, stmt, params=None):
+        self.statements.append(stmt)
+        return self.results.pop(0) if self.results else FakeResult()
+
+    async def commit(self):
+        self.commits += 1
+
+    def sql(self, index: int = 0) -> str:
+        """Текст запроса в диалекте Postgres (asyncpg)."""
+        return str(self.statements[index].compile(dialect=postgresql.asyncpg.dialect()))
+
+    def params(self, index: int = 0) -> dict:
+        return self.statements[index].compile(dialect=postgresql.asyncpg.dialect()).params
+
+
+class FakeEngine:
+    def __init__(self, conn: FakeConnection):
+        self.conn = conn
+
+    def _context(self):
+        conn = self.conn
+
+        class Context:
+            async def __aenter__(self):
+                return conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Context()
+
+    connect = begin = _context
+
+
+@pytest.fixture
+def fake_db(monkeypatch) -> FakeConnection:
+    """Подменяет движок db.requests: запросы не уходят в БД, а сохраняются для проверки."""
+    import db.requests
+    conn = FakeConnection()
+    monkeypatch.setattr(db.requests, "engine", FakeEngine(conn))
+    return conn
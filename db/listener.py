@@ -0,0 +1,55 @@
+# db/listener.py
+
+import os
+import json
+import asyncio
+import logging
+from typing import Callable
+
+import asyncpg
+
+from db.requests import CACHE_CHANNEL
+
+RECONNECT_DELAY_SECONDS = 5
+
+
+async def _connect() -> asyncpg.Connection:
+    """Открывает отдельное соединение для LISTEN (вне пула SQLAlchemy)."""
+    return await asyncpg.connect(
+        user=os.getenv('DB_USER'), password=os.getenv('DB_PASS'),
+        host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
+        database=os.getenv('DB_NAME')
+    )
+
+
+async def run_cache_listener(on_event: Callable[[dict], None]):
+    """
+    Держит одно LISTEN-соединение и передает события об изменениях в on_event.
+    При потере соединения события могли быть пропущены, поэтому on_event
+    получает {"event": "resync"} и кэши сбрасываются целиком.
+    """
+    def handle_notification(connection, pid, channel, payload):
+        try:
+            on_event(json.loads(payload))
+        except Exception as e:
+            logging.error(f"Не удалось обработать событие кэша {payload!r}: {e}")
+
+    while True:
+        conn = None
+        try:
+            conn = await _connect()
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda _: closed.set())
+            await conn.add_listener(CACHE_CHANNEL, handle_notification)
+            logging.info(f"Подписка на канал '{CACHE_CHANNEL}' активна")
+            await closed.wait()
+            logging.warning("LISTEN-соединение закрыто, переподключаемся...")
+        except asyncio.CancelledError:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка LISTEN-соединения: {e}")
+
+        on_event({"event": "resync"})
+        await asyncio.sleep(RECONNECT_DELAY_SECONDS)
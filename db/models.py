@@ -1,4 +1,5 @@
-from sqlalchemy import Column, BigInteger, String, DateTime, JSON, ForeignKey, Integer, Text
+from sqlalchemy import Column, BigInteger, String, DateTime, ForeignKey, Integer, Text, Index, Boolean
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import func
 
@@ -7,16 +8,24 @@ Base = declarative_base()
 class Chat(Base):
     __tablename__ = "chats"
     chat_id = Column(BigInteger, primary_key=True, index=True)
-    settings = Column(JSON, nullable=False, default={
+    # JSONB: отдельные ключи меняются на сервере, без чтения и перезаписи всего словаря
+    settings = Column(JSONB, nullable=False, default={
         'welcome_message': 'Приветствуем в чате!',
         'warn_limit': 3,
+        # Через сколько дней варн перестает действовать (0 - никогда)
+        'warn_ttl_days': 0,
         'antilink_enabled': False,
+        'antidup_enabled': False,
+        'antiraid_enabled': True,
+        'federation_enabled': False,
         'log_channel_id': None,
         'captcha_enabled': False,
         'captcha_timeout': 60,
         'rules_text': 'Правила в этом чате еще не установлены.',
         'goodbye_message': 'Пользователь {user_mention} покинул чат.'
     }) 
+    # Растет на 1 при каждом изменении настроек; по ней кэши отличают свежие данные от устаревших
+    settings_version = Column(BigInteger, nullable=False, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class StopWord(Base):
@@ -24,6 +33,8 @@ class StopWord(Base):
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     chat_id = Column(BigInteger, ForeignKey("chats.chat_id", ondelete="CASCADE"), nullable=False)
     word = Column(String, nullable=False)
+    # Повторная вставка слова (в том числе пачкой из файла) пропускается через ON CONFLICT
+    __table_args__ = (Index("ux_stop_words_chat_word", "chat_id", "word", unique=True),)
 
 class Warning(Base):
     __tablename__ = "warnings"
@@ -31,6 +42,8 @@ class Warning(Base):
     user_id = Column(BigInteger, nullable=False) # Кому выдали
     chat_id = Column(BigInteger, ForeignKey("chats.chat_id", ondelete="CASCADE"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Подсчет действующих варнов пользователя и очистка истекших идут по этому индексу
+    __table_args__ = (Index("ix_warnings_chat_user_created", "chat_id", "user_id", "created_at"),)
 
 class User(Base):
     __tablename__ = "users"
@@ -53,7 +66,11 @@ class Message(Base):
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     chat_id = Column(BigInteger, ForeignKey("chats.chat_id", ondelete="CASCADE"), nullable=False)
     user_id = Column(BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    # ID сообщения в Telegram (у записей, сделанных до появления колонки, пусто)
+    message_id = Column(BigInteger)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Для /purge: ID сообщений пользователя в чате читаются по индексу
+    __table_args__ = (Index("ix_messages_chat_user_message", "chat_id", "user_id", "message_id"),)
 
 class Note(Base):
     __tablename__ = "notes"
@@ -68,4 +85,52 @@ class Trigger(Base):
     id = Column(Integer, primary_key=True)
     chat_id = Column(BigInteger, ForeignKey("chats.chat_id", ondelete="CASCADE"), nullable=False)
     keyword = Column(String(100), nullable=False)
-    response = Column(Text, nullable=False)
\ No newline at end of file
+    response = Column(Text, nullable=False)
+    __table_args__ = (Index("ux_triggers_chat_keyword", "chat_id", "keyword", unique=True),)
+
+class Timer(Base):
+    """Отложенное действие (кик по капче, удаление сообщения, размут), переживающее перезапуск."""
+    __tablename__ = "timers"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    kind = Column(String(32), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger)
+    message_id = Column(BigInteger)
+    run_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class RaidCaptchaMember(Base):
+    """Участник общей капчи рейда; хранится рядом с таймером raid_kick, чтобы пачка пережила перезапуск."""
+    __tablename__ = "raid_captcha_members"
+    chat_id = Column(BigInteger, primary_key=True)
+    # ID общего сообщения с капчей
+    message_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    verified = Column(Boolean, nullable=False, default=False)
+
+class GlobalBan(Base):
+    """Общий бан-лист всех чатов бота; проверяется при входе в чатах с federation_enabled."""
+    __tablename__ = "global_bans"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, nullable=False, unique=True)
+    reason = Column(Text)
+    banned_by = Column(BigInteger)
+    source_chat_id = Column(BigInteger)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+class ModerationEvent(Base):
+    """Журнал действий модерации: кто, над кем, что сделал, почему и на какой срок."""
+    __tablename__ = "moderation_events"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, nullable=False)
+    # None - автоматическое действие бота (антифлуд, фильтры)
+    actor_id = Column(BigInteger)
+    target_id = Column(BigInteger)
+    action = Column(String(32), nullable=False)
+    reason = Column(Text)
+    duration_seconds = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # /modlog листает журнал чата (и журнал пользователя в чате) по ключу (created_at, id)
+    __table_args__ = (
+        Index("ix_moderation_events_chat_created", "chat_id", "created_at", "id"),
+        Index("ix_moderation_events_chat_target_created", "chat_id", "target_id", "created_at", "id"),
+    )
@@ -1,23 +1,119 @@
 import os
+import json
+import logging
+import zlib
+from contextlib import asynccontextmanager
 from aiogram import types
-from sqlalchemy import update, select, delete, func as sql_func, text, insert
-from sqlalchemy.dialects.postgresql import insert as pg_insert
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import update, select, delete, func as sql_func, text, insert, any_, bindparam, BigInteger, or_, true, tuple_, literal, literal_column, String, Text
+from sqlalchemy.dialects.postgresql import insert as pg_insert, ARRAY, JSONB
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.schema import CreateSchema, CreateIndex
 
-from db.models import Base, Chat, StopWord, Warning, User, UserProfile, Message, Note, Trigger
+from db.models import Base, Chat, StopWord, Warning, User, UserProfile, Message, Note, Trigger, Timer, GlobalBan, ModerationEvent, RaidCaptchaMember
 from datetime import datetime, timedelta
+from utils.tenancy import current_bot_id, schema_for
 
 db_url = (
     f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@"
     f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 )
 
-engine = create_async_engine(db_url)
+class TenantEngine:
+    """
+    Один движок и один пул соединений на все боты процесса. Соединение получает
+    schema_translate_map текущего бота, поэтому таблицы без схемы попадают в bot_<id>.
+    """
+
+    def __init__(self, base: AsyncEngine):
+        self.base = base
+        self._scoped: dict[str, AsyncEngine] = {}
+
+    def _current(self) -> AsyncEngine:
+        schema = schema_for(current_bot_id.get())
+        if schema is None:
+            return self.base
+        scoped = self._scoped.get(schema)
+        if scoped is None:
+            # Производный движок использует тот же пул
+            scoped = self._scoped[schema] = self.base.execution_options(schema_translate_map={None: schema})
+        return scoped
+
+    def connect(self):
+        return self._current().connect()
+
+    def begin(self):
+        return self._current().begin()
+
+engine = TenantEngine(create_async_engine(db_url))
+
+# Канал Postgres, через который инстансы бота сообщают друг другу об изменениях кэшируемых данных
+CACHE_CHANNEL = "tgmanager_cache"
+
+async def notify_cache_event(conn, event: str, chat_id: int, **payload):
+    """Публикует событие об изменении данных чата (доставляется слушателям после COMMIT)."""
+    message = json.dumps({"event": event, "bot": current_bot_id.get(), "chat_id": chat_id, **payload}, ensure_ascii=False)
+    await conn.execute(select(sql_func.pg_notify(CACHE_CHANNEL, message)))
+
+# Колонки и индексы, добавленные в модели после создания таблиц: create_all не меняет
+# существующие таблицы, поэтому они досоздаются при старте
+ADDED_COLUMNS = [Message.__table__.c.message_id, Chat.__table__.c.settings_version]
+# Колонки, тип которых изменился: в старых таблицах settings хранился как JSON
+CHANGED_TYPE_COLUMNS = [Chat.__table__.c.settings]
+ADDED_INDEXES = [
+    *Message.__table__.indexes, *Warning.__table__.indexes,
+    *StopWord.__table__.indexes, *Trigger.__table__.indexes,
+]
 
 async def create_tables():
     async with engine.begin() as conn:
+        schema = schema_for(current_bot_id.get())
+        if schema is not None:
+            await conn.execute(CreateSchema(schema, if_not_exists=True))
         await conn.run_sync(Base.metadata.create_all)
 
+        dialect = engine.base.dialect
+        for column in ADDED_COLUMNS:
+            # schema_translate_map не действует на текстовый SQL, схему подставляем сами
+            table_name = f'"{schema}".{column.table.name}' if schema is not None else column.table.name
+            definition = f"{column.name} {column.type.compile(dialect=dialect)}"
+            if column.server_default is not None:
+                definition += f" DEFAULT {column.server_default.arg}"
+            if not column.nullable:
+                definition += " NOT NULL"
+            await conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {definition}"))
+        for column in CHANGED_TYPE_COLUMNS:
+            await _alter_column_type(conn, column, schema, dialect)
+        for index in ADDED_INDEXES:
+            await _create_added_index(conn, index, schema)
+
+async def _alter_column_type(conn, column, schema: str | None, dialect):
+    new_type = column.type.compile(dialect=dialect)
+    current_type = (await conn.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = coalesce(:schema, current_schema()) AND table_name = :table AND column_name = :column"
+    ), {"schema": schema, "table": column.table.name, "column": column.name})).scalar()
+    # Проверяем заранее: ALTER TYPE переписывает всю таблицу
+    if current_type is None or current_type.lower() == new_type.lower():
+        return
+    table_name = f'"{schema}".{column.table.name}' if schema is not None else column.table.name
+    await conn.execute(text(
+        f"ALTER TABLE {table_name} ALTER COLUMN {column.name} TYPE {new_type} USING {column.name}::{new_type}"
+    ))
+
+async def _create_added_index(conn, index, schema: str | None):
+    qualified = f'"{schema}".{index.name}' if schema is not None else index.name
+    if (await conn.execute(select(sql_func.to_regclass(qualified)))).scalar() is not None:
+        return
+    if index.unique:
+        # Выполняется один раз, пока индекса нет. В старых таблицах могли остаться повторы:
+        # оставляем самую позднюю запись (для триггеров - последний заданный ответ, как при upsert)
+        table = f'"{schema}".{index.table.name}' if schema is not None else index.table.name
+        same_key = " AND ".join(f"a.{column.name} = b.{column.name}" for column in index.columns)
+        result = await conn.execute(text(f"DELETE FROM {table} a USING {table} b WHERE {same_key} AND a.id < b.id"))
+        if result.rowcount:
+            logging.warning(f"Перед созданием индекса {index.name} удалено повторов в {table}: {result.rowcount}")
+    await conn.execute(CreateIndex(index, if_not_exists=True))
+
 async def add_chat(chat_id: int):
     """Добавляет новый чат в базу данных."""
     async with engine.connect() as conn:
@@ -26,24 +122,50 @@ async def add_chat(chat_id: int):
         await conn.execute(stmt)
         await conn.commit()
         
-async def update_chat_setting(chat_id: int, setting_name: str, value):
+async def update_chat_settings(chat_id: int, **values) -> int | None:
+    """
+    Меняет несколько настроек чата одним запросом: переданные ключи сливаются
+    с текущими на сервере (settings || patch), остальные не затрагиваются.
+    Возвращает новую версию настроек или None, если чата нет.
+    """
     async with engine.connect() as conn:
-        current_settings_result = await conn.execute(
-            Chat.__table__.select().where(Chat.chat_id == chat_id)
+        stmt = (
+            update(Chat)
+            .where(Chat.chat_id == chat_id)
+            .values(settings=Chat.settings.op("||")(literal(values, JSONB)),
+                    settings_version=Chat.settings_version + 1)
+            .returning(Chat.settings_version)
         )
-        current_settings = current_settings_result.first()
-        
-        if current_settings:
-            settings_dict = dict(current_settings.settings)
-            settings_dict[setting_name] = value
-            
-            stmt = (
-                update(Chat)
-                .where(Chat.chat_id == chat_id)
-                .values(settings=settings_dict)
-            )
-            await conn.execute(stmt)
-            await conn.commit()
+        version = (await conn.execute(stmt)).scalar_one_or_none()
+        if version is not None:
+            await notify_cache_event(conn, "settings_changed", chat_id, keys=list(values), version=version)
+        await conn.commit()
+        return version
+
+async def update_chat_setting(chat_id: int, setting_name: str, value) -> int | None:
+    return await update_chat_settings(chat_id, **{setting_name: value})
+
+async def toggle_chat_setting(chat_id: int, setting_name: str, default: bool = False) -> tuple[bool, int] | None:
+    """
+    Атомарно переключает булеву настройку (отсутствующая считается равной default).
+    Одновременные нажатия не теряются: каждое переключает уже обновленное значение.
+    Возвращает (новое значение, версия настроек) или None, если чата нет.
+    """
+    current = sql_func.coalesce(Chat.settings[setting_name].as_boolean(), default)
+    async with engine.connect() as conn:
+        stmt = (
+            update(Chat)
+            .where(Chat.chat_id == chat_id)
+            .values(settings=sql_func.jsonb_set(Chat.settings, literal([setting_name], ARRAY(Text)),
+                                                sql_func.to_jsonb(~current)),
+                    settings_version=Chat.settings_version + 1)
+            .returning(Chat.settings[setting_name].as_boolean(), Chat.settings_version)
+        )
+        row = (await conn.execute(stmt)).first()
+        if row is not None:
+            await notify_cache_event(conn, "settings_changed", chat_id, keys=[setting_name], version=row[1])
+        await conn.commit()
+        return (row[0], row[1]) if row is not None else None
 
 # --- Функции для системы уровней (XP) ---
 
@@ -51,6 +173,18 @@ def calculate_xp_for_next_level(level: int) -> int:
     """Формула для расчета необходимого опыта для следующего уровня."""
     return 5 * (level ** 2) + 50 * level + 100
 
+def apply_xp(level: int, xp: int, amount: int) -> tuple[int, int, bool]:
+    """Начисляет опыт. Возвращает (уровень, остаток опыта, флаг повышения уровня)."""
+    new_xp = xp + amount
+    xp_needed = calculate_xp_for_next_level(level)
+    leveled_up = False
+    while new_xp >= xp_needed:
+        level += 1
+        new_xp -= xp_needed
+        xp_needed = calculate_xp_for_next_level(level)
+        leveled_up = True
+    return level, new_xp, leveled_up
+
 async def add_xp(user_id: int, chat_id: int, amount: int) -> tuple[int, bool]:
     """
     Добавляет опыт пользователю и проверяет, не повысился ли уровень.
@@ -58,17 +192,7 @@ async def add_xp(user_id: int, chat_id: int, amount: int) -> tuple[int, bool]:
     """
     async with engine.connect() as conn:
         profile = await get_or_create_user_profile(user_id, chat_id)
-        
-        current_level = profile.level
-        new_xp = profile.xp + amount
-        xp_needed = calculate_xp_for_next_level(current_level)
-        
-        leveled_up = False
-        while new_xp >= xp_needed:
-            current_level += 1
-            new_xp -= xp_needed
-            xp_needed = calculate_xp_for_next_level(current_level)
-            leveled_up = True
+        current_level, new_xp, leveled_up = apply_xp(profile.level, profile.xp, amount)
 
         stmt = update(UserProfile).where(
             UserProfile.user_id == user_id,
@@ -92,25 +216,44 @@ async def get_top_users_by_xp(chat_id: int, limit: int = 10):
         return result.all()
 
 async def add_stop_word(chat_id: int, word: str):
-    """Добавляет стоп-слово для конкретного чата."""
+    """Добавляет стоп-слово для конкретного чата. False, если слово уже есть."""
     async with engine.connect() as conn:
-        # Проверяем, может слово уже есть
-        existing = await conn.execute(
-            select(StopWord).where(StopWord.chat_id == chat_id, StopWord.word == word)
+        stmt = (
+            pg_insert(StopWord).values(chat_id=chat_id, word=word)
+            .on_conflict_do_nothing(index_elements=['chat_id', 'word'])
+            .returning(StopWord.id)
         )
-        if existing.first():
-            return False # Слово уже есть
-
-        stmt = insert(StopWord).values(chat_id=chat_id, word=word)
-        await conn.execute(stmt)
+        if (await conn.execute(stmt)).first() is None:
+            return False
+        await notify_cache_event(conn, "stop_word_added", chat_id, word=word)
         await conn.commit()
-        return True # Слово успешно добавлено
+        return True
+
+async def add_stop_words(chat_id: int, words: list[str]) -> int:
+    """
+    Добавляет много стоп-слов одним запросом (массив разворачивается в строки через unnest).
+    Уже существующие пропускаются. Возвращает число добавленных.
+    """
+    rows = select(literal(chat_id, BigInteger), sql_func.unnest(bindparam("words", words, type_=ARRAY(String))))
+    stmt = (
+        pg_insert(StopWord).from_select(['chat_id', 'word'], rows)
+        .on_conflict_do_nothing(index_elements=['chat_id', 'word'])
+        .returning(StopWord.id)
+    )
+    async with engine.begin() as conn:
+        added = len((await conn.execute(stmt)).all())
+        if added:
+            # Одно событие на весь импорт: кэши перечитают список целиком
+            await notify_cache_event(conn, "stop_words_changed", chat_id)
+        return added
 
 async def delete_stop_word(chat_id: int, word: str):
     """Удаляет стоп-слово для конкретного чата."""
     async with engine.connect() as conn:
         stmt = delete(StopWord).where(StopWord.chat_id == chat_id, StopWord.word == word)
         result = await conn.execute(stmt)
+        if result.rowcount > 0:
+            await notify_cache_event(conn, "stop_word_deleted", chat_id, word=word)
         await conn.commit()
         return result.rowcount > 0 # Возвращает True, если что-то было удалено
 
@@ -121,23 +264,60 @@ async def get_stop_words(chat_id: int):
         result = await conn.execute(stmt)
         return [row.word for row in result.all()]
     
-async def add_warning(user_id: int, chat_id: int):
-    """Добавляет предупреждение пользователю."""
-    async with engine.connect() as conn:
-        stmt = insert(Warning).values(user_id=user_id, chat_id=chat_id)
-        await conn.execute(stmt)
-        await conn.commit()
+def _live_warnings(user_id: int, chat_id: int, ttl_days: int = 0):
+    """Условия для действующих варнов пользователя: диапазон индекса (chat_id, user_id, created_at)."""
+    conditions = [Warning.chat_id == chat_id, Warning.user_id == user_id]
+    if ttl_days:
+        conditions.append(Warning.created_at > sql_func.now() - timedelta(days=ttl_days))
+    return conditions
+
+async def add_warning(user_id: int, chat_id: int) -> tuple[int, int]:
+    """
+    Добавляет предупреждение. Возвращает (число действующих предупреждений вместе с новым, лимит варнов чата).
+    Вставка, подсчет и чтение настроек чата выполняются одним запросом.
+    """
+    ttl_days = Chat.settings['warn_ttl_days'].as_integer()
+    chat_settings = select(
+        sql_func.coalesce(ttl_days, 0).label("ttl_days"),
+        sql_func.coalesce(Chat.settings['warn_limit'].as_integer(), 3).label("warn_limit"),
+    ).where(Chat.chat_id == chat_id).cte("chat_settings")
+    inserted = insert(Warning).values(user_id=user_id, chat_id=chat_id).returning(Warning.id).cte("inserted")
+    live_count = select(sql_func.count()).select_from(Warning).where(
+        Warning.chat_id == chat_id, Warning.user_id == user_id,
+        or_(chat_settings.c.ttl_days == 0,
+            Warning.created_at > sql_func.now() - sql_func.make_interval(0, 0, 0, chat_settings.c.ttl_days))
+    ).scalar_subquery()
+    # Подзапрос не видит строку, вставленную в CTE того же запроса (общий снимок), поэтому +1
+    stmt = select(live_count + 1, chat_settings.c.warn_limit).select_from(inserted).join(chat_settings, true())
+    async with engine.begin() as conn:
+        # Параллельные /warn одному пользователю идут по очереди, иначе оба получат одинаковый счетчик
+        await conn.execute(select(sql_func.pg_advisory_xact_lock(_lock_key(f"warn:{chat_id}:{user_id}"))))
+        warnings_count, warn_limit = (await conn.execute(stmt)).one()
+        return warnings_count, warn_limit
 
-async def count_warnings(user_id: int, chat_id: int):
-    """Считает количество предупреждений у пользователя."""
+async def count_warnings(user_id: int, chat_id: int, ttl_days: int = 0):
+    """Считает действующие предупреждения пользователя."""
     async with engine.connect() as conn:
-        stmt = select(sql_func.count()).select_from(Warning).where(
-            Warning.user_id == user_id,
-            Warning.chat_id == chat_id
-        )
+        stmt = select(sql_func.count()).select_from(Warning).where(*_live_warnings(user_id, chat_id, ttl_days))
         result = await conn.execute(stmt)
         return result.scalar_one()
-    
+
+async def delete_expired_warnings(batch_size: int = 1000) -> int:
+    """
+    Удаляет до batch_size истекших варнов во всех чатах с warn_ttl_days > 0.
+    Короткие пачки не держат долгих блокировок; вызывать, пока возвращается batch_size.
+    """
+    ttl_days = Chat.settings['warn_ttl_days'].as_integer()
+    expired = (
+        select(Warning.id)
+        .join(Chat, Chat.chat_id == Warning.chat_id)
+        .where(ttl_days > 0, Warning.created_at < sql_func.now() - sql_func.make_interval(0, 0, 0, ttl_days))
+        .limit(batch_size)
+    )
+    async with engine.begin() as conn:
+        result = await conn.execute(delete(Warning).where(Warning.id.in_(expired.scalar_subquery())))
+        return result.rowcount
+
 async def remove_last_warning(user_id: int, chat_id: int):
     """Удаляет одно последнее предупреждение у пользователя."""
     async with engine.connect() as conn:
@@ -221,6 +401,73 @@ async def log_message(chat_id: int, user_id: int):
         await conn.execute(stmt)
         await conn.commit()
 
+async def record_message_activity(user: types.User, chat_id: int | None, xp_amount: int = 1) -> tuple[int, bool] | None:
+    """
+    Весь учет одного сообщения в одной транзакции на одном соединении:
+    пользователь, чат, профиль и опыт. Для личных сообщений (chat_id=None)
+    обновляется только пользователь. Возвращает (уровень, флаг повышения уровня) или None.
+    Само сообщение записывается отдельно (add_message_records), этот учет при перегрузке пропускается.
+    """
+    async with engine.begin() as conn:
+        stmt = pg_insert(User).values(
+            user_id=user.id, username=user.username, first_name=user.first_name, last_name=user.last_name
+        ).on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={'username': user.username, 'first_name': user.first_name, 'last_name': user.last_name}
+        )
+        await conn.execute(stmt)
+        if chat_id is None:
+            return None
+
+        await conn.execute(pg_insert(Chat).values(chat_id=chat_id).on_conflict_do_nothing(index_elements=['chat_id']))
+
+        # Блокируем строку профиля, чтобы параллельные начисления не затирали друг друга
+        profile = (await conn.execute(
+            select(UserProfile.id, UserProfile.level, UserProfile.xp)
+            .where(UserProfile.user_id == user.id, UserProfile.chat_id == chat_id)
+            .with_for_update()
+        )).first()
+        if profile is None:
+            profile = (await conn.execute(
+                pg_insert(UserProfile).values(user_id=user.id, chat_id=chat_id, reputation=0)
+                .returning(UserProfile.id, UserProfile.level, UserProfile.xp)
+            )).first()
+
+        level, xp, leveled_up = apply_xp(profile.level, profile.xp, xp_amount)
+        await conn.execute(update(UserProfile).where(UserProfile.id == profile.id).values(level=level, xp=xp))
+        return level, leveled_up
+
+async def add_message_records(rows: list[dict]):
+    """
+    Записывает пачку сообщений (chat_id, user_id, message_id, timestamp) в одной транзакции.
+    Пользователи и чаты, которых еще нет, создаются пустыми: их заполнит обычный учет.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(
+            pg_insert(User).values([{"user_id": user_id} for user_id in {row["user_id"] for row in rows}])
+            .on_conflict_do_nothing(index_elements=['user_id'])
+        )
+        await conn.execute(
+            pg_insert(Chat).values([{"chat_id": chat_id} for chat_id in {row["chat_id"] for row in rows}])
+            .on_conflict_do_nothing(index_elements=['chat_id'])
+        )
+        await conn.execute(insert(Message).values(rows))
+
+async def iter_user_message_ids(chat_id: int, user_id: int, batch_size: int = 100):
+    """
+    Отдает ID записанных сообщений пользователя в чате пачками по batch_size.
+    Строки читаются курсором по индексу (chat_id, user_id, message_id), а не загружаются списком.
+    """
+    async with engine.connect() as conn:
+        result = await conn.stream(
+            select(Message.message_id)
+            .where(Message.chat_id == chat_id, Message.user_id == user_id, Message.message_id.is_not(None))
+            .order_by(Message.message_id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions(batch_size):
+            yield [row.message_id for row in partition]
+
 async def get_chat_stats(chat_id: int):
     """Собирает статистику по чату."""
     async with engine.connect() as conn:
@@ -306,22 +553,45 @@ async def get_all_notes(chat_id: int):
 # --- Функции для Триггеров (Triggers) ---
 
 async def add_trigger(chat_id: int, keyword: str, response: str) -> bool:
-    """Добавляет или обновляет триггер."""
+    """Добавляет или обновляет триггер. True, если триггер новый."""
     async with engine.connect() as conn:
-        stmt_select = select(Trigger).where(Trigger.chat_id == chat_id, Trigger.keyword == keyword)
-        existing = (await conn.execute(stmt_select)).first()
-        if existing:
-            await conn.execute(update(Trigger).where(Trigger.id == existing.id).values(response=response))
-        else:
-            await conn.execute(pg_insert(Trigger).values(chat_id=chat_id, keyword=keyword, response=response))
+        stmt = (
+            pg_insert(Trigger).values(chat_id=chat_id, keyword=keyword, response=response)
+            .on_conflict_do_update(index_elements=['chat_id', 'keyword'], set_={'response': response})
+            # xmax = 0 только у строки, созданной этим запросом, а не обновленной
+            .returning(literal_column("xmax = 0"))
+        )
+        is_new = (await conn.execute(stmt)).scalar()
+        # Ответ триггера может не влезть в payload NOTIFY (8000 байт), поэтому просто сбрасываем кэш
+        await notify_cache_event(conn, "triggers_changed", chat_id)
         await conn.commit()
-        return not existing
+        return is_new
+
+async def add_triggers(chat_id: int, triggers: dict[str, str]) -> int:
+    """Добавляет много триггеров одним запросом; существующие фразы не меняются. Возвращает число добавленных."""
+    rows = select(
+        literal(chat_id, BigInteger),
+        sql_func.unnest(bindparam("keywords", list(triggers), type_=ARRAY(String))),
+        sql_func.unnest(bindparam("responses", list(triggers.values()), type_=ARRAY(Text))),
+    )
+    stmt = (
+        pg_insert(Trigger).from_select(['chat_id', 'keyword', 'response'], rows)
+        .on_conflict_do_nothing(index_elements=['chat_id', 'keyword'])
+        .returning(Trigger.id)
+    )
+    async with engine.begin() as conn:
+        added = len((await conn.execute(stmt)).all())
+        if added:
+            await notify_cache_event(conn, "triggers_changed", chat_id)
+        return added
 
 async def delete_trigger(chat_id: int, keyword: str) -> bool:
     """Удаляет триггер."""
     async with engine.connect() as conn:
         stmt = delete(Trigger).where(Trigger.chat_id == chat_id, Trigger.keyword == keyword)
         result = await conn.execute(stmt)
+        if result.rowcount > 0:
+            await notify_cache_event(conn, "triggers_changed", chat_id)
         await conn.commit()
         return result.rowcount > 0
 
@@ -338,4 +608,265 @@ async def get_chat_settings(chat_id: int):
         stmt = select(Chat.settings).where(Chat.chat_id == chat_id)
         result = await conn.execute(stmt)
         settings = result.scalar_one_or_none()
-        return settings if settings else {}
\ No newline at end of file
+        return settings if settings else {}
+
+async def get_chat_settings_snapshot(chat_id: int) -> tuple[dict, int]:
+    """Настройки чата вместе с их версией (для чата без записи - пустые и версия 0)."""
+    async with engine.connect() as conn:
+        stmt = select(Chat.settings, Chat.settings_version).where(Chat.chat_id == chat_id)
+        row = (await conn.execute(stmt)).first()
+        return (row.settings or {}, row.settings_version) if row is not None else ({}, 0)
+
+# --- Функции для отложенных действий (Timers) ---
+
+async def add_timer(kind: str, chat_id: int, run_at: datetime, user_id: int | None = None, message_id: int | None = None) -> int:
+    """Сохраняет таймер и возвращает его ID."""
+    async with engine.connect() as conn:
+        stmt = insert(Timer).values(
+            kind=kind, chat_id=chat_id, user_id=user_id, message_id=message_id, run_at=run_at
+        ).returning(Timer.id)
+        timer_id = (await conn.execute(stmt)).scalar_one()
+        await conn.commit()
+        return timer_id
+
+async def delete_timer(timer_id: int):
+    """Удаляет выполненный таймер."""
+    async with engine.connect() as conn:
+        await conn.execute(delete(Timer).where(Timer.id == timer_id))
+        await conn.commit()
+
+async def delete_timers(kind: str, chat_id: int, user_id: int):
+    """Удаляет таймеры указанного типа для пользователя в чате (отмена)."""
+    async with engine.connect() as conn:
+        await conn.execute(delete(Timer).where(
+            Timer.kind == kind, Timer.chat_id == chat_id, Timer.user_id == user_id
+        ))
+        await conn.commit()
+
+async def get_pending_timers(shard_index: int = 0, shard_count: int = 1):
+    """
+    Получает невыполненные таймеры (для восстановления после перезапуска).
+    При шардировании - только таймеры чатов своего шарда (abs(chat_id) % shard_count).
+    """
+    async with engine.connect() as conn:
+        stmt = select(Timer).order_by(Timer.run_at)
+        stmt = _filter_by_shard(stmt, Timer.chat_id, shard_index, shard_count)
+        return (await conn.execute(stmt)).all()
+
+# --- Advisory-блокировки для координации процессов ---
+
+def _lock_key(name: str) -> int:
+    return zlib.crc32(name.encode("utf-8"))
+
+@asynccontextmanager
+async def advisory_lock(name: str):
+    """Выполняет блок, пока ни один другой процесс не держит блокировку name (ждет ее)."""
+    async with engine.connect() as conn:
+        await conn.execute(select(sql_func.pg_advisory_lock(_lock_key(name))))
+        await conn.commit()
+        try:
+            yield
+        finally:
+            await conn.execute(select(sql_func.pg_advisory_unlock(_lock_key(name))))
+            await conn.commit()
+
+async def acquire_singleton_lock(name: str, wait: bool = False):
+    """
+    Захватывает блокировку name на все время жизни процесса. Возвращает соединение,
+    которое держит блокировку (при смерти процесса она освобождается вместе с ним),
+    или None, если блокировку держит другой процесс и wait=False.
+    """
+    conn = await engine.connect()
+    try:
+        if wait:
+            await conn.execute(select(sql_func.pg_advisory_lock(_lock_key(name))))
+            acquired = True
+        else:
+            acquired = (await conn.execute(select(sql_func.pg_try_advisory_lock(_lock_key(name))))).scalar()
+        await conn.commit()
+    except BaseException:
+        await conn.close()
+        raise
+    if not acquired:
+        await conn.close()
+        return None
+    return conn
+
+async def release_singleton_lock(conn, name: str):
+    # Соединение вернется в пул, поэтому блокировку снимаем явно
+    await conn.execute(select(sql_func.pg_advisory_unlock(_lock_key(name))))
+    await conn.commit()
+    await conn.close()
+
+# --- Массовая загрузка для прогрева кэшей при старте ---
+
+def _filter_by_shard(stmt, column, shard_index: int, shard_count: int):
+    # Та же формула, что и shard_for: abs(chat_id) % shard_count
+    if shard_count <= 1:
+        return stmt
+    return stmt.where(sql_func.abs(column) % shard_count == shard_index)
+
+async def get_recently_active_chat_ids(days: int, limit: int, shard_index: int = 0, shard_count: int = 1) -> list[int]:
+    """
+    Возвращает чаты, в которых были сообщения за последние days дней (сначала самые активные недавно).
+    При шардировании - только чаты своего шарда, поэтому limit не расходуется на чужие.
+    """
+    async with engine.connect() as conn:
+        since = datetime.utcnow() - timedelta(days=days)
+        stmt = (
+            select(Message.chat_id)
+            .where(Message.timestamp >= since)
+            .group_by(Message.chat_id)
+            .order_by(sql_func.max(Message.timestamp).desc())
+            .limit(limit)
+        )
+        stmt = _filter_by_shard(stmt, Message.chat_id, shard_index, shard_count)
+        return [row.chat_id for row in (await conn.execute(stmt)).all()]
+
+def _filter_by_chats(stmt, column, chat_ids: list[int] | None):
+    # Один параметр-массив вместо IN (...), чтобы не упереться в лимит параметров asyncpg
+    if chat_ids is None:
+        return stmt
+    return stmt.where(column == any_(bindparam("chat_ids", chat_ids, type_=ARRAY(BigInteger))))
+
+async def iter_chat_settings(chat_ids: list[int] | None = None, limit: int | None = None,
+                             shard_index: int = 0, shard_count: int = 1):
+    """Потоково отдает (chat_id, settings, settings_version) для выбранных чатов (или всех чатов шарда)."""
+    stmt = _filter_by_chats(select(Chat.chat_id, Chat.settings, Chat.settings_version), Chat.chat_id, chat_ids)
+    stmt = _filter_by_shard(stmt, Chat.chat_id, shard_index, shard_count).limit(limit)
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=1000))
+        async for row in result:
+            yield row.chat_id, row.settings or {}, row.settings_version
+
+async def _iter_grouped_by_chat(stmt, add_row, empty):
+    """Потоково читает строки, отсортированные по chat_id, и отдает их сгруппированными по чату."""
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=1000))
+        current_chat_id, group = None, empty()
+        async for row in result:
+            if row.chat_id != current_chat_id:
+                if current_chat_id is not None:
+                    yield current_chat_id, group
+                current_chat_id, group = row.chat_id, empty()
+            add_row(group, row)
+        if current_chat_id is not None:
+            yield current_chat_id, group
+
+async def iter_stop_words_by_chat(chat_ids: list[int] | None = None):
+    """Потоково отдает (chat_id, множество стоп-слов) одним запросом."""
+    stmt = _filter_by_chats(select(StopWord.chat_id, StopWord.word), StopWord.chat_id, chat_ids)
+    async for item in _iter_grouped_by_chat(stmt.order_by(StopWord.chat_id), lambda group, row: group.add(row.word), set):
+        yield item
+
+async def iter_triggers_by_chat(chat_ids: list[int] | None = None):
+    """Потоково отдает (chat_id, словарь триггеров) одним запросом."""
+    stmt = _filter_by_chats(select(Trigger.chat_id, Trigger.keyword, Trigger.response), Trigger.chat_id, chat_ids)
+    def add_trigger_row(group, row):
+        group[row.keyword] = row.response
+    async for item in _iter_grouped_by_chat(stmt.order_by(Trigger.chat_id), add_trigger_row, dict):
+        yield item
+
+# --- Функции для общей капчи рейда ---
+
+async def add_raid_captcha_members(chat_id: int, message_id: int, user_ids: list[int]):
+    """Добавляет вошедших в пачку общей капчи."""
+    async with engine.begin() as conn:
+        await conn.execute(
+            pg_insert(RaidCaptchaMember)
+            .values([{"chat_id": chat_id, "message_id": message_id, "user_id": user_id} for user_id in user_ids])
+            .on_conflict_do_nothing()
+        )
+
+async def verify_raid_captcha_member(chat_id: int, message_id: int, user_id: int) -> bool | None:
+    """
+    Отмечает прохождение общей капчи. True - пользователь ждал этой капчи,
+    False - не ждал (или уже прошел), None - пачка с таким сообщением неизвестна.
+    """
+    batch = (RaidCaptchaMember.chat_id == chat_id) & (RaidCaptchaMember.message_id == message_id)
+    async with engine.begin() as conn:
+        updated = (await conn.execute(
+            update(RaidCaptchaMember)
+            .where(batch, RaidCaptchaMember.user_id == user_id, RaidCaptchaMember.verified.is_(False))
+            .values(verified=True)
+            .returning(RaidCaptchaMember.user_id)
+        )).first()
+        if updated is not None:
+            return True
+        known = (await conn.execute(select(select(RaidCaptchaMember.user_id).where(batch).exists()))).scalar()
+        return False if known else None
+
+async def pop_raid_captcha_batch(chat_id: int, message_id: int) -> list[int] | None:
+    """Удаляет пачку и возвращает тех, кто капчу не прошел (None - пачка неизвестна)."""
+    async with engine.begin() as conn:
+        rows = (await conn.execute(
+            delete(RaidCaptchaMember)
+            .where(RaidCaptchaMember.chat_id == chat_id, RaidCaptchaMember.message_id == message_id)
+            .returning(RaidCaptchaMember.user_id, RaidCaptchaMember.verified)
+        )).all()
+        if not rows:
+            return None
+        return [row.user_id for row in rows if not row.verified]
+
+# --- Общий бан-лист ---
+
+async def add_global_ban(user_id: int, chat_id: int, banned_by: int, reason: str | None = None) -> bool:
+    """Добавляет пользователя в общий бан-лист. False, если он уже там."""
+    async with engine.begin() as conn:
+        inserted = (await conn.execute(
+            pg_insert(GlobalBan)
+            .values(user_id=user_id, reason=reason, banned_by=banned_by, source_chat_id=chat_id)
+            .on_conflict_do_nothing(index_elements=['user_id'])
+            .returning(GlobalBan.id)
+        )).first()
+        if inserted is None:
+            return False
+        await notify_cache_event(conn, "global_ban_added", chat_id, user_id=user_id)
+        return True
+
+async def remove_global_ban(user_id: int) -> bool:
+    # Фильтры Блума не умеют удалять: снятый бан останется ложным срабатыванием, которое отсеет проверка в БД
+    async with engine.begin() as conn:
+        result = await conn.execute(delete(GlobalBan).where(GlobalBan.user_id == user_id))
+        return result.rowcount > 0
+
+async def get_global_banned(user_ids: list[int]) -> set[int]:
+    """Какие из user_ids есть в общем бан-листе (один запрос по уникальному индексу)."""
+    async with engine.connect() as conn:
+        stmt = select(GlobalBan.user_id).where(
+            GlobalBan.user_id == any_(bindparam("user_ids", user_ids, type_=ARRAY(BigInteger)))
+        )
+        return {row.user_id for row in (await conn.execute(stmt)).all()}
+
+async def iter_global_bans(after_id: int = 0):
+    """Потоково отдает (id, user_id) записей бан-листа, добавленных после after_id."""
+    stmt = select(GlobalBan.id, GlobalBan.user_id).where(GlobalBan.id > after_id).order_by(GlobalBan.id)
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=1000))
+        async for row in result:
+            yield row.id, row.user_id
+
+# --- Журнал модерации ---
+
+async def add_moderation_events(events: list[dict]):
+    """Записывает пачку событий модерации одним многострочным INSERT."""
+    async with engine.begin() as conn:
+        await conn.execute(insert(ModerationEvent).values(events))
+
+async def get_moderation_events(chat_id: int, target_id: int | None = None,
+                                before: tuple[datetime, int] | None = None, limit: int = 10):
+    """
+    Страница журнала модерации чата (или пользователя в чате), от новых к старым.
+    before - (created_at, id) последней записи предыдущей страницы: поиск по ключу в индексе вместо OFFSET.
+    """
+    stmt = select(ModerationEvent).where(ModerationEvent.chat_id == chat_id)
+    if target_id is not None:
+        stmt = stmt.where(ModerationEvent.target_id == target_id)
+    if before is not None:
+        before_at, before_id = before
+        stmt = stmt.where(tuple_(ModerationEvent.created_at, ModerationEvent.id) < tuple_(
+            literal(before_at, ModerationEvent.created_at.type), literal(before_id, BigInteger)
+        ))
+    stmt = stmt.order_by(ModerationEvent.created_at.desc(), ModerationEvent.id.desc()).limit(limit)
+    async with engine.connect() as conn:
+        return (await conn.execute(stmt)).all()
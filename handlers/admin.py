@@ -2,52 +2,60 @@
 
 import html
 import logging # <-- ДОБАВЛЕН ИМПОРТ
-from datetime import timedelta
-from aiogram import Router, Bot, types
-from aiogram.filters import Command
+from datetime import datetime, timedelta, timezone
+from aiogram import Router, Bot, types, F
+from aiogram.filters import Command, CommandObject
 from aiogram.enums import ChatMemberStatus
 from aiogram.utils.markdown import hbold
-from aiogram.types import ChatPermissions
+from aiogram.types import ChatPermissions, InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from db.requests import (
-    update_chat_setting, add_warning, count_warnings, get_chat_settings, 
+    update_chat_setting, count_warnings,
     remove_last_warning, clear_warnings, add_stop_word, delete_stop_word, 
-    get_stop_words, get_or_create_user_profile, count_user_messages
+    get_stop_words, get_or_create_user_profile, count_user_messages, iter_user_message_ids,
+    add_global_ban, remove_global_ban, get_moderation_events
 )
 from utils.time_parser import parse_time
-from .callbacks import get_main_settings_keyboard
-from .utils import is_admin 
-from .filters import stop_words_cache
+from utils.timers import timers, TimerEntry
+from utils.outbound import outbound_priority, Priority
+from utils.audit import audit_log
+from .callbacks import get_main_settings_keyboard, import_stop_words_file, import_triggers_file
+from .utils import is_admin, is_user_admin_silent, process_warning
+from .filters import stop_words_cache, settings_cache, get_cached_chat_settings
 router = Router()
 
-# --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
+# deleteMessages принимает не больше 100 ID за вызов
+PURGE_BATCH_SIZE = 100
+# Наибольший диапазон ID для /purge <от> <до>
+PURGE_MAX_RANGE = 10_000
+
+MODLOG_PAGE_SIZE = 10
+MODLOG_ACTIONS = {
+    "warn": "⚠️ Варн", "unwarn": "✅ Снят варн", "clearwarns": "🗑 Очищены варны",
+    "mute": "🔇 Мут", "unmute": "🔊 Размут", "ban": "🚫 Бан", "unban": "✅ Разбан", "kick": "👢 Кик",
+    "gban": "🌐 Общий бан", "ungban": "🌐 Снят общий бан", "purge": "🧹 Очистка", "delete": "🗑 Удаление",
+}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# --- ОТЛОЖЕННОЕ СНЯТИЕ ОГРАНИЧЕНИЙ ---
+# Telegram сам снимает ограничения по until_date, но сроки меньше 30 секунд
+# и больше 366 дней считает вечными. Таймер снимает их явно и точно в срок.
+
+@timers.handler("unmute")
+async def timer_unmute(bot: Bot, timer: TimerEntry):
+    await bot.restrict_chat_member(
+        chat_id=timer.chat_id,
+        user_id=timer.user_id,
+        permissions=ChatPermissions(
+            can_send_messages=True, can_send_media_messages=True,
+            can_send_other_messages=True, can_add_web_page_previews=True
+        )
+    )
 
-async def process_warning(message: types.Message, user_to_warn: types.User, bot: Bot, log_action_func: callable):
-    """Общая функция для выдачи варна и проверки на бан."""
-    chat_id = message.chat.id
-    user_id = user_to_warn.id
-    
-    await add_warning(user_id, chat_id)
-    warnings_count = await count_warnings(user_id, chat_id)
-    
-    settings = await get_chat_settings(chat_id)
-    warn_limit = settings.get('warn_limit', 3)
-    
-    admin_mention = message.from_user.mention_html()
-    user_mention = user_to_warn.mention_html()
-
-    if warnings_count >= warn_limit:
-        try:
-            await bot.ban_chat_member(chat_id, user_id, until_date=timedelta(days=1))
-            await message.answer(f"🚫 Пользователь {user_mention} получил {warnings_count} предупреждение и забанен на 1 день.", parse_mode="HTML")
-            log_text = (f"🚫 <b>Авто-бан</b>\n<b>Админ:</b> {admin_mention}\n<b>Пользователь:</b> {user_mention} (<code>{user_id}</code>)\n<b>Причина:</b> Достигнут лимит предупреждений ({warnings_count}/{warn_limit})")
-            await log_action_func(chat_id, log_text, bot)
-        except Exception as e:
-            await message.answer(f"Не удалось забанить пользователя {user_mention}. Возможно, у меня недостаточно прав.", parse_mode="HTML")
-    else:
-        await message.answer(f"⚠️ Пользователю {user_mention} вынесено предупреждение ({warnings_count}/{warn_limit}).", parse_mode="HTML")
-        log_text = (f"⚠️ <b>Предупреждение</b>\n<b>Админ:</b> {admin_mention}\n<b>Пользователь:</b> {user_mention} (<code>{user_id}</code>)\n<b>Счетчик:</b> {warnings_count}/{warn_limit}")
-        await log_action_func(chat_id, log_text, bot)
+@timers.handler("unban")
+async def timer_unban(bot: Bot, timer: TimerEntry):
+    await bot.unban_chat_member(chat_id=timer.chat_id, user_id=timer.user_id, only_if_banned=True)
 
 # --- КОМАНДЫ ---
 
@@ -74,12 +82,14 @@ async def cmd_set_log_channel(message: types.Message, bot: Bot, log_action: call
         await bot.send_message(channel_id, "Канал для логов успешно подключен.")
         
         await update_chat_setting(message.chat.id, 'log_channel_id', channel_id)
+        # Не ждем NOTIFY: лог ниже уже должен уйти в новый канал
+        settings_cache.pop(message.chat.id, None)
         await message.answer("✅ Канал для логов успешно установлен.")
         
         log_text = (f"⚙️ <b>Установлен канал для логов</b>\n"
                     f"<b>Админ:</b> {message.from_user.mention_html()}\n"
                     f"<b>ID канала:</b> <code>{channel_id}</code>")
-        await log_action(message.chat.id, log_text, bot)
+        await log_action(message.chat.id, log_text, bot, urgent=True)
 
     except (IndexError, ValueError):
         await message.answer("Неверный формат. Используйте: /set_log_channel <ID канала>\nID канала должен быть отрицательным числом, например, -100123456789.")
@@ -104,8 +114,10 @@ async def cmd_unwarn(message: types.Message, bot: Bot, log_action: callable):
 
     user_to_unwarn = message.reply_to_message.from_user
     if await remove_last_warning(user_to_unwarn.id, message.chat.id):
-        warnings_count = await count_warnings(user_to_unwarn.id, message.chat.id)
+        settings = await get_cached_chat_settings(message.chat.id)
+        warnings_count = await count_warnings(user_to_unwarn.id, message.chat.id, settings.get('warn_ttl_days', 0))
         await message.answer(f"✅ Последнее предупреждение для {user_to_unwarn.mention_html()} снято. Текущее количество: {warnings_count}.", parse_mode="HTML")
+        audit_log.record(message.chat.id, "unwarn", user_to_unwarn.id, message.from_user.id)
         
         log_text = (f"✅ <b>Снято предупреждение</b>\n"
                     f"<b>Админ:</b> {message.from_user.mention_html()}\n"
@@ -123,6 +135,7 @@ async def cmd_clearwarns(message: types.Message, bot: Bot, log_action: callable)
 
     target_user = message.reply_to_message.from_user
     await clear_warnings(target_user.id, message.chat.id)
+    audit_log.record(message.chat.id, "clearwarns", target_user.id, message.from_user.id)
     await message.answer(f"✅ Все предупреждения для пользователя {target_user.mention_html()} были очищены.", parse_mode="HTML")
 
     log_text = (f"🗑 <b>Очищены предупреждения</b>\n"
@@ -149,6 +162,9 @@ async def cmd_mute(message: types.Message, bot: Bot, log_action: callable):
             permissions=ChatPermissions(can_send_messages=False),
             until_date=duration
         )
+        await timers.cancel("unmute", message.chat.id, user_to_mute.id)
+        await timers.schedule("unmute", duration.total_seconds(), message.chat.id, user_id=user_to_mute.id)
+        audit_log.record(message.chat.id, "mute", user_to_mute.id, message.from_user.id, duration=duration)
         await message.answer(f"🔇 Пользователь {user_to_mute.mention_html()} замучен на {time_str}.", parse_mode="HTML")
 
         log_text = (f"🔇 <b>Мут</b>\n"
@@ -177,6 +193,8 @@ async def cmd_unmute(message: types.Message, bot: Bot, log_action: callable):
             can_send_other_messages=True, can_add_web_page_previews=True
         )
     )
+    await timers.cancel("unmute", message.chat.id, user_to_unmute.id)
+    audit_log.record(message.chat.id, "unmute", user_to_unmute.id, message.from_user.id)
     await message.answer(f"🔊 Пользователь {user_to_unmute.mention_html()} размучен.", parse_mode="HTML")
 
     log_text = (f"🔊 <b>Размут</b>\n"
@@ -203,6 +221,9 @@ async def cmd_ban(message: types.Message, bot: Bot, log_action: callable):
             return await message.reply("Неверный формат времени.")
         
         await bot.ban_chat_member(message.chat.id, user_to_ban.id, until_date=duration)
+        await timers.cancel("unban", message.chat.id, user_to_ban.id)
+        await timers.schedule("unban", duration.total_seconds(), message.chat.id, user_id=user_to_ban.id)
+        audit_log.record(message.chat.id, "ban", user_to_ban.id, message.from_user.id, reason, duration)
         await message.answer(
             f"🚫 Пользователь {user_to_ban.mention_html()} забанен.\n"
             f"<b>Срок:</b> {time_str}\n"
@@ -214,7 +235,7 @@ async def cmd_ban(message: types.Message, bot: Bot, log_action: callable):
                     f"<b>Пользователь:</b> {user_to_ban.mention_html()} (<code>{user_to_ban.id}</code>)\n"
                     f"<b>Срок:</b> {time_str}\n"
                     f"<b>Причина:</b> {html.escape(reason)}")
-        await log_action(message.chat.id, log_text, bot)
+        await log_action(message.chat.id, log_text, bot, urgent=True)
 
         await message.delete()
         await message.reply_to_message.delete()
@@ -229,6 +250,8 @@ async def cmd_unban(message: types.Message, bot: Bot, log_action: callable):
     try:
         user_to_unban = message.reply_to_message.from_user
         await bot.unban_chat_member(chat_id=message.chat.id, user_id=user_to_unban.id)
+        await timers.cancel("unban", message.chat.id, user_to_unban.id)
+        audit_log.record(message.chat.id, "unban", user_to_unban.id, message.from_user.id)
         await message.answer(f"✅ Пользователь {user_to_unban.mention_html()} успешно разбанен.", parse_mode="HTML")
         
         log_text = (f"✅ <b>Ручной разбан</b>\n"
@@ -240,15 +263,122 @@ async def cmd_unban(message: types.Message, bot: Bot, log_action: callable):
     except Exception as e:
         await message.reply("Не удалось разбанить пользователя.")
 
+@router.message(Command("gban"))
+async def cmd_gban(message: types.Message, bot: Bot, log_action: callable):
+    """Бан в этом чате и внесение в общий бан-лист (доступно в чатах, участвующих в нем)."""
+    if not await is_admin(message, bot): return
+    if not message.reply_to_message:
+        return await message.reply("Эта команда должна быть ответом на сообщение.")
+    settings = await get_cached_chat_settings(message.chat.id)
+    if not settings.get('federation_enabled', False):
+        return await message.reply("Общий бан-лист выключен для этого чата. Включите его в настройках антиспама.")
+
+    user_to_ban = message.reply_to_message.from_user
+    reason = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else "без указания причины"
+    try:
+        await bot.ban_chat_member(message.chat.id, user_to_ban.id)
+    except Exception as e:
+        logging.error(f"Не удалось забанить {user_to_ban.id} по /gban: {e}")
+    if not await add_global_ban(user_to_ban.id, message.chat.id, message.from_user.id, reason):
+        return await message.reply("Пользователь уже в общем бан-листе.")
+    audit_log.record(message.chat.id, "gban", user_to_ban.id, message.from_user.id, reason)
+
+    await message.answer(
+        f"🌐 Пользователь {user_to_ban.mention_html()} забанен и внесен в общий бан-лист.\n"
+        f"<b>Причина:</b> {html.escape(reason)}",
+        parse_mode="HTML"
+    )
+    log_text = (f"🌐 <b>Общий бан</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Пользователь:</b> {user_to_ban.mention_html()} (<code>{user_to_ban.id}</code>)\n"
+                f"<b>Причина:</b> {html.escape(reason)}")
+    await log_action(message.chat.id, log_text, bot, urgent=True)
+
+@router.message(Command("ungban"))
+async def cmd_ungban(message: types.Message, bot: Bot, log_action: callable):
+    """Убирает пользователя из общего бан-листа: ответом на сообщение или /ungban <ID>."""
+    if not await is_admin(message, bot): return
+    settings = await get_cached_chat_settings(message.chat.id)
+    if not settings.get('federation_enabled', False):
+        return await message.reply("Общий бан-лист выключен для этого чата.")
+    args = message.text.split()
+    if message.reply_to_message:
+        user_id = message.reply_to_message.from_user.id
+    elif len(args) > 1 and args[1].isdigit():
+        user_id = int(args[1])
+    else:
+        return await message.reply("Используйте /ungban ответом на сообщение или /ungban <ID пользователя>.")
+
+    if not await remove_global_ban(user_id):
+        return await message.reply("Этого пользователя нет в общем бан-листе.")
+    audit_log.record(message.chat.id, "ungban", user_id, message.from_user.id)
+    await message.answer(f"✅ Пользователь <code>{user_id}</code> убран из общего бан-листа.", parse_mode="HTML")
+    log_text = (f"✅ <b>Снят общий бан</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Пользователь:</b> <code>{user_id}</code>")
+    await log_action(message.chat.id, log_text, bot)
+
+async def id_range_batches(first: int, last: int):
+    for start in range(first, last + 1, PURGE_BATCH_SIZE):
+        yield list(range(start, min(start + PURGE_BATCH_SIZE, last + 1)))
+
+@router.message(Command("purge"))
+async def cmd_purge(message: types.Message, bot: Bot, log_action: callable):
+    """
+    /purge ответом на сообщение - удаляет все записанные сообщения автора;
+    /purge <от> <до> - удаляет сообщения чата с ID в диапазоне.
+    """
+    if not await is_admin(message, bot): return
+    args = message.text.split()[1:]
+    chat_id = message.chat.id
+    if len(args) == 2 and all(arg.isdigit() for arg in args):
+        first, last = sorted(map(int, args))
+        if last - first + 1 > PURGE_MAX_RANGE:
+            return await message.reply(f"Можно удалить не больше {PURGE_MAX_RANGE} сообщений за раз.")
+        batches = id_range_batches(first, last)
+        target = f"сообщения с ID {first}-{last}"
+        target_id = None
+    elif message.reply_to_message and not args:
+        user = message.reply_to_message.from_user
+        batches = iter_user_message_ids(chat_id, user.id, PURGE_BATCH_SIZE)
+        target = f"сообщения {user.mention_html()} (<code>{user.id}</code>)"
+        target_id = user.id
+    else:
+        return await message.reply("Используйте /purge ответом на сообщение пользователя или /purge <от ID> <до ID>.")
+
+    total = calls = failed = 0
+    # Массовое удаление идет в общем лимите запросов и не задерживает ответы пользователям
+    with outbound_priority(Priority.LOW):
+        async for message_ids in batches:
+            calls += 1
+            total += len(message_ids)
+            try:
+                await bot.delete_messages(chat_id, message_ids)
+            except Exception as e:
+                failed += 1
+                logging.warning(f"Не удалось удалить пачку сообщений в чате {chat_id}: {e}")
+
+    audit_log.record(chat_id, "purge", target_id, message.from_user.id, f"{total} ID")
+    try:
+        await message.delete()
+    except Exception:
+        pass
+    await message.answer(f"🧹 Удалены {target}: {total} ID за {calls} запросов.", parse_mode="HTML")
+    log_text = (f"🧹 <b>Очистка сообщений</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Удалены:</b> {target}\n"
+                f"<b>ID:</b> {total}, запросов: {calls}, с ошибкой: {failed}")
+    await log_action(chat_id, log_text, bot)
+
 @router.message(Command("add_word"))
 async def cmd_add_word(message: types.Message, bot: Bot, log_action: callable):
     if not await is_admin(message, bot): return
     try:
         word = message.text.split(maxsplit=1)[1].lower()
         if await add_stop_word(message.chat.id, word):
-            if message.chat.id not in stop_words_cache:
-                stop_words_cache[message.chat.id] = set()
-            stop_words_cache[message.chat.id].add(word)
+            # Если кэша еще нет, он целиком загрузится из БД при первом сообщении
+            if message.chat.id in stop_words_cache:
+                stop_words_cache[message.chat.id] = stop_words_cache[message.chat.id] | {word}
 
             await message.answer(f"✅ Слово {hbold(word)} добавлено в черный список.", parse_mode="HTML")
             log_text = (f"➕ <b>Добавлено стоп-слово</b>\n"
@@ -267,7 +397,7 @@ async def cmd_del_word(message: types.Message, bot: Bot, log_action: callable):
         word = message.text.split(maxsplit=1)[1].lower()
         if await delete_stop_word(message.chat.id, word):
             if message.chat.id in stop_words_cache:
-                stop_words_cache[message.chat.id].discard(word)
+                stop_words_cache[message.chat.id] = stop_words_cache[message.chat.id] - {word}
 
             await message.answer(f"✅ Слово {hbold(word)} удалено из черного списка.", parse_mode="HTML")
             log_text = (f"➖ <b>Удалено стоп-слово</b>\n"
@@ -279,6 +409,22 @@ async def cmd_del_word(message: types.Message, bot: Bot, log_action: callable):
     except IndexError:
         await message.answer("Неверный формат.")
 
+@router.message(Command("import_words", "import_triggers"))
+async def cmd_import(message: types.Message, bot: Bot, log_action: callable, command: CommandObject):
+    """
+    Импорт из файла: документ с подписью /import_words (по слову в строке)
+    или /import_triggers (CSV «фраза,ответ»), либо команда ответом на такой документ.
+    """
+    if not await is_admin(message, bot): return
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if not document:
+        return await message.reply("Отправьте файл .txt или .csv с этой командой в подписи или ответьте командой на файл.")
+    if command.command == "import_words":
+        text = await import_stop_words_file(message, document, bot, log_action)
+    else:
+        text = await import_triggers_file(message, document, bot, log_action)
+    await message.reply(text)
+
 @router.message(Command("list_words"))
 async def cmd_list_words(message: types.Message, bot: Bot):
     if not await is_admin(message, bot): return
@@ -297,7 +443,9 @@ async def cmd_info(message: types.Message, bot: Bot):
     target_user = message.reply_to_message.from_user
     chat_id = message.chat.id
     profile = await get_or_create_user_profile(target_user.id, chat_id)
-    warnings_count = await count_warnings(target_user.id, chat_id)
+    settings = await get_cached_chat_settings(chat_id)
+    # Только действующие варны; подсчет идет по индексу (chat_id, user_id, created_at)
+    warnings_count = await count_warnings(target_user.id, chat_id, settings.get('warn_ttl_days', 0))
     message_count = await count_user_messages(target_user.id, chat_id)
     text = [
         f"👤 <b>Информация о пользователе:</b> {target_user.mention_html()}",
@@ -307,3 +455,58 @@ async def cmd_info(message: types.Message, bot: Bot):
         f"<b>Всего сообщений:</b> {message_count}"
     ]
     await message.answer("\n".join(text), parse_mode="HTML")
+
+# --- ЖУРНАЛ МОДЕРАЦИИ ---
+
+def format_modlog_page(events) -> str:
+    lines = []
+    for event in events:
+        line = (f"<code>{event.created_at:%d.%m %H:%M}</code> {MODLOG_ACTIONS.get(event.action, event.action)}"
+                f" <code>{event.target_id}</code>")
+        line += f", админ <code>{event.actor_id}</code>" if event.actor_id is not None else ", автоматически"
+        if event.duration_seconds:
+            line += f", срок {timedelta(seconds=event.duration_seconds)}"
+        if event.reason:
+            line += f"\n    {html.escape(event.reason)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+async def render_modlog(chat_id: int, target_id: int | None, before: tuple[datetime, int] | None = None):
+    """Страница журнала и клавиатура перехода к следующей (более старой) странице."""
+    events = await get_moderation_events(chat_id, target_id, before, MODLOG_PAGE_SIZE)
+    title = "📜 <b>Журнал модерации</b>" + (f" для <code>{target_id}</code>" if target_id else "")
+    if not events:
+        return f"{title}\n\nЗаписей нет.", None
+    builder = InlineKeyboardBuilder()
+    if before is not None:
+        builder.add(InlineKeyboardButton(text="⏮ В начало", callback_data=f"modlog:{target_id or 0}:0:0"))
+    if len(events) == MODLOG_PAGE_SIZE:
+        # Ключ последней записи страницы: следующая страница начинается сразу после нее
+        last = events[-1]
+        cursor = (last.created_at - _EPOCH) // timedelta(microseconds=1)
+        builder.add(InlineKeyboardButton(text="Далее ▶️", callback_data=f"modlog:{target_id or 0}:{cursor}:{last.id}"))
+    return f"{title}\n\n{format_modlog_page(events)}", builder.as_markup()
+
+@router.message(Command("modlog"))
+async def cmd_modlog(message: types.Message, bot: Bot):
+    """/modlog - журнал чата; ответом на сообщение или /modlog <ID> - журнал пользователя."""
+    if not await is_admin(message, bot): return
+    args = message.text.split()
+    target_id = None
+    if message.reply_to_message:
+        target_id = message.reply_to_message.from_user.id
+    elif len(args) > 1 and args[1].isdigit():
+        target_id = int(args[1])
+    text, keyboard = await render_modlog(message.chat.id, target_id)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("modlog:"))
+async def callback_modlog_page(callback: types.CallbackQuery, bot: Bot):
+    if not await is_user_admin_silent(callback.message.chat, callback.from_user.id, bot):
+        return await callback.answer("Журнал доступен только администраторам.", show_alert=True)
+    _, target, cursor, event_id = callback.data.split(":")
+    before = (_EPOCH + timedelta(microseconds=int(cursor)), int(event_id)) if int(cursor) else None
+    text, keyboard = await render_modlog(callback.message.chat.id, int(target) or None, before)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
@@ -1,43 +1,69 @@
 import html
 import logging
-import asyncio
+import functools
 from aiogram import Router, F, types, Bot
-from aiogram.enums import ChatMemberStatus
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.utils.markdown import hbold
 
 from db.requests import (
-    get_chat_settings, update_chat_setting, get_stop_words, 
+    update_chat_settings, toggle_chat_setting,
     add_stop_word, delete_stop_word, get_all_notes, add_note, delete_note,
-    get_all_triggers, add_trigger, delete_trigger
+    add_trigger, delete_trigger, add_stop_words, add_triggers
 )
 from states import SettingsStates
+from utils.templates import render_template, PLACEHOLDERS_HELP
+from utils.timers import timers
+from utils.state_backend import state_backend
+from utils.raid import raid_guard
+from utils.bulk_import import iter_document_lines, parse_stop_words, parse_triggers, BulkImportError
+from middlewares.antiflood import get_antiflood_config
+from utils.cache import BoundedCache
 from .filters import stop_words_cache, triggers_cache
 
 router = Router()
 
 # ИСПРАВЛЕНИЕ: Импортируем оба кэша из filters.py
 from .filters import stop_words_cache, triggers_cache
+from .filters import (
+    get_settings_snapshot, get_cached_chat_settings, apply_settings_change,
+    get_cached_stop_words, get_cached_triggers
+)
+from .utils import is_user_admin_cached
 
 router = Router()
 
-VERIFIED_USERS = {}
+# Отрисованные меню настроек: (чат, меню, версия настроек) -> (текст, клавиатура)
+menu_cache = BoundedCache("settings_menus", max_items=10_000, max_bytes=16 * 1024 * 1024)
 
 
 # --- ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ ДЛЯ АВТО-УДАЛЕНИЯ ---
 async def delete_message_after_delay(message: types.Message, delay: int):
-    """Запускает таймер и удаляет сообщение после задержки."""
-    await asyncio.sleep(delay)
-    try:
-        await message.delete()
-    except Exception:
-        pass # Игнорируем ошибки, если сообщение уже было удалено
+    """Планирует удаление сообщения через общий планировщик таймеров."""
+    await timers.schedule("delete_message", delay, message.chat.id, message_id=message.message_id)
 # --- ФАБРИКИ КЛАВИАТУР (Создатели меню) ---
 
-async def get_main_settings_keyboard(chat_id: int) -> InlineKeyboardMarkup:
-    """Создает новое главное меню настроек."""
+def settings_menu(name: str):
+    """
+    Меню, которое строится только из настроек чата. Рендер получает снимок настроек из кэша,
+    а готовые текст и клавиатура запоминаются по (чат, меню, версия настроек):
+    повторные нажатия не ходят в БД и не собирают клавиатуру заново.
+    """
+    def decorator(render):
+        @functools.wraps(render)
+        async def wrapper(chat_id: int):
+            settings, version = await get_settings_snapshot(chat_id)
+            key = (chat_id, name, version)
+            menu = menu_cache.get(key)
+            if menu is None:
+                menu = menu_cache[key] = render(settings)
+            return menu
+        return wrapper
+    return decorator
+
+
+def _build_main_settings_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
         InlineKeyboardButton(text="📜 Правила", callback_data="menu:rules"),
@@ -61,8 +87,7 @@ async def get_main_settings_keyboard(chat_id: int) -> InlineKeyboardMarkup:
     )
     return builder.as_markup()
 
-async def get_content_settings_keyboard() -> InlineKeyboardMarkup:
-    """Создает меню настроек контента."""
+def _build_content_settings_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
         InlineKeyboardButton(text="🚫 Стоп-слова", callback_data="menu:stopwords"),
@@ -72,9 +97,21 @@ async def get_content_settings_keyboard() -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
     return builder.as_markup()
 
-async def get_rules_menu(chat_id: int):
+# Клавиатуры без данных чата собираются один раз
+MAIN_SETTINGS_KEYBOARD = _build_main_settings_keyboard()
+CONTENT_SETTINGS_KEYBOARD = _build_content_settings_keyboard()
+
+async def get_main_settings_keyboard(chat_id: int) -> InlineKeyboardMarkup:
+    """Главное меню настроек."""
+    return MAIN_SETTINGS_KEYBOARD
+
+async def get_content_settings_keyboard() -> InlineKeyboardMarkup:
+    """Меню настроек контента."""
+    return CONTENT_SETTINGS_KEYBOARD
+
+@settings_menu("rules")
+def get_rules_menu(settings: dict):
     """Создает меню для управления правилами."""
-    settings = await get_chat_settings(chat_id)
     rules_text = settings.get('rules_text', 'Правила еще не установлены.')
     text = (f"📜 **Управление правилами**\n\nТекущие правила:\n<i>{html.escape(rules_text)}</i>")
     builder = InlineKeyboardBuilder()
@@ -82,41 +119,48 @@ async def get_rules_menu(chat_id: int):
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
     return text, builder.as_markup()
 
-async def get_welcome_menu(chat_id: int):
+@settings_menu("welcome")
+def get_welcome_menu(settings: dict):
     """Создает меню для управления приветствием."""
-    settings = await get_chat_settings(chat_id)
     welcome_text = settings.get('welcome_message', "Добро пожаловать, {user_mention}!")
     text = (f"👋 **Управление приветствием**\n\nТекущее сообщение:\n<code>{html.escape(welcome_text)}</code>\n\n"
-            "Используйте <code>{user_mention}</code> для упоминания пользователя.")
+            f"{PLACEHOLDERS_HELP}")
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="✏️ Изменить текст", callback_data="action:change_welcome"))
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
     return text, builder.as_markup()
 
-async def get_goodbye_menu(chat_id: int):
+@settings_menu("goodbye")
+def get_goodbye_menu(settings: dict):
     """Создает меню для управления прощанием."""
-    settings = await get_chat_settings(chat_id)
     goodbye_text = settings.get('goodbye_message', "Пользователь {user_mention} покинул чат.")
     text = (f"🚪 **Управление прощанием**\n\nТекущее сообщение:\n<code>{html.escape(goodbye_text)}</code>\n\n"
-            "Используйте <code>{user_mention}</code> для упоминания пользователя.")
+            f"{PLACEHOLDERS_HELP}")
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="✏️ Изменить текст", callback_data="action:change_goodbye"))
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
     return text, builder.as_markup()
 
-async def get_antispam_menu(chat_id: int):
+@settings_menu("antispam")
+def get_antispam_menu(settings: dict):
     """Создает меню для настроек антиспама."""
-    settings = await get_chat_settings(chat_id)
     antilink_status = "✅ Включена" if settings.get('antilink_enabled', False) else "❌ Выключена"
+    antidup_status = "✅ Включена" if settings.get('antidup_enabled', False) else "❌ Выключена"
+    antiraid_status = "✅ Включена" if settings.get('antiraid_enabled', True) else "❌ Выключена"
+    federation_status = "✅ Включен" if settings.get('federation_enabled', False) else "❌ Выключен"
     text = "🛡️ **Настройки антиспама**"
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text=f"Защита от ссылок: {antilink_status}", callback_data="action:toggle_antilink"))
+    builder.add(InlineKeyboardButton(text=f"Защита от рассылок: {antidup_status}", callback_data="action:toggle_antidup"))
+    builder.add(InlineKeyboardButton(text=f"Защита от рейдов: {antiraid_status}", callback_data="action:toggle_antiraid"))
+    builder.add(InlineKeyboardButton(text=f"Общий бан-лист: {federation_status}", callback_data="action:toggle_federation"))
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
+    builder.adjust(1)
     return text, builder.as_markup()
 
-async def get_captcha_menu(chat_id: int):
+@settings_menu("captcha")
+def get_captcha_menu(settings: dict):
     """Создает меню для настроек капчи."""
-    settings = await get_chat_settings(chat_id)
     captcha_status = "✅ Включена" if settings.get('captcha_enabled', False) else "❌ Выключена"
     captcha_timeout = settings.get('captcha_timeout', 60)
     text = "🧠 **Настройки CAPTCHA**"
@@ -127,18 +171,37 @@ async def get_captcha_menu(chat_id: int):
     builder.adjust(1)
     return text, builder.as_markup()
 
-async def get_warns_menu(chat_id: int):
+@settings_menu("antiflood")
+def get_antiflood_menu(settings: dict):
+    """Создает меню для настроек антифлуда."""
+    enabled, msg_limit, time_limit, mute_minutes = get_antiflood_config(settings)
+    status = "✅ Включен" if enabled else "❌ Выключен"
+    text = (f"🌊 **Настройки антифлуда**\n\n"
+            f"Пользователь, отправивший <b>{msg_limit}</b> сообщений за <b>{time_limit}</b> сек., "
+            f"получает мут на <b>{mute_minutes}</b> мин.")
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text=f"Антифлуд: {status}", callback_data="action:toggle_antiflood"))
+    builder.add(InlineKeyboardButton(text=f"Лимит: {msg_limit} сообщ. / {time_limit} сек.", callback_data="action:change_antiflood_limit"))
+    builder.add(InlineKeyboardButton(text=f"Мут: {mute_minutes} мин.", callback_data="action:change_antiflood_mute"))
+    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
+    builder.adjust(1)
+    return text, builder.as_markup()
+
+@settings_menu("warns")
+def get_warns_menu(settings: dict):
     """Создает меню для настроек предупреждений."""
-    settings = await get_chat_settings(chat_id)
     warn_limit = settings.get('warn_limit', 3)
-    text = f"❗️ **Настройки предупреждений**\n\nТекущий лимит варнов до бана: <b>{warn_limit}</b>"
+    warn_ttl_days = settings.get('warn_ttl_days', 0)
+    ttl_text = f"{warn_ttl_days} дн." if warn_ttl_days else "бессрочно"
+    text = (f"❗️ **Настройки предупреждений**\n\nТекущий лимит варнов до бана: <b>{warn_limit}</b>\n"
+            f"Срок действия варна: <b>{ttl_text}</b>")
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="✏️ Изменить лимит", callback_data="action:change_warn_limit"))
+    builder.add(InlineKeyboardButton(text="⏳ Изменить срок действия", callback_data="action:change_warn_ttl"))
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
     return text, builder.as_markup()
 
-async def get_blocks_menu():
-    """Создает информационное меню для блокировок."""
+def _build_blocks_menu():
     text = (
         "🚫 **Управление блокировками**\n\n"
         "Для управления блокировками используйте следующие команды в ответ на сообщение пользователя:\n\n"
@@ -151,6 +214,12 @@ async def get_blocks_menu():
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="menu:main"))
     return text, builder.as_markup()
 
+BLOCKS_MENU = _build_blocks_menu()
+
+async def get_blocks_menu():
+    """Информационное меню для блокировок."""
+    return BLOCKS_MENU
+
 async def get_notes_menu(chat_id: int):
     notes = await get_all_notes(chat_id)
     text = "🗒️ **Управление заметками**\n\nТекущий список:\n"
@@ -168,10 +237,10 @@ async def get_notes_menu(chat_id: int):
     return text, builder.as_markup()
 
 async def get_triggers_menu(chat_id: int):
-    triggers = await get_all_triggers(chat_id)
+    triggers = await get_cached_triggers(chat_id)
     text = "🤖 **Управление триггерами**\n\nТекущий список:\n"
     if triggers:
-        text += "\n".join(f"• <code>{html.escape(keyword)}</code>" for keyword in triggers)
+        text += "\n".join(f"• <code>{html.escape(keyword)}</code>" for keyword in sorted(triggers))
     else:
         text += "Список пуст."
     
@@ -185,10 +254,10 @@ async def get_triggers_menu(chat_id: int):
 
 async def get_stopwords_menu(chat_id: int):
     """Создает текст и клавиатуру для меню стоп-слов."""
-    words = await get_stop_words(chat_id)
+    words = await get_cached_stop_words(chat_id)
     text = "🚫 **Управление стоп-словами**\n\nТекущий список:\n"
     if words:
-        text += "\n".join(f"• <code>{html.escape(word)}</code>" for word in words)
+        text += "\n".join(f"• <code>{html.escape(word)}</code>" for word in sorted(words))
     else:
         text += "Список пуст."
     
@@ -203,7 +272,7 @@ async def get_stopwords_menu(chat_id: int):
 
 async def get_moderation_settings_keyboard(chat_id: int) -> InlineKeyboardMarkup:
     """Создает меню настроек модерации (объединяет антиспам, капчу и варны)."""
-    settings = await get_chat_settings(chat_id)
+    settings = await get_cached_chat_settings(chat_id)
     antilink_status = "✅ Включена" if settings.get('antilink_enabled', False) else "❌ Выключена"
     captcha_status = "✅ Включена" if settings.get('captcha_enabled', False) else "❌ Выключена"
     captcha_timeout = settings.get('captcha_timeout', 60)
@@ -224,8 +293,7 @@ async def get_moderation_settings_keyboard(chat_id: int) -> InlineKeyboardMarkup
 @router.callback_query(F.data.startswith("menu:"))
 async def handle_menu_navigation(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
     # --- ИСПРАВЛЕНИЕ: Добавляем проверку на админа в самом начале ---
-    member = await bot.get_chat_member(callback.message.chat.id, callback.from_user.id)
-    if member.status not in {ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR}:
+    if not await is_user_admin_cached(callback.message.chat.id, callback.from_user.id, bot):
         return await callback.answer("Это меню доступно только для администраторов.", show_alert=True)
 
     await state.clear()
@@ -248,6 +316,8 @@ async def handle_menu_navigation(callback: types.CallbackQuery, state: FSMContex
         text, keyboard = await get_captcha_menu(chat_id)
     elif menu_type == "warns":
         text, keyboard = await get_warns_menu(chat_id)
+    elif menu_type == "antiflood":
+        text, keyboard = await get_antiflood_menu(chat_id)
     elif menu_type == "blocks":
         text, keyboard = await get_blocks_menu()
     elif menu_type == "content":
@@ -274,10 +344,19 @@ async def handle_menu_navigation(callback: types.CallbackQuery, state: FSMContex
 
 # --- ОБРАБОТЧИКИ ДЕЙСТВИЙ ИЗ МЕНЮ ---
 
+# Переключатели: действие -> (ключ настройки, значение по умолчанию, название для лога, меню для перерисовки)
+TOGGLES = {
+    "toggle_antilink": ("antilink_enabled", False, "Защита от ссылок", get_antispam_menu),
+    "toggle_antidup": ("antidup_enabled", False, "Защита от рассылок", get_antispam_menu),
+    "toggle_antiraid": ("antiraid_enabled", True, "Защита от рейдов", get_antispam_menu),
+    "toggle_federation": ("federation_enabled", False, "Общий бан-лист", get_antispam_menu),
+    "toggle_captcha": ("captcha_enabled", False, "CAPTCHA", get_captcha_menu),
+    "toggle_antiflood": ("antiflood_enabled", True, "Антифлуд", get_antiflood_menu),
+}
+
 @router.callback_query(F.data.startswith("action:"))
 async def handle_menu_actions(callback: types.CallbackQuery, state: FSMContext, bot: Bot, log_action: callable):
-    member = await bot.get_chat_member(callback.message.chat.id, callback.from_user.id)
-    if member.status not in {ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR}:
+    if not await is_user_admin_cached(callback.message.chat.id, callback.from_user.id, bot):
         return await callback.answer("Это действие доступно только администраторам.", show_alert=True)
 
     action = callback.data.split(":")[1]
@@ -288,12 +367,15 @@ async def handle_menu_actions(callback: types.CallbackQuery, state: FSMContext,
         "change_welcome": ("Пожалуйста, отправьте новый текст приветствия.", SettingsStates.waiting_for_welcome_message),
         "change_goodbye": ("Пожалуйста, отправьте новый текст прощания.", SettingsStates.waiting_for_goodbye_message),
         "change_warn_limit": ("Пожалуйста, отправьте новое число для лимита варнов.", SettingsStates.waiting_for_warn_limit),
+        "change_warn_ttl": ("Отправьте срок действия варна в днях (0 - бессрочно, до 365).", SettingsStates.waiting_for_warn_ttl),
         "change_captcha_timeout": ("Отправьте новое время в секундах для капчи (10-300).", SettingsStates.waiting_for_captcha_timeout),
-        "add_stopword": ("Отправьте слово или фразу для добавления в черный список.", SettingsStates.waiting_for_stop_word_to_add),
+        "change_antiflood_limit": ("Отправьте лимит в формате «сообщений секунд», например: 5 10.", SettingsStates.waiting_for_antiflood_limit),
+        "change_antiflood_mute": ("Отправьте длительность мута за флуд в минутах (1-1440).", SettingsStates.waiting_for_antiflood_mute),
+        "add_stopword": ("Отправьте слово или фразу для добавления в черный список, либо файл .txt/.csv со списком (по слову в строке).", SettingsStates.waiting_for_stop_word_to_add),
         "del_stopword": ("Отправьте слово или фразу для удаления из черного списка.", SettingsStates.waiting_for_stop_word_to_delete),
         "add_note": ("Отправьте имя для новой заметки (одно слово без #).", SettingsStates.waiting_for_note_name_to_add),
         "del_note": ("Отправьте имя заметки для удаления (без #).", SettingsStates.waiting_for_note_name_to_delete),
-        "add_trigger": ('Отправьте ключевую фразу для нового триггера.', SettingsStates.waiting_for_trigger_keyword_to_add),
+        "add_trigger": ('Отправьте ключевую фразу для нового триггера, либо файл .csv со строками «фраза,ответ».', SettingsStates.waiting_for_trigger_keyword_to_add),
         "del_trigger": ('Отправьте ключевую фразу триггера для удаления.', SettingsStates.waiting_for_trigger_keyword_to_delete),
     }
 
@@ -303,32 +385,75 @@ async def handle_menu_actions(callback: types.CallbackQuery, state: FSMContext,
         await callback.message.edit_text(prompt_text)
         await state.set_state(new_state)
     
-    elif action in ["toggle_antilink", "toggle_captcha"]:
-        setting_name = "antilink_enabled" if action == "toggle_antilink" else "captcha_enabled"
-        settings = await get_chat_settings(chat_id)
-        new_status = not settings.get(setting_name, False)
-        await update_chat_setting(chat_id, setting_name, new_status)
-        
-        setting_name_rus = "Защита от ссылок" if action == "toggle_antilink" else "CAPTCHA"
+    elif action in TOGGLES:
+        setting_name, default, setting_name_rus, menu_func = TOGGLES[action]
+        # Переключение на стороне БД: одновременные нажатия разных админов не теряются
+        toggled = await toggle_chat_setting(chat_id, setting_name, default)
+        if toggled is None:
+            await callback.answer("Чат не найден в базе.", show_alert=True)
+            return
+        new_status, version = toggled
+        apply_settings_change(chat_id, {setting_name: new_status}, version)
+
         status_text = "включена" if new_status else "выключена"
         log_text = (f"⚙️ <b>Изменена настройка: {setting_name_rus}</b>\n"
                     f"<b>Админ:</b> {callback.from_user.mention_html()}\n"
                     f"<b>Новый статус:</b> {status_text}")
         await log_action(chat_id, log_text, bot)
         
-        if action == "toggle_antilink":
-            _, new_keyboard = await get_antispam_menu(chat_id)
-            await callback.message.edit_reply_markup(reply_markup=new_keyboard)
-        else:
-            # ИСПРАВЛЕНИЕ: Сначала дожидаемся выполнения, потом берем элемент
-            _, new_keyboard = await get_captcha_menu(chat_id)
-            await callback.message.edit_reply_markup(reply_markup=new_keyboard)
+        # Меню перерисовывается из уже обновленного снимка настроек, без запроса в БД
+        _, new_keyboard = await menu_func(chat_id)
+        await callback.message.edit_reply_markup(reply_markup=new_keyboard)
 
     await callback.answer()
 
 
 
+# --- ИМПОРТ ИЗ ФАЙЛА ---
+async def import_stop_words_file(message: types.Message, document: types.Document, bot: Bot, log_action: callable) -> str:
+    """Добавляет стоп-слова из файла одним запросом. Возвращает текст ответа админу."""
+    try:
+        words = await parse_stop_words(iter_document_lines(bot, document))
+    except BulkImportError as e:
+        return f"❌ {e}"
+    if not words:
+        return "В файле нет стоп-слов."
+    added = await add_stop_words(message.chat.id, words)
+    # Кэш чата перечитается один раз при следующем сообщении
+    stop_words_cache.pop(message.chat.id, None)
+    log_text = (f"➕ <b>Импорт стоп-слов</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Добавлено:</b> {added} из {len(words)}")
+    await log_action(message.chat.id, log_text, bot)
+    return f"✅ Добавлено стоп-слов: {added} (в файле уникальных: {len(words)}, остальные уже были в списке)."
+
+async def import_triggers_file(message: types.Message, document: types.Document, bot: Bot, log_action: callable) -> str:
+    """Добавляет триггеры из CSV одним запросом. Существующие фразы не меняются."""
+    try:
+        triggers, skipped = await parse_triggers(iter_document_lines(bot, document))
+    except BulkImportError as e:
+        return f"❌ {e}"
+    if not triggers:
+        return "В файле нет триггеров. Ожидаются строки «фраза,ответ»."
+    added = await add_triggers(message.chat.id, triggers)
+    triggers_cache.pop(message.chat.id, None)
+    log_text = (f"🤖 <b>Импорт триггеров</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Добавлено:</b> {added} из {len(triggers)}")
+    await log_action(message.chat.id, log_text, bot)
+    text = f"✅ Добавлено триггеров: {added} (в файле уникальных: {len(triggers)}, остальные уже были)."
+    if skipped:
+        text += f"\nПропущено некорректных строк: {skipped}."
+    return text
+
+
 # --- ОБРАБОТЧИКИ СОСТОЯНИЙ (FSM) ---
+async def save_chat_settings(chat_id: int, **values):
+    """Сохраняет настройки и сразу обновляет снимок в кэше, чтобы меню показало новые значения."""
+    version = await update_chat_settings(chat_id, **values)
+    if version is not None:
+        apply_settings_change(chat_id, values, version)
+
 async def return_to_menu(message: types.Message, state: FSMContext, menu_func: callable, bot: Bot):
     """Универсальная функция для возврата в меню после изменения настройки."""
     data = await state.get_data()
@@ -352,9 +477,9 @@ async def return_to_menu(message: types.Message, state: FSMContext, menu_func: c
 @router.message(SettingsStates.waiting_for_rules_text)
 async def process_new_rules_text(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
     new_text = message.html_text
-    await update_chat_setting(message.chat.id, 'rules_text', new_text)
+    await save_chat_settings(message.chat.id, rules_text=new_text)
     confirmation_msg = await message.answer("✅ Новые правила успешно установлены.")
-    asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+    await delete_message_after_delay(confirmation_msg, 5)
 
     log_text = (f"⚙️ <b>Обновлены правила чата</b>\n"
                 f"<b>Админ:</b> {message.from_user.mention_html()}")
@@ -365,9 +490,9 @@ async def process_new_rules_text(message: types.Message, state: FSMContext, bot:
 @router.message(SettingsStates.waiting_for_goodbye_message)
 async def process_new_goodbye_message(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
     new_text = message.html_text
-    await update_chat_setting(message.chat.id, 'goodbye_message', new_text)
+    await save_chat_settings(message.chat.id, goodbye_message=new_text)
     confirmation_msg = await message.answer("✅ Новое прощальное сообщение установлено.")
-    asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+    await delete_message_after_delay(confirmation_msg, 5)
 
     log_text = (f"⚙️ <b>Изменено прощание</b>\n"
                 f"<b>Админ:</b> {message.from_user.mention_html()}")
@@ -379,13 +504,13 @@ async def process_new_goodbye_message(message: types.Message, state: FSMContext,
 async def process_new_captcha_timeout(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
     if not message.text.isdigit() or not (10 <= int(message.text) <= 300):
         error_msg = await message.reply("Пожалуйста, введите число от 10 до 300 секунд.")
-        asyncio.create_task(delete_message_after_delay(error_msg, 5))
+        await delete_message_after_delay(error_msg, 5)
         return
     
     timeout = int(message.text)
-    await update_chat_setting(message.chat.id, 'captcha_timeout', timeout)
+    await save_chat_settings(message.chat.id, captcha_timeout=timeout)
     confirmation_msg = await message.answer(f"✅ Таймаут для капчи изменен на {timeout} секунд.")
-    asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+    await delete_message_after_delay(confirmation_msg, 5)
     
     log_text = (f"⚙️ <b>Изменен таймаут CAPTCHA</b>\n"
                 f"<b>Админ:</b> {message.from_user.mention_html()}\n"
@@ -394,17 +519,57 @@ async def process_new_captcha_timeout(message: types.Message, state: FSMContext,
 
     await return_to_menu(message, state, get_captcha_menu, bot)
 
+@router.message(SettingsStates.waiting_for_antiflood_limit)
+async def process_new_antiflood_limit(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
+    parts = message.text.split()
+    if (len(parts) != 2 or not all(part.isdigit() for part in parts)
+            or not (2 <= int(parts[0]) <= 100) or not (1 <= int(parts[1]) <= 600)):
+        error_msg = await message.reply("Введите два числа: сообщений (2-100) и секунд (1-600), например: 5 10.")
+        await delete_message_after_delay(error_msg, 5)
+        return
+
+    msg_limit, time_limit = int(parts[0]), int(parts[1])
+    await save_chat_settings(message.chat.id, antiflood_limit=msg_limit, antiflood_seconds=time_limit)
+    confirmation_msg = await message.answer(f"✅ Лимит антифлуда: {msg_limit} сообщений за {time_limit} сек.")
+    await delete_message_after_delay(confirmation_msg, 5)
+
+    log_text = (f"⚙️ <b>Изменен лимит антифлуда</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Новое значение:</b> {msg_limit} сообщ. / {time_limit} сек.")
+    await log_action(message.chat.id, log_text, bot)
+
+    await return_to_menu(message, state, get_antiflood_menu, bot)
+
+@router.message(SettingsStates.waiting_for_antiflood_mute)
+async def process_new_antiflood_mute(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
+    if not message.text.isdigit() or not (1 <= int(message.text) <= 1440):
+        error_msg = await message.reply("Пожалуйста, введите число минут от 1 до 1440.")
+        await delete_message_after_delay(error_msg, 5)
+        return
+
+    minutes = int(message.text)
+    await save_chat_settings(message.chat.id, antiflood_mute_minutes=minutes)
+    confirmation_msg = await message.answer(f"✅ Мут за флуд изменен на {minutes} мин.")
+    await delete_message_after_delay(confirmation_msg, 5)
+
+    log_text = (f"⚙️ <b>Изменена длительность мута за флуд</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Новое значение:</b> {minutes} мин.")
+    await log_action(message.chat.id, log_text, bot)
+
+    await return_to_menu(message, state, get_antiflood_menu, bot)
+
 @router.message(SettingsStates.waiting_for_warn_limit)
 async def process_new_warn_limit(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
     if not message.text.isdigit() or int(message.text) < 1:
         error_msg = await message.reply("Пожалуйста, введите целое число больше 0.")
-        asyncio.create_task(delete_message_after_delay(error_msg, 5))
+        await delete_message_after_delay(error_msg, 5)
         return
     
     limit = int(message.text)
-    await update_chat_setting(message.chat.id, 'warn_limit', limit)
+    await save_chat_settings(message.chat.id, warn_limit=limit)
     confirmation_msg = await message.answer(f"✅ Лимит предупреждений изменен на {hbold(limit)}.", parse_mode="HTML")
-    asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+    await delete_message_after_delay(confirmation_msg, 5)
 
     log_text = (f"⚙️ <b>Изменен лимит варнов</b>\n"
                 f"<b>Админ:</b> {message.from_user.mention_html()}\n"
@@ -413,13 +578,32 @@ async def process_new_warn_limit(message: types.Message, state: FSMContext, bot:
     
     await return_to_menu(message, state, get_warns_menu, bot)
 
+@router.message(SettingsStates.waiting_for_warn_ttl)
+async def process_new_warn_ttl(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
+    if not message.text or not message.text.isdigit() or int(message.text) > 365:
+        error_msg = await message.reply("Пожалуйста, введите число дней от 0 до 365.")
+        await delete_message_after_delay(error_msg, 5)
+        return
+
+    days = int(message.text)
+    await save_chat_settings(message.chat.id, warn_ttl_days=days)
+    ttl_text = f"{days} дн." if days else "бессрочно"
+    confirmation_msg = await message.answer(f"✅ Срок действия варнов: {hbold(ttl_text)}.", parse_mode="HTML")
+    await delete_message_after_delay(confirmation_msg, 5)
+
+    log_text = (f"⚙️ <b>Изменен срок действия варнов</b>\n"
+                f"<b>Админ:</b> {message.from_user.mention_html()}\n"
+                f"<b>Новое значение:</b> {ttl_text}")
+    await log_action(message.chat.id, log_text, bot)
+
+    await return_to_menu(message, state, get_warns_menu, bot)
 
 @router.message(SettingsStates.waiting_for_welcome_message)
 async def process_new_welcome_message(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
     new_text = message.html_text
-    await update_chat_setting(message.chat.id, 'welcome_message', new_text)
+    await save_chat_settings(message.chat.id, welcome_message=new_text)
     confirmation_msg = await message.answer("✅ Новое приветственное сообщение установлено.")
-    asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+    await delete_message_after_delay(confirmation_msg, 5)
 
     log_text = (f"⚙️ <b>Изменено приветствие</b>\n"
                 f"<b>Админ:</b> {message.from_user.mention_html()}")
@@ -429,11 +613,20 @@ async def process_new_welcome_message(message: types.Message, state: FSMContext,
 
 @router.message(SettingsStates.waiting_for_stop_word_to_add)
 async def process_add_stop_word(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
+    if message.document:
+        confirmation_msg = await message.answer(await import_stop_words_file(message, message.document, bot, log_action))
+        await delete_message_after_delay(confirmation_msg, 10)
+        return await return_to_menu(message, state, get_stopwords_menu, bot)
+    if not message.text:
+        return
+
     word = message.text.lower()
     if await add_stop_word(message.chat.id, word):
-        stop_words_cache[message.chat.id] = set(await get_stop_words(message.chat.id))
+        # Патчим уже загруженный кэш, не перечитывая весь список
+        if message.chat.id in stop_words_cache:
+            stop_words_cache[message.chat.id] = stop_words_cache[message.chat.id] | {word}
         confirmation_msg = await message.answer(f"✅ Слово <code>{html.escape(word)}</code> добавлено.", parse_mode="HTML")
-        asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+        await delete_message_after_delay(confirmation_msg, 5)
         
         log_text = (f"➕ <b>Добавлено стоп-слово</b>\n"
                     f"<b>Админ:</b> {message.from_user.mention_html()}\n"
@@ -441,7 +634,7 @@ async def process_add_stop_word(message: types.Message, state: FSMContext, bot:
         await log_action(message.chat.id, log_text, bot)
     else:
         error_msg = await message.answer("Это слово уже есть в списке.")
-        asyncio.create_task(delete_message_after_delay(error_msg, 5))
+        await delete_message_after_delay(error_msg, 5)
     
     await return_to_menu(message, state, get_stopwords_menu, bot)
 
@@ -449,9 +642,10 @@ async def process_add_stop_word(message: types.Message, state: FSMContext, bot:
 async def process_del_stop_word(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
     word = message.text.lower()
     if await delete_stop_word(message.chat.id, word):
-        stop_words_cache[message.chat.id] = set(await get_stop_words(message.chat.id))
+        if message.chat.id in stop_words_cache:
+            stop_words_cache[message.chat.id] = stop_words_cache[message.chat.id] - {word}
         confirmation_msg = await message.answer(f"✅ Слово <code>{html.escape(word)}</code> удалено.", parse_mode="HTML")
-        asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+        await delete_message_after_delay(confirmation_msg, 5)
         
         log_text = (f"➖ <b>Удалено стоп-слово</b>\n"
                     f"<b>Админ:</b> {message.from_user.mention_html()}\n"
@@ -459,7 +653,7 @@ async def process_del_stop_word(message: types.Message, state: FSMContext, bot:
         await log_action(message.chat.id, log_text, bot)
     else:
         error_msg = await message.answer("Такого слова нет в списке.")
-        asyncio.create_task(delete_message_after_delay(error_msg, 5))
+        await delete_message_after_delay(error_msg, 5)
         
     await return_to_menu(message, state, get_stopwords_menu, bot)
 
@@ -480,7 +674,7 @@ async def process_add_note_content(message: types.Message, state: FSMContext, bo
     is_new = await add_note(message.chat.id, name, content)
     status = "создана" if is_new else "обновлена"
     confirmation_msg = await message.answer(f"✅ Заметка `#{name}` успешно {status}.")
-    asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+    await delete_message_after_delay(confirmation_msg, 5)
     
     log_text = (f"📝 <b>{status.capitalize()} заметка</b>\n"
                 f"<b>Админ:</b> {message.from_user.mention_html()}\n"
@@ -494,20 +688,27 @@ async def process_del_note(message: types.Message, state: FSMContext, bot: Bot,
     name = message.text.lower().split()[0]
     if await delete_note(message.chat.id, name):
         confirmation_msg = await message.answer(f"✅ Заметка `#{name}` удалена.")
-        asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+        await delete_message_after_delay(confirmation_msg, 5)
         log_text = (f"🗑 <b>Удалена заметка</b>\n"
                     f"<b>Админ:</b> {message.from_user.mention_html()}\n"
                     f"<b>Имя:</b> #{name}")
         await log_action(message.chat.id, log_text, bot)
     else:
         error_msg = await message.answer("Такой заметки не существует.")
-        asyncio.create_task(delete_message_after_delay(error_msg, 5))
+        await delete_message_after_delay(error_msg, 5)
         
     await return_to_menu(message, state, get_notes_menu, bot)
 
 # --- Обработчики для Триггеров ---
 @router.message(SettingsStates.waiting_for_trigger_keyword_to_add)
-async def process_add_trigger_keyword(message: types.Message, state: FSMContext, bot: Bot):
+async def process_add_trigger_keyword(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
+    if message.document:
+        confirmation_msg = await message.answer(await import_triggers_file(message, message.document, bot, log_action))
+        await delete_message_after_delay(confirmation_msg, 10)
+        return await return_to_menu(message, state, get_triggers_menu, bot)
+    if not message.text:
+        return
+
     await state.update_data(trigger_keyword=message.text.lower())
     await message.delete()
     menu_message_id = (await state.get_data()).get("menu_message_id")
@@ -521,10 +722,11 @@ async def process_add_trigger_response(message: types.Message, state: FSMContext
     response = message.html_text
     
     is_new = await add_trigger(message.chat.id, keyword, response)
-    triggers_cache[message.chat.id] = await get_all_triggers(message.chat.id)
+    if message.chat.id in triggers_cache:
+        triggers_cache[message.chat.id] = {**triggers_cache[message.chat.id], keyword: response}
     status = "создан" if is_new else "обновлен"
     confirmation_msg = await message.answer(f"✅ Триггер на фразу «{keyword}» успешно {status}.")
-    asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+    await delete_message_after_delay(confirmation_msg, 5)
     
     log_text = (f"🤖 <b>{status.capitalize()} триггер</b>\n"
                 f"<b>Админ:</b> {message.from_user.mention_html()}\n"
@@ -537,19 +739,49 @@ async def process_add_trigger_response(message: types.Message, state: FSMContext
 async def process_del_trigger(message: types.Message, state: FSMContext, bot: Bot, log_action: callable):
     keyword = message.text.lower()
     if await delete_trigger(message.chat.id, keyword):
-        triggers_cache[message.chat.id] = await get_all_triggers(message.chat.id)
+        if message.chat.id in triggers_cache:
+            triggers_cache[message.chat.id] = {
+                k: v for k, v in triggers_cache[message.chat.id].items() if k != keyword
+            }
         confirmation_msg = await message.answer(f"✅ Триггер на фразу «{keyword}» удален.")
-        asyncio.create_task(delete_message_after_delay(confirmation_msg, 5))
+        await delete_message_after_delay(confirmation_msg, 5)
         log_text = (f"🗑 <b>Удален триггер</b>\n"
                     f"<b>Админ:</b> {message.from_user.mention_html()}\n"
                     f"<b>Фраза:</b> {html.escape(keyword)}")
         await log_action(message.chat.id, log_text, bot)
     else:
         error_msg = await message.answer("Такого триггера не существует.")
-        asyncio.create_task(delete_message_after_delay(error_msg, 5))
+        await delete_message_after_delay(error_msg, 5)
         
     await return_to_menu(message, state, get_triggers_menu, bot)
 
+# Регистрируется раньше callback_verify_user: у общей капчи рейда в данных нет ID пользователя
+@router.callback_query(F.data == "verify_raid")
+async def callback_verify_raid(callback: types.CallbackQuery, bot: Bot):
+    chat_id = callback.message.chat.id
+    verified = await raid_guard.verify(chat_id, callback.message.message_id, callback.from_user.id)
+    if verified is None:
+        # Пачка неизвестна (БД недоступна или процесс перезапускался): права не выдаем,
+        # иначе кнопкой могли бы размутить себя и ограниченные через /mute или антифлуд
+        return await callback.answer("Не удалось проверить капчу, попробуйте позже.", show_alert=True)
+    if not verified:
+        return await callback.answer("Это кнопка не для вас!", show_alert=True)
+
+    try:
+        await bot.restrict_chat_member(
+            chat_id=chat_id,
+            user_id=callback.from_user.id,
+            permissions=types.ChatPermissions(
+                can_send_messages=True, can_send_media_messages=True,
+                can_send_other_messages=True, can_add_web_page_previews=True
+            )
+        )
+        # Общее сообщение остается до срабатывания таймера пачки, приветствие во время рейда не отправляется
+        await callback.answer("Проверка пройдена, теперь вы можете писать в чат.")
+    except Exception as e:
+        await callback.answer("Произошла ошибка. Попросите администратора выдать вам права вручную.", show_alert=True)
+        logging.error(f"Ошибка при верификации во время рейда: {e}")
+
 @router.callback_query(F.data.startswith("verify_"))
 async def callback_verify_user(callback: types.CallbackQuery, bot: Bot):
     chat_id = callback.message.chat.id
@@ -559,9 +791,8 @@ async def callback_verify_user(callback: types.CallbackQuery, bot: Bot):
         return await callback.answer("Это кнопка не для вас!", show_alert=True)
         
     # Добавляем пользователя в список прошедших проверку
-    if chat_id not in VERIFIED_USERS:
-        VERIFIED_USERS[chat_id] = set()
-    VERIFIED_USERS[chat_id].add(user_id_to_verify)
+    await state_backend.mark_verified(chat_id, user_id_to_verify)
+    await timers.cancel("captcha_kick", chat_id, user_id_to_verify)
 
     try:
         await bot.restrict_chat_member(
@@ -579,9 +810,9 @@ async def callback_verify_user(callback: types.CallbackQuery, bot: Bot):
         await callback.message.delete()
         
         # И отправляем приветствие
-        settings = await get_chat_settings(callback.message.chat.id)
+        settings = await get_cached_chat_settings(callback.message.chat.id)
         welcome_text = settings.get('welcome_message', "Добро пожаловать в чат, {user_mention}!")
-        final_text = welcome_text.replace("{user_mention}", callback.from_user.mention_html())
+        final_text = await render_template(welcome_text, [callback.from_user], callback.message.chat, bot)
         await bot.send_message(callback.message.chat.id, final_text, parse_mode="HTML")
 
     except Exception as e:
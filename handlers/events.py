@@ -1,62 +1,175 @@
 # handlers/events.py
-import logging
 import asyncio
+import logging
 from datetime import timedelta
 from aiogram import Router, F, types, Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from db.requests import get_chat_settings, add_chat, update_reputation
-from .filters import stop_words_cache
-# Импортируем наш временный кэш
-from .callbacks import VERIFIED_USERS
+from db.requests import add_chat, update_reputation
+from utils.templates import render_template
+from utils.timers import timers, TimerEntry
+from .filters import stop_words_cache, get_cached_chat_settings
+from utils.state_backend import state_backend
+from utils.outbound import outbound_priority, Priority
+from utils.overload import overload
+from utils.raid import raid_guard
+from utils.global_bans import global_bans
+from utils.audit import audit_log
 
 router = Router()
 
-async def kick_if_not_verified(bot: Bot, chat_id: int, user_id: int, captcha_message_id: int, timeout: int):
+@timers.handler("captcha_kick")
+async def kick_if_not_verified(bot: Bot, timer: TimerEntry):
     """
-    Финальная версия фоновой задачи. Принимает объект 'bot' напрямую.
+    Срабатывает по таймеру капчи. Таймер хранится в БД, поэтому кик произойдет и после перезапуска.
     """
-    logging.info(f"Запущен таймер на {timeout} сек. для user {user_id} в чате {chat_id}.")
-    await asyncio.sleep(timeout)
+    chat_id, user_id, captcha_message_id = timer.chat_id, timer.user_id, timer.message_id
     logging.info(f"Таймер для user {user_id} истек. Проверяем верификацию...")
     
     # Проверяем, есть ли пользователь в списке верифицированных
-    if chat_id in VERIFIED_USERS and user_id in VERIFIED_USERS[chat_id]:
+    if await state_backend.pop_verified(chat_id, user_id):
         logging.info(f"Пользователь {user_id} прошел проверку. Кик отменен.")
-        VERIFIED_USERS[chat_id].discard(user_id)
-        if not VERIFIED_USERS[chat_id]:
-            del VERIFIED_USERS[chat_id]
         return
 
     logging.info(f"Пользователь {user_id} НЕ прошел проверку. Попытка кика...")
     try:
         await bot.ban_chat_member(chat_id, user_id, until_date=timedelta(seconds=60))
+        audit_log.record(chat_id, "kick", user_id, None, "капча не пройдена", timedelta(seconds=60))
         await bot.delete_message(chat_id, captcha_message_id)
         logging.info(f"УСПЕХ: Пользователь {user_id} кикнут из чата {chat_id} за не пройденную капчу.")
     except Exception as e:
         logging.error(f"ОШИБКА: Не удалось кикнуть пользователя {user_id} по таймауту: {e}")
 
 
+@timers.handler("raid_kick")
+async def kick_raid_batch(bot: Bot, timer: TimerEntry):
+    """Один таймер на пачку вошедших во время рейда: кикает всех, кто не нажал общую кнопку."""
+    chat_id, captcha_message_id = timer.chat_id, timer.message_id
+    user_ids = await raid_guard.pop_batch(chat_id, captcha_message_id)
+    if user_ids is None:
+        # Состав пачки потерян (БД была недоступна, процесс перезапускался): кого кикать, неизвестно.
+        # Вошедшие остаются без права писать, пока администратор не снимет ограничение
+        logging.error(f"Рейд в чате {chat_id}: состав пачки капчи {captcha_message_id} потерян")
+        try:
+            await bot.edit_message_text(
+                "⚠️ Проверку участников, вошедших во время рейда, завершить не удалось.\n\n"
+                "Администраторы могут вернуть им право писать командой /unmute "
+                "в ответ на сообщение о входе участника.",
+                chat_id=chat_id, message_id=captcha_message_id
+            )
+        except Exception as e:
+            logging.error(f"Не удалось обновить сообщение капчи рейда в чате {chat_id}: {e}")
+        return
+    results = await asyncio.gather(
+        *(bot.ban_chat_member(chat_id, user_id, until_date=timedelta(seconds=60)) for user_id in user_ids),
+        return_exceptions=True
+    )
+    failed = sum(isinstance(result, Exception) for result in results)
+    for user_id, result in zip(user_ids, results):
+        if not isinstance(result, Exception):
+            audit_log.record(chat_id, "kick", user_id, None, "рейд: капча не пройдена", timedelta(seconds=60))
+    try:
+        await bot.delete_message(chat_id, captcha_message_id)
+    except Exception:
+        pass
+    logging.info(f"Рейд в чате {chat_id}: кикнуто {len(user_ids) - failed} из {len(user_ids)} не прошедших капчу")
+
+
+async def raid_captcha(message: types.Message, members: list[types.User], bot: Bot, captcha_timeout: int):
+    """
+    Капча во время рейда: вошедшие ограничиваются параллельно (темп задает планировщик
+    исходящих запросов), а вместо сообщения на каждого публикуется одно общее на пачку.
+    """
+    chat_id = message.chat.id
+    user_ids = [member.id for member in members]
+    with outbound_priority(Priority.MODERATION):
+        results = await asyncio.gather(
+            *(bot.restrict_chat_member(
+                chat_id=chat_id, user_id=user_id,
+                permissions=types.ChatPermissions(can_send_messages=False)
+            ) for user_id in user_ids),
+            return_exceptions=True
+        )
+    restricted = [user_id for user_id, result in zip(user_ids, results) if not isinstance(result, Exception)]
+    if not restricted:
+        return
+
+    captcha_message_id = raid_guard.open_batch(chat_id)
+    if captcha_message_id is None:
+        keyboard = InlineKeyboardBuilder()
+        keyboard.add(InlineKeyboardButton(text="✅ Я не бот", callback_data="verify_raid"))
+        captcha_message = await message.answer(
+            "⚠️ В чат массово входят новые участники.\n\n"
+            f"Все, кто только что вошел, должны нажать на кнопку ниже в течение {captcha_timeout} секунд, "
+            "иначе будут удалены из чата.",
+            reply_markup=keyboard.as_markup()
+        )
+        captcha_message_id = captcha_message.message_id
+        # Пачка принимает новых участников половину таймаута, чтобы у каждого осталось время ответить
+        raid_guard.start_batch(chat_id, captcha_message_id, captcha_timeout / 2)
+        await timers.schedule("raid_kick", captcha_timeout, chat_id, message_id=captcha_message_id)
+    await raid_guard.add_pending(chat_id, captcha_message_id, restricted)
+
+
 @router.message(F.new_chat_members)
-async def new_chat_member_handler(message: types.Message, bot: Bot):
-    settings = await get_chat_settings(message.chat.id)
-    
-    bot_obj = await bot.get_me()
-    if any(member.id == bot_obj.id for member in message.new_chat_members):
+async def new_chat_member_handler(message: types.Message, bot: Bot, log_action: callable):
+    # ID бота берется из токена: проверка входа самого бота не стоит запроса к API
+    if any(member.id == bot.id for member in message.new_chat_members):
         await add_chat(message.chat.id)
         stop_words_cache[message.chat.id] = set()
         return await message.answer("Спасибо, что добавили меня! Я готов к работе.")
 
+    # Снимок настроек из кэша: входы (особенно во время рейда) не ходят в БД за настройками
+    settings = await get_cached_chat_settings(message.chat.id)
+
+    members = message.new_chat_members
+    if settings.get('federation_enabled', False):
+        # Почти всегда ответ дает фильтр Блума в памяти, в БД идут только его срабатывания
+        banned = await global_bans.check([member.id for member in members])
+        if banned:
+            with outbound_priority(Priority.MODERATION):
+                await asyncio.gather(
+                    *(bot.ban_chat_member(message.chat.id, user_id) for user_id in banned),
+                    return_exceptions=True
+                )
+            for user_id in banned:
+                audit_log.record(message.chat.id, "ban", user_id, None, "общий бан-лист")
+            await log_action(
+                message.chat.id,
+                "🌐 <b>Бан по общему бан-листу</b>\n" + "\n".join(
+                    f"<b>Пользователь:</b> {member.mention_html()} (<code>{member.id}</code>)"
+                    for member in members if member.id in banned
+                ),
+                bot
+            )
+            members = [member for member in members if member.id not in banned]
+            if not members:
+                return
+
+    in_raid, raid_started = raid_guard.register_joins(message.chat.id, len(members))
+    if in_raid and settings.get('antiraid_enabled', True):
+        if raid_started:
+            await log_action(
+                message.chat.id,
+                f"⚠️ #РЕЙД\nВ чат массово входят участники, включен режим защиты от рейда "
+                f"на {int(raid_guard.cooldown)} сек.",
+                bot, urgent=True
+            )
+        # Во время рейда общая капча действует, даже если обычная выключена; приветствий нет
+        await raid_captcha(message, members, bot, settings.get('captcha_timeout', 60))
+        return
+
     if not settings.get('captcha_enabled', False):
         welcome_text = settings.get('welcome_message', "Добро пожаловать в чат, {user_mention}!")
-        for member in message.new_chat_members:
-            final_text = welcome_text.replace("{user_mention}", member.mention_html())
+        # Всех вошедших сразу приветствуем одним сообщением, шаблон разбирается один раз
+        final_text = await render_template(welcome_text, members, message.chat, bot)
+        with outbound_priority(Priority.LOW):
             await message.answer(final_text, parse_mode="HTML")
         return
 
     captcha_timeout = settings.get('captcha_timeout', 60)
-    for member in message.new_chat_members:
+    for member in members:
         try:
             await bot.restrict_chat_member(
                 chat_id=message.chat.id, user_id=member.id,
@@ -72,9 +185,9 @@ async def new_chat_member_handler(message: types.Message, bot: Bot):
                 parse_mode="HTML", reply_markup=keyboard.as_markup()
             )
             
-            # ИСПРАВЛЕНИЕ: Передаем 'bot' как первый аргумент в нашу задачу
-            asyncio.create_task(
-                kick_if_not_verified(bot, message.chat.id, member.id, captcha_message.message_id, captcha_timeout)
+            await timers.schedule(
+                "captcha_kick", captcha_timeout, message.chat.id,
+                user_id=member.id, message_id=captcha_message.message_id
             )
         except Exception as e:
             logging.error(f"Не удалось выдать капчу пользователю {member.id}: {e}")
@@ -91,6 +204,8 @@ async def thanks_handler(message: types.Message):
         return
         
     await update_reputation(recipient.id, message.chat.id, 1)
+    if overload.should_shed("thanks_reaction"):
+        return
     try:
         await message.reply_to_message.react([types.ReactionTypeEmoji(emoji="👍")])
     except Exception:
@@ -102,14 +217,14 @@ async def left_chat_member_handler(message: types.Message, bot: Bot):
     Обработчик для прощания с ушедшими участниками.
     """
     # Не реагируем на уход самого бота
-    bot_obj = await bot.get_me()
-    if message.left_chat_member.id == bot_obj.id:
+    if message.left_chat_member.id == bot.id:
         return
 
-    settings = await get_chat_settings(message.chat.id)
+    settings = await get_cached_chat_settings(message.chat.id)
     goodbye_text = settings.get('goodbye_message')
 
     # Отправляем сообщение, только если оно не пустое
     if goodbye_text:
-        final_text = goodbye_text.replace("{user_mention}", message.left_chat_member.mention_html())
-        await message.answer(final_text, parse_mode="HTML")
+        final_text = await render_template(goodbye_text, [message.left_chat_member], message.chat, bot)
+        with outbound_priority(Priority.LOW):
+            await message.answer(final_text, parse_mode="HTML")
@@ -4,7 +4,17 @@ import html
 import logging
 from aiogram import Router, F, types, Bot
 
-from db.requests import get_chat_settings, get_stop_words, get_all_triggers
+from db.requests import (
+    get_chat_settings_snapshot, get_stop_words, get_all_triggers,
+    iter_chat_settings, iter_stop_words_by_chat, iter_triggers_by_chat
+)
+from utils.cache import BoundedCache, approx_size
+from utils.simhash import NearDuplicateIndex
+from utils.matcher import PhraseMatcher
+from utils.templates import render_template
+from utils.tenancy import bot_scope
+from utils.global_bans import global_bans
+from utils.audit import audit_log
 # ИМПОРТИРУЕМ ИЗ ПРАВИЛЬНОГО МЕСТА
 from .utils import is_user_admin_silent
 
@@ -12,54 +22,236 @@ router = Router()
 
 # --- ЦЕНТРАЛЬНОЕ ХРАНИЛИЩЕ КЭШЕЙ ---
 # Оба кэша теперь определены здесь, чтобы избежать циклических импортов.
-stop_words_cache = {}
-triggers_cache = {}
+# Значения (set/dict) не меняем на месте, а присваиваем заново, чтобы учитывался их размер.
+stop_words_cache = BoundedCache("stop_words", max_items=50_000, max_bytes=64 * 1024 * 1024)
+triggers_cache = BoundedCache("triggers", max_items=50_000, max_bytes=64 * 1024 * 1024)
+# Настройки чатов: (settings, settings_version). Инвалидируются через NOTIFY по версии,
+# TTL страхует на случай потери LISTEN-соединения.
+settings_cache = BoundedCache("settings", max_items=50_000, max_bytes=64 * 1024 * 1024, ttl=600)
+# Собранные по кэшам выше искатели фраз: (исходный набор, PhraseMatcher).
+# Размер не считаем - исходный набор уже учтен в своем кэше.
+stop_word_matchers = BoundedCache("stop_word_matchers", max_items=50_000, sizer=lambda value: 0)
+trigger_matchers = BoundedCache("trigger_matchers", max_items=50_000, sizer=lambda value: 0)
 
+# Отпечатки последних сообщений из всех чатов для поиска волн копипасты-спама
+duplicate_index = NearDuplicateIndex(capacity=50_000, window_seconds=600)
+# Сколько других чатов должны получить похожий текст, чтобы считать его спамом
+DUPLICATE_CHATS_THRESHOLD = 3
 
-@router.message(F.text)
-async def message_filter(message: types.Message, bot: Bot, log_action: callable):
+
+async def get_settings_snapshot(chat_id: int) -> tuple[dict, int]:
+    """Настройки чата и их версия из кэша, при промахе - из БД."""
+    snapshot = settings_cache.get(chat_id)
+    if snapshot is None:
+        snapshot = settings_cache[chat_id] = await get_chat_settings_snapshot(chat_id)
+    return snapshot
+
+
+async def get_cached_chat_settings(chat_id: int) -> dict:
+    """Возвращает настройки чата из кэша, при промахе загружает их из БД."""
+    return (await get_settings_snapshot(chat_id))[0]
+
+
+def apply_settings_change(chat_id: int, values: dict, version: int):
+    """
+    Применяет к кэшу собственное изменение настроек, не дожидаясь NOTIFY.
+    Патчим, только если в кэше предыдущая версия; иначе (пропущены чужие изменения) сбрасываем.
+    """
+    snapshot = settings_cache.get(chat_id)
+    if snapshot is None:
+        return
+    settings, cached_version = snapshot
+    if cached_version == version - 1:
+        settings_cache[chat_id] = ({**settings, **values}, version)
+    elif cached_version < version:
+        settings_cache.pop(chat_id, None)
+
+
+async def get_cached_stop_words(chat_id: int) -> set:
+    stop_words = stop_words_cache.get(chat_id)
+    if stop_words is None:
+        stop_words = stop_words_cache[chat_id] = set(await get_stop_words(chat_id))
+    return stop_words
+
+
+async def get_cached_triggers(chat_id: int) -> dict:
+    triggers = triggers_cache.get(chat_id)
+    if triggers is None:
+        triggers = triggers_cache[chat_id] = await get_all_triggers(chat_id)
+    return triggers
+
+
+def apply_cache_event(event: dict):
+    """Применяет событие из LISTEN/NOTIFY к локальным кэшам этого инстанса (в пространстве имен бота из события)."""
+    event_type = event.get("event")
+    chat_id = event.get("chat_id")
+
+    with bot_scope(event.get("bot")):
+        if event_type == "resync":
+            stop_words_cache.clear()
+            triggers_cache.clear()
+            settings_cache.clear()
+            global_bans.mark_stale()
+        elif event_type == "stop_word_added":
+            # Патчим только уже загруженный кэш, иначе он загрузится из БД при первом сообщении
+            if chat_id in stop_words_cache:
+                stop_words_cache[chat_id] = stop_words_cache[chat_id] | {event["word"]}
+        elif event_type == "stop_word_deleted":
+            if chat_id in stop_words_cache:
+                stop_words_cache[chat_id] = stop_words_cache[chat_id] - {event["word"]}
+        elif event_type == "stop_words_changed":
+            stop_words_cache.pop(chat_id, None)
+        elif event_type == "triggers_changed":
+            triggers_cache.pop(chat_id, None)
+        elif event_type == "settings_changed":
+            # Снимок той же или более новой версии (например, уже пропатченный этим инстансом) остается
+            snapshot = settings_cache.get(chat_id)
+            version = event.get("version")
+            if snapshot is not None and (version is None or snapshot[1] < version):
+                settings_cache.pop(chat_id, None)
+        elif event_type == "global_ban_added":
+            global_bans.add(event["user_id"])
+
+
+async def prewarm_caches(chat_ids: list[int] | None, max_chats: int, max_bytes: int,
+                         shard_index: int = 0, shard_count: int = 1):
+    """
+    Заполняет кэши настроек, стоп-слов и триггеров тремя потоковыми запросами.
+    chat_ids=None означает все чаты (при шардировании - все чаты шарда).
+    Загрузка останавливается по max_chats или max_bytes.
+    """
+    used_bytes = 0
+    warmed_chats = []
+    async for chat_id, settings, version in iter_chat_settings(chat_ids, max_chats, shard_index, shard_count):
+        used_bytes += approx_size(settings)
+        if used_bytes > max_bytes:
+            break
+        settings_cache[chat_id] = (settings, version)
+        warmed_chats.append(chat_id)
+
+    if not warmed_chats:
+        return 0, used_bytes
+
+    # Фильтры грузим только для чатов, чьи настройки поместились в бюджет
+    for cache, iter_groups, empty in (
+        (stop_words_cache, iter_stop_words_by_chat, set),
+        (triggers_cache, iter_triggers_by_chat, dict),
+    ):
+        complete = True
+        seen = set()
+        async for chat_id, group in iter_groups(warmed_chats):
+            used_bytes += approx_size(group)
+            if used_bytes > max_bytes:
+                complete = False
+                break
+            cache[chat_id] = group
+            seen.add(chat_id)
+        # Пустой список кэшируем, только если проход завершился полностью
+        if complete:
+            for chat_id in warmed_chats:
+                if chat_id not in seen:
+                    cache[chat_id] = empty()
+
+    return len(warmed_chats), used_bytes
+
+
+def _compiled(cache: BoundedCache, chat_id: int, phrases) -> PhraseMatcher:
+    """
+    Искатель для набора фраз чата. Набор в кэше при изменении заменяется новым объектом,
+    поэтому устаревший искатель узнается по несовпадению исходного объекта.
+    """
+    cached = cache.get(chat_id)
+    if cached is not None and cached[0] is phrases:
+        return cached[1]
+    matcher = PhraseMatcher(phrases)
+    cache[chat_id] = (phrases, matcher)
+    return matcher
+
+
+async def get_chat_filters(chat_id: int) -> tuple[dict, PhraseMatcher, PhraseMatcher]:
+    """Триггеры чата и собранные искатели триггеров и стоп-слов. БД - только при промахе кэша."""
+    triggers = await get_cached_triggers(chat_id)
+    stop_words = await get_cached_stop_words(chat_id)
+    return (triggers, _compiled(trigger_matchers, chat_id, triggers),
+            _compiled(stop_word_matchers, chat_id, stop_words))
+
+
+async def run_filters(message: types.Message, bot: Bot, log_action: callable, edited: bool = False):
+    """
+    Общий конвейер фильтров для текста и подписей к медиа, новых и отредактированных сообщений.
+    На отредактированные сообщения триггеры не отвечают, остальные проверки те же.
+    """
+    # Текст и его нижний регистр вычисляются один раз на апдейт
+    text = message.text or message.caption
+    if not text:
+        return
+    entities = message.entities or message.caption_entities or ()
+    text_lower = text.lower()
     chat_id = message.chat.id
     user_id = message.from_user.id
     user_mention = message.from_user.mention_html()
-    text_lower = message.text.lower()
-    
+
+    triggers, trigger_matcher, stop_word_matcher = await get_chat_filters(chat_id)
+
     # --- 1. Проверка на триггеры ---
-    if chat_id not in triggers_cache:
-        triggers_cache[chat_id] = await get_all_triggers(chat_id)
-    
-    for keyword, response in triggers_cache.get(chat_id, {}).items():
-        if keyword in text_lower:
-            await message.reply(response, parse_mode="HTML")
+    if not edited:
+        keyword = trigger_matcher.search(text_lower)
+        if keyword is not None:
+            await message.reply(await render_template(triggers[keyword], [message.from_user], message.chat, bot), parse_mode="HTML")
             return # Если сработал триггер, дальше не проверяем
 
     # --- 2. Проверка на ссылки ---
-    settings = await get_chat_settings(chat_id)
+    settings = await get_cached_chat_settings(chat_id)
     if settings.get('antilink_enabled', False):
-        if not await is_user_admin_silent(message.chat, user_id, bot):
-            if message.entities and any(e.type in ['url', 'text_link'] for e in message.entities):
+        if any(e.type in ['url', 'text_link'] for e in entities):
+            if not await is_user_admin_silent(message.chat, user_id, bot):
                 try:
                     await message.delete()
+                    audit_log.record(chat_id, "delete", user_id, None, "ссылка")
                     log_text = (f"🗑 <b>Удалено сообщение (ссылка)</b>\n"
                                 f"<b>Пользователь:</b> {user_mention} (<code>{user_id}</code>)\n"
-                                f"<b>Сообщение:</b> <code>{html.escape(message.text)}</code>")
-                    await log_action(chat_id, log_text, bot) 
+                                f"<b>Сообщение:</b> <code>{html.escape(text)}</code>")
+                    await log_action(chat_id, log_text, bot)
                 except Exception as e:
                     logging.error(f"Не удалось удалить сообщение со ссылкой: {e}")
                 return
 
     # --- 3. Проверка на стоп-слова ---
-    if chat_id not in stop_words_cache:
-        words = await get_stop_words(chat_id)
-        stop_words_cache[chat_id] = set(words)
+    word = stop_word_matcher.search(text_lower)
+    if word is not None:
+        try:
+            await message.delete()
+            audit_log.record(chat_id, "delete", user_id, None, f"стоп-слово: {word}")
+            log_text = (f"🗑 <b>Удалено сообщение (стоп-слово)</b>\n"
+                        f"<b>Пользователь:</b> {user_mention} (<code>{user_id}</code>)\n"
+                        f"<b>Слово:</b> <code>{html.escape(word)}</code>")
+            await log_action(chat_id, log_text, bot)
+        except Exception as e:
+            logging.error(f"Ошибка в фильтре стоп-слов: {e}")
+        return
 
-    for word in stop_words_cache.get(chat_id, set()):
-        if word in text_lower:
+    # --- 4. Проверка на рассылку одного текста по многим чатам ---
+    # Индексируем сообщения всех чатов, а удаляем только там, где защита включена
+    is_mass_spam = duplicate_index.check_and_add(text, chat_id, DUPLICATE_CHATS_THRESHOLD)
+    if is_mass_spam and settings.get('antidup_enabled', False):
+        if not await is_user_admin_silent(message.chat, user_id, bot):
             try:
                 await message.delete()
-                log_text = (f"🗑 <b>Удалено сообщение (стоп-слово)</b>\n"
+                audit_log.record(chat_id, "delete", user_id, None, "массовая рассылка")
+                log_text = (f"🗑 <b>Удалено сообщение (массовая рассылка)</b>\n"
                             f"<b>Пользователь:</b> {user_mention} (<code>{user_id}</code>)\n"
-                            f"<b>Слово:</b> <code>{html.escape(word)}</code>")
+                            f"<b>Сообщение:</b> <code>{html.escape(text)}</code>")
                 await log_action(chat_id, log_text, bot)
             except Exception as e:
-                logging.error(f"Ошибка в фильтре стоп-слов: {e}")
-            return
\ No newline at end of file
+                logging.error(f"Не удалось удалить сообщение из массовой рассылки: {e}")
+
+
+@router.message(F.text | F.caption)
+async def message_filter(message: types.Message, bot: Bot, log_action: callable):
+    await run_filters(message, bot, log_action)
+
+
+@router.edited_message(F.text | F.caption)
+async def edited_message_filter(message: types.Message, bot: Bot, log_action: callable):
+    # Без этого спамер мог отправить безобидный текст и затем дописать в него ссылку или стоп-слово
+    await run_filters(message, bot, log_action, edited=True)
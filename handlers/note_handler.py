@@ -1,11 +1,12 @@
 # handlers/note_handler.py
-from aiogram import Router, F, types
+from aiogram import Router, F, types, Bot
 from db.requests import get_note
+from utils.templates import render_template
 
 router = Router()
 
 @router.message(F.text.startswith("#"))
-async def handle_note_call(message: types.Message):
+async def handle_note_call(message: types.Message, bot: Bot):
     # Извлекаем имя заметки из сообщения, например, из "#rules" получаем "rules"
     note_name = message.text[1:].lower().split()[0]
     if not note_name:
@@ -17,9 +18,11 @@ async def handle_note_call(message: types.Message):
     if note_content:
         # Определяем, на какое сообщение отвечать
         target_message = message.reply_to_message or message
+        # Плейсхолдеры пользователя относятся к тому, кому адресована заметка
+        note_text = await render_template(note_content, [target_message.from_user], message.chat, bot)
         try:
             # Сначала отвечаем
-            await target_message.reply(note_content, parse_mode="HTML")
+            await target_message.reply(note_text, parse_mode="HTML")
             # Потом удаляем команду вызова
             await message.delete()
         except Exception:
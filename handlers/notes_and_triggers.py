@@ -9,11 +9,12 @@ from db.requests import (
     add_trigger, delete_trigger, get_all_triggers
 )
 # ИМПОРТИРУЕМ ИЗ НОВОГО ФАЙЛА
+from utils.templates import render_template
 from .utils import is_admin
+# Общий кэш триггеров, чтобы изменения видел фильтр сообщений
+from .filters import triggers_cache
 
 router = Router()
-# Кэш для триггеров, чтобы не обращаться к БД на каждое сообщение
-triggers_cache = {}
 
 # --- ЗАМЕТКИ (NOTES) ---
 
@@ -59,19 +60,21 @@ async def cmd_list_notes(message: types.Message):
     await message.reply(text, parse_mode="MarkdownV2")
 
 @router.message(F.text.startswith("#"))
-async def handle_note_call(message: types.Message):
+async def handle_note_call(message: types.Message, bot: Bot):
     note_name = message.text[1:].lower().split()[0]
     if not note_name: return
 
     note_content = await get_note(message.chat.id, note_name)
     if note_content:
+        target_user = (message.reply_to_message or message).from_user
+        note_text = await render_template(note_content, [target_user], message.chat, bot)
         # СНАЧАЛА отправляем ответ
         if message.reply_to_message:
             # Если это ответ на другое сообщение, отвечаем на него
-            await message.reply_to_message.reply(note_content, parse_mode="HTML")
+            await message.reply_to_message.reply(note_text, parse_mode="HTML")
         else:
             # Если это новое сообщение, просто отправляем в чат
-            await message.answer(note_content, parse_mode="HTML")
+            await message.answer(note_text, parse_mode="HTML")
         
         # ПОТОМ удаляем команду
         try:
@@ -118,9 +121,10 @@ async def cmd_del_trigger(message: types.Message, bot: Bot, log_action: callable
 
 @router.message(Command("triggers"))
 async def cmd_list_triggers(message: types.Message):
-    if message.chat.id not in triggers_cache:
-        triggers_cache[message.chat.id] = await get_all_triggers(message.chat.id)
-    triggers = triggers_cache[message.chat.id]
+    triggers = triggers_cache.get(message.chat.id)
+    if triggers is None:
+        triggers = await get_all_triggers(message.chat.id)
+        triggers_cache[message.chat.id] = triggers
     if not triggers:
         return await message.reply("В этом чате еще нет триггеров.")
     text = "📋 **Список настроенных триггеров:**\n" + "\n".join(f"• «`{html.escape(keyword)}`»" for keyword in triggers)
@@ -5,7 +5,13 @@ from aiogram import Bot, types
 from aiogram.enums import ChatMemberStatus
 from aiogram.utils.markdown import hbold
 
-from db.requests import add_warning, count_warnings, get_chat_settings
+from db.requests import add_warning
+from utils.audit import audit_log
+from utils.cache import BoundedCache
+
+# Статус админа для меню настроек: админ листает меню серией нажатий, и каждое
+# не должно стоить запроса get_chat_member. Снятие прав вступает в силу не позже TTL.
+admin_status_cache = BoundedCache("admin_status", max_items=50_000, ttl=60)
 
 async def is_admin(message: types.Message, bot: Bot) -> bool:
     """Проверка прав администратора с ответом."""
@@ -23,16 +29,23 @@ async def is_user_admin_silent(chat: types.Chat, user_id: int, bot: Bot) -> bool
     member = await bot.get_chat_member(chat.id, user_id)
     return member.status in {ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR}
 
+async def is_user_admin_cached(chat_id: int, user_id: int, bot: Bot) -> bool:
+    """Как is_user_admin_silent, но ответ запоминается на минуту."""
+    key = (chat_id, user_id)
+    status = admin_status_cache.get(key)
+    if status is None:
+        member = await bot.get_chat_member(chat_id, user_id)
+        status = admin_status_cache[key] = member.status in {ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR}
+    return status
+
 async def process_warning(message: types.Message, user_to_warn: types.User, bot: Bot, log_action_func: callable):
     """Общая функция для выдачи варна и проверки на бан."""
     chat_id = message.chat.id
     user_id = user_to_warn.id
-    
-    await add_warning(user_id, chat_id)
-    warnings_count = await count_warnings(user_id, chat_id)
-    
-    settings = await get_chat_settings(chat_id)
-    warn_limit = settings.get('warn_limit', 3)
+
+    # Счетчик действующих варнов и лимит чата приходят вместе со вставкой
+    warnings_count, warn_limit = await add_warning(user_id, chat_id)
+    audit_log.record(chat_id, "warn", user_id, message.from_user.id)
     
     admin_mention = message.from_user.mention_html()
     user_mention = user_to_warn.mention_html()
@@ -40,9 +53,11 @@ async def process_warning(message: types.Message, user_to_warn: types.User, bot:
     if warnings_count >= warn_limit:
         try:
             await bot.ban_chat_member(chat_id, user_id, until_date=timedelta(days=1))
+            audit_log.record(chat_id, "ban", user_id, None, f"лимит предупреждений ({warnings_count}/{warn_limit})",
+                             timedelta(days=1))
             await message.answer(f"🚫 Пользователь {user_mention} получил {warnings_count} предупреждение и забанен на 1 день.", parse_mode="HTML")
             log_text = (f"🚫 <b>Авто-бан</b>\n<b>Админ:</b> {admin_mention}\n<b>Пользователь:</b> {user_mention} (<code>{user_id}</code>)\n<b>Причина:</b> Достигнут лимит предупреждений ({warnings_count}/{warn_limit})")
-            await log_action_func(chat_id, log_text, bot)
+            await log_action_func(chat_id, log_text, bot, urgent=True)
         except Exception as e:
             await message.answer(f"Не удалось забанить пользователя {user_mention}. Возможно, у меня недостаточно прав.", parse_mode="HTML")
     else:
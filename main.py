@@ -8,56 +8,271 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from aiogram import Bot, Dispatcher, types
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
 
 # Импортируем наши роутеры
 from handlers import user, admin, callbacks, events, note_handler, filters as msg_filters
 from middlewares.antiflood import AntiFloodMiddleware
-from db.requests import create_tables, upsert_user, get_or_create_user_profile, log_message, get_chat_settings, add_xp, add_chat
+from middlewares.shared_state import SharedStateMiddleware
+from db.listener import run_cache_listener
+from utils.cache import get_cache_stats
+from utils.timers import timers
+from utils.state_backend import state_backend
+from utils.outbound import outbound, outbound_priority, Priority
+from utils.log_digest import log_digest
+from utils.chat_dispatcher import ChatDispatcher
+from utils.webhook import run_webhook
+from utils.sharding import ShardRouter, SHARD_INDEX, SHARD_COUNT, is_front
+from utils.chat_dispatcher import poll_updates
+from utils.background import bookkeeping
+from utils.overload import overload
+from utils.global_bans import global_bans
+from utils.audit import audit_log
+from utils.message_log import message_log
+from utils.tenancy import get_bot_tokens, bot_namespace, bot_scope
+from db.requests import create_tables, record_message_activity, get_recently_active_chat_ids, advisory_lock, acquire_singleton_lock, release_singleton_lock, delete_expired_warnings
 from utils.commands import set_bot_commands
 
 logging.basicConfig(level=logging.INFO)
 
-async def log_action(chat_id: int, text: str, bot: Bot):
-    """Отправляет лог в установленный для чата канал."""
-    settings = await get_chat_settings(chat_id)
+# Как часто выводить метрики кэшей в лог (в секундах)
+METRICS_INTERVAL_SECONDS = int(os.getenv("METRICS_INTERVAL_SECONDS", "300"))
+
+# Как часто удалять истекшие варны (в чатах с warn_ttl_days) и размер одной пачки удаления
+WARN_SWEEP_INTERVAL_SECONDS = int(os.getenv("WARN_SWEEP_INTERVAL_SECONDS", "3600"))
+WARN_SWEEP_BATCH_SIZE = 1000
+WARN_SWEEP_PAUSE_SECONDS = 0.1
+
+# Прогрев кэшей при старте: чаты с активностью за PREWARM_ACTIVE_DAYS дней (0 - все чаты)
+PREWARM_CACHES = os.getenv("PREWARM_CACHES", "0") == "1"
+PREWARM_ACTIVE_DAYS = int(os.getenv("PREWARM_ACTIVE_DAYS", "7"))
+PREWARM_MAX_CHATS = int(os.getenv("PREWARM_MAX_CHATS", "10000"))
+PREWARM_MAX_BYTES = int(os.getenv("PREWARM_MAX_MB", "128")) * 1024 * 1024
+
+# chat_queue - очереди по чатам с ограниченным числом воркеров, aiogram - стандартный поллинг
+DISPATCH_MODE = os.getenv("DISPATCH_MODE", "chat_queue")
+# polling - long polling, webhook - HTTP-сервер (см. WEBHOOK_* в utils/webhook.py)
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+chat_dispatcher: ChatDispatcher | None = None
+
+async def log_action(chat_id: int, text: str, bot: Bot, urgent: bool = False):
+    """
+    Отправляет лог в установленный для чата канал. Обычные события копятся
+    и уходят сводками, срочные (ручные баны и т.п.) отправляются сразу.
+    """
+    settings = await msg_filters.get_cached_chat_settings(chat_id)
     log_channel_id = settings.get('log_channel_id')
     if log_channel_id:
+        await log_digest.add(bot, log_channel_id, text, urgent=urgent)
+
+async def record_activity(message: types.Message):
+    """Учет сообщения в фоне; поздравление с уровнем отправляется, когда опыт уже записан."""
+    chat_id = message.chat.id if message.chat.type != 'private' else None
+    result = await record_message_activity(message.from_user, chat_id)
+    if result is None:
+        return
+    new_level, leveled_up = result
+    if leveled_up and not overload.should_shed("level_up"):
+        with outbound_priority(Priority.LOW):
+            await message.answer(f"🎉 Поздравляем {message.from_user.mention_html()}, вы достигли {new_level} уровня!", parse_mode="HTML")
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks = set()
+
+def start_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def sweep_expired_warnings(bots: tuple[Bot, ...]):
+    """
+    Периодически удаляет истекшие варны небольшими пачками. Из всех процессов
+    чистку выполняет тот, кто захватил блокировку, остальные пропускают проход.
+    """
+    while True:
+        await asyncio.sleep(WARN_SWEEP_INTERVAL_SECONDS)
         try:
-            await bot.send_message(chat_id=log_channel_id, text=text, parse_mode="HTML")
+            lock = await acquire_singleton_lock("warn_sweeper")
+            if lock is None:
+                continue
+            try:
+                for bot in bots:
+                    with bot_scope(bot_namespace(bot.id)):
+                        total = 0
+                        while True:
+                            deleted = await delete_expired_warnings(WARN_SWEEP_BATCH_SIZE)
+                            total += deleted
+                            if deleted < WARN_SWEEP_BATCH_SIZE:
+                                break
+                            # Пауза между пачками, чтобы не занимать БД надолго
+                            await asyncio.sleep(WARN_SWEEP_PAUSE_SECONDS)
+                        if total:
+                            logging.info(f"Удалено истекших варнов бота {bot.id}: {total}")
+            finally:
+                await release_singleton_lock(lock, "warn_sweeper")
+                await lock.close()
         except Exception as e:
-            logging.error(f"Не удалось отправить лог в канал {log_channel_id}: {e}")
+            logging.error(f"Ошибка при очистке истекших варнов: {e}")
+
+async def report_metrics():
+    """Периодически пишет в лог размер, попадания, промахи и вытеснения кэшей."""
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL_SECONDS)
+        for stats in get_cache_stats():
+            logging.info(
+                f"Кэш {stats['name']}: записей={stats['size']}, ~{stats['bytes'] // 1024} КБ, "
+                f"попаданий={stats['hits']}, промахов={stats['misses']}, вытеснений={stats['evictions']}"
+            )
+        stats = outbound.stats
+        logging.info(
+            f"Исходящие запросы: отправлено={stats['sent']} {stats['by_priority']}, "
+            f"429={stats['retry_after']}, склеено={stats['coalesced']}, в очереди={outbound.queue_size()}"
+        )
+        stats = log_digest.stats
+        logging.info(
+            f"Логи: событий={stats['events']}, сообщений={stats['messages']}, срочных={stats['urgent']}, "
+            f"ошибок={stats['errors']}, в буфере={log_digest.pending_count()}"
+        )
+        stats = overload.take_stats()
+        logging.info(
+            f"Нагрузка: перегрузка={'да' if stats['overloaded'] else 'нет'}, эпизодов={stats['episodes']}, "
+            f"в перегрузке={stats['overloaded_seconds']:.0f} сек., макс. задержка цикла={stats['max_lag_ms']:.0f} мс, "
+            f"отброшено={stats['shed']}"
+        )
+        stats = audit_log.stats
+        logging.info(
+            f"Журнал модерации: событий={stats['recorded']}, записано={stats['written']} "
+            f"пачками={stats['batches']}, ошибок={stats['errors']}, отброшено={stats['dropped']}, "
+            f"в буфере={audit_log.pending_count()}"
+        )
+        stats = message_log.stats
+        logging.info(
+            f"Учет сообщений: записано={stats['written']} пачками={stats['batches']}, "
+            f"ошибок={stats['errors']}, отброшено={stats['dropped']}, в буфере={message_log.pending_count()}"
+        )
+        stats = global_bans.stats
+        logging.info(
+            f"Общий бан-лист: проверено={stats['checks']}, срабатываний фильтра={stats['bloom_hits']}, "
+            f"подтверждено={stats['confirmed']}"
+        )
+        stats = bookkeeping.stats
+        logging.info(
+            f"Фоновый учет: поставлено={stats['submitted']}, выполнено={stats['done']}, "
+            f"отброшено={stats['dropped']}, ошибок={stats['errors']}, в очереди={bookkeeping.queue_size()}"
+        )
+        if chat_dispatcher is not None:
+            stats = chat_dispatcher.take_stats()
+            logging.info(
+                f"Диспетчер: получено={stats['received']}, обработано={stats['processed']}, "
+                f"отброшено={stats['dropped']}, ошибок={stats['errors']}, в очереди={stats['depth']} "
+                f"в {stats['chats']} чатах, макс. ожидание={stats['max_wait_ms']} мс"
+            )
+
+async def prewarm():
+    """Загружает фильтры и настройки чатов до начала поллинга."""
+    # Воркер шарда прогревает только свои чаты, в том числе при PREWARM_ACTIVE_DAYS=0
+    shard = (SHARD_INDEX, SHARD_COUNT) if SHARD_INDEX is not None else (0, 1)
+    chat_ids = None
+    if PREWARM_ACTIVE_DAYS > 0:
+        chat_ids = await get_recently_active_chat_ids(PREWARM_ACTIVE_DAYS, PREWARM_MAX_CHATS, *shard)
+    chats_count, used_bytes = await msg_filters.prewarm_caches(chat_ids, PREWARM_MAX_CHATS, PREWARM_MAX_BYTES, *shard)
+    logging.info(f"Кэши прогреты: {chats_count} чатов, ~{used_bytes // 1024} КБ")
 
-async def on_startup(bot: Bot):
-    await create_tables()
-    await set_bot_commands(bot)
+# Соединение, которое держит блокировку шарда, пока процесс жив
+shard_lock = None
+SHARD_LOCK_NAME = f"shard:{SHARD_INDEX}/{SHARD_COUNT}"
+
+async def on_startup(bots: tuple[Bot, ...]):
+    global shard_lock
+    # Воркеры шардов стартуют одновременно: таблицы создает кто-то один
+    async with advisory_lock("startup"):
+        for bot in bots:
+            with bot_scope(bot_namespace(bot.id)):
+                await create_tables()
     logging.info("База данных готова к работе")
-    logging.info("Команды бота установлены")
+    if SHARD_INDEX in (None, 0):
+        for bot in bots:
+            await set_bot_commands(bot)
+        logging.info("Команды бота установлены")
+
+    if SHARD_INDEX is not None:
+        # Гарантирует, что шард (его таймеры и состояние чатов) обслуживает один процесс,
+        # даже если старый воркер еще не завершился
+        shard_lock = await acquire_singleton_lock(SHARD_LOCK_NAME, wait=True)
+        logging.info(f"Воркер шарда {SHARD_INDEX} из {SHARD_COUNT} запущен")
+
+    bookkeeping.start()
+    audit_log.start()
+    message_log.start()
+    overload.add_queue_source(bookkeeping.queue_size)
+    overload.start()
+
+    for bot in bots:
+        # Таблицы, таймеры и кэши каждого бота - в его пространстве имен
+        with bot_scope(bot_namespace(bot.id)):
+            # Восстанавливаем таймеры (кики по капче, размуты), не выполненные до перезапуска
+            timers.start(bot)
+            restored = await timers.load_pending()
+            logging.info(f"Восстановлено таймеров бота {bot.id}: {restored}")
+
+            loaded = await global_bans.refresh()
+            logging.info(f"Загружено записей общего бан-листа бота {bot.id}: {loaded}")
+
+            if PREWARM_CACHES:
+                try:
+                    await prewarm()
+                except Exception as e:
+                    logging.error(f"Не удалось прогреть кэши бота {bot.id}: {e}")
+
+    # Слушаем изменения стоп-слов, триггеров и настроек от других инстансов
+    start_background_task(run_cache_listener(msg_filters.apply_cache_event))
+    start_background_task(report_metrics())
+    start_background_task(sweep_expired_warnings(bots))
+
+async def on_shutdown():
+    await bookkeeping.stop()
+    await audit_log.stop()
+    await message_log.stop()
+    # Не теряем накопленные сводки логов
+    await log_digest.flush_all()
+    if shard_lock is not None:
+        await release_singleton_lock(shard_lock, SHARD_LOCK_NAME)
 
 async def main():
-    storage = MemoryStorage()
-    bot = Bot(token=os.getenv("BOT_TOKEN"))
-    dp = Dispatcher(storage=storage)
+    global chat_dispatcher
+    # Все боты (BOT_TOKENS или один BOT_TOKEN) делят одну HTTP-сессию, пул БД и кэши.
+    # Все запросы к API идут через планировщик с лимитами и приоритетами.
+    session = AiohttpSession()
+    session.middleware(outbound)
+    bots = [Bot(token=token, session=session) for token in get_bot_tokens()]
+    # FSM, антифлуд и капча живут в общем хранилище (Redis при заданном REDIS_URL).
+    # Стандартный FSM-мидлварь заменен на SharedStateMiddleware, читающий все за один запрос.
+    dp = Dispatcher(storage=state_backend.fsm, disable_fsm=True)
+
+    @dp.update.outer_middleware()
+    async def bot_scope_middleware(handler, event: types.Update, data):
+        # Схема БД и ключи кэшей бота, получившего апдейт; ставится до всех остальных мидлварей
+        with bot_scope(bot_namespace(data['bot'].id)):
+            return await handler(event, data)
+
+    dp.update.outer_middleware(SharedStateMiddleware(state_backend))
 
     dp['log_action'] = log_action
-    dp['bot'] = bot
 
     @dp.message.middleware()
     async def user_register_middleware(handler, event: types.Message, data):
         if event.text and event.text.startswith('/'):
             return await handler(event, data)
 
-        bot = data['bot']
-        await upsert_user(event.from_user)
-        if event.chat.type != 'private':
-            await add_chat(event.chat.id)
-            await get_or_create_user_profile(event.from_user.id, event.chat.id)
-            await log_message(event.chat.id, event.from_user.id)
-            
-            new_level, leveled_up = await add_xp(event.from_user.id, event.chat.id, 1)
-            
-            if leveled_up:
-                await event.answer(f"🎉 Поздравляем {event.from_user.mention_html()}, вы достигли {new_level} уровня!", parse_mode="HTML")
+        # ID сообщения записывается всегда (нужен /purge во время флуда), пачками в фоне
+        if event.from_user is not None and event.chat.type != 'private':
+            message_log.record(event.chat.id, event.from_user.id, event.message_id)
+
+        # Учет идет в фоне: модерация не ждет записи опыта.
+        # При перегрузке опыт и профили не обновляются.
+        if event.from_user is not None and not overload.should_shed("bookkeeping"):
+            bookkeeping.submit(record_activity, event)
 
         return await handler(event, data)
 
@@ -73,9 +288,36 @@ async def main():
     dp.include_router(msg_filters.router)
 
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+    if is_front():
+        # Фронт только принимает апдейты и раздает их воркерам по чатам
+        router = ShardRouter(dp)
+        if RUN_MODE == "webhook":
+            await run_webhook(bots, router)
+        else:
+            allowed_updates = dp.resolve_used_update_types()
+            for bot in bots:
+                await bot.delete_webhook(drop_pending_updates=True)
+            async with router.running(*bots):
+                await asyncio.gather(*(poll_updates(bot, allowed_updates, router.submit) for bot in bots))
+        return
+
+    if RUN_MODE == "webhook" or DISPATCH_MODE == "chat_queue":
+        chat_dispatcher = ChatDispatcher(dp)
+        overload.add_queue_source(chat_dispatcher.queue_depth)
+
+    if RUN_MODE == "webhook":
+        # Вебхук всегда работает через очереди чатов
+        await run_webhook(bots, chat_dispatcher)
+        return
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    for bot in bots:
+        await bot.delete_webhook(drop_pending_updates=True)
+    if chat_dispatcher is not None:
+        await chat_dispatcher.run_polling(*bots)
+    else:
+        await dp.start_polling(*bots)
 
 if __name__ == "__main__":
     asyncio.run(main())
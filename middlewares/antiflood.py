@@ -1,76 +1,97 @@
 # middlewares/antiflood.py
 
-import asyncio
 import logging
 from typing import Callable, Dict, Any, Awaitable
-from collections import defaultdict
 from datetime import timedelta
-import time
 
 from aiogram import BaseMiddleware
 from aiogram.types import Message, ChatPermissions
 
-user_messages = defaultdict(lambda: defaultdict(list))
+from handlers.filters import get_cached_chat_settings
+from utils.state_backend import state_backend
+from utils.timers import timers
+from utils.audit import audit_log
+
+# Значения по умолчанию, если в настройках чата ничего не задано
+DEFAULT_MSG_LIMIT = 3
+DEFAULT_TIME_LIMIT_SECONDS = 2
+DEFAULT_MUTE_DURATION_MINUTES = 2
+NOTICE_LIFETIME_SECONDS = 10
+
+
+def get_antiflood_config(settings: dict) -> tuple[bool, int, int, int]:
+    """Возвращает (включен, лимит сообщений, окно в секундах, длительность мута в минутах)."""
+    return (
+        settings.get('antiflood_enabled', True),
+        settings.get('antiflood_limit', DEFAULT_MSG_LIMIT),
+        settings.get('antiflood_seconds', DEFAULT_TIME_LIMIT_SECONDS),
+        settings.get('antiflood_mute_minutes', DEFAULT_MUTE_DURATION_MINUTES),
+    )
 
-class AntiFloodMiddleware(BaseMiddleware):
-    MSG_LIMIT = 3
-    TIME_LIMIT_SECONDS = 2
-    MUTE_DURATION_MINUTES = 2
 
+async def get_flood_params(message: Message) -> tuple[float, float] | None:
+    """Параметры token bucket (емкость, пополнение в секунду) или None, если проверка не нужна."""
+    if message.chat.type not in ('group', 'supergroup') or message.from_user is None:
+        return None
+    enabled, msg_limit, time_limit, _ = get_antiflood_config(await get_cached_chat_settings(message.chat.id))
+    if not enabled:
+        return None
+    # msg_limit сообщений за time_limit секунд - уже флуд, поэтому без флуда проходит на одно меньше
+    capacity = max(msg_limit - 1, 1)
+    return capacity, capacity / time_limit
+
+
+class AntiFloodMiddleware(BaseMiddleware):
     async def __call__(
         self,
         handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
         event: Message,
         data: Dict[str, Any]
     ) -> Any:
-        
-        # Мидлварь зарегистрирован на dp.message, так что event всегда будет Message
-        # Проверяем только то, что сообщение пришло из группы
-        if event.chat.type not in ('group', 'supergroup'):
+
+        # Обычно токен уже списан в SharedStateMiddleware тем же запросом, что и чтение FSM
+        allowed = data.get("flood_allowed")
+        if allowed is None:
+            flood = await get_flood_params(event)
+            if flood is None:
+                return await handler(event, data)
+            allowed = await state_backend.consume_flood_token(event.chat.id, event.from_user.id, *flood)
+
+        if allowed:
+            # Если флуда нет, передаем управление дальше
             return await handler(event, data)
 
         chat_id = event.chat.id
         user_id = event.from_user.id
-        current_time = time.time()
-
-        # Очищаем список от временных меток, которые старше TIME_LIMIT_SECONDS
-        user_messages[chat_id][user_id] = [
-            t for t in user_messages[chat_id][user_id] if current_time - t < self.TIME_LIMIT_SECONDS
-        ]
-
-        # Добавляем время текущего сообщения
-        user_messages[chat_id][user_id].append(current_time)
-
-        # Проверяем, превышен ли лимит
-        if len(user_messages[chat_id][user_id]) >= self.MSG_LIMIT:
-            # Добавим лог, чтобы точно видеть срабатывание
-            logging.info(f"!!! ОБНАРУЖЕН ФЛУД от user_id={user_id} в chat_id={chat_id} !!!")
-            try:
-                # Сначала выдаем мут
-                mute_duration = timedelta(minutes=self.MUTE_DURATION_MINUTES)
-                await event.bot.restrict_chat_member(
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    permissions=ChatPermissions(can_send_messages=False),
-                    until_date=mute_duration
-                )
-                
-                # Затем удаляем сообщение, вызвавшее флуд
-                await event.delete()
-                
-                # Отправляем уведомление и планируем его удаление
-                msg = await event.answer(
-                    f"🔇 Пользователь {event.from_user.mention_html()} замучен на {self.MUTE_DURATION_MINUTES} минут за флуд.",
-                    parse_mode="HTML"
-                )
-                await asyncio.sleep(10)
-                await msg.delete()
-
-            except Exception as e:
-                logging.error(f"Ошибка в анти-флуде: {e}")
-            
-            # Останавливаем дальнейшую обработку сообщения
-            return
-        
-        # Если флуда нет, передаем управление дальше
-        return await handler(event, data)
\ No newline at end of file
+        mute_minutes = get_antiflood_config(await get_cached_chat_settings(chat_id))[3]
+
+        # Добавим лог, чтобы точно видеть срабатывание
+        logging.info(f"!!! ОБНАРУЖЕН ФЛУД от user_id={user_id} в chat_id={chat_id} !!!")
+        # Пока пользователь замучен, новые сообщения не должны снова запускать мут
+        await state_backend.reset_flood(chat_id, user_id)
+        try:
+            # Сначала выдаем мут
+            await event.bot.restrict_chat_member(
+                chat_id=chat_id,
+                user_id=user_id,
+                permissions=ChatPermissions(can_send_messages=False),
+                until_date=timedelta(minutes=mute_minutes)
+            )
+            audit_log.record(chat_id, "mute", user_id, None, "флуд", timedelta(minutes=mute_minutes))
+
+            # Затем удаляем сообщение, вызвавшее флуд
+            await event.delete()
+
+            # Отправляем уведомление, а его удаление отдаем планировщику таймеров,
+            # чтобы не держать обработку апдейта
+            msg = await event.answer(
+                f"🔇 Пользователь {event.from_user.mention_html()} замучен на {mute_minutes} минут за флуд.",
+                parse_mode="HTML"
+            )
+            await timers.schedule("delete_message", NOTICE_LIFETIME_SECONDS, chat_id, message_id=msg.message_id)
+
+        except Exception as e:
+            logging.error(f"Ошибка в анти-флуде: {e}")
+
+        # Останавливаем дальнейшую обработку сообщения
+        return
@@ -0,0 +1,46 @@
+# middlewares/shared_state.py
+
+from typing import Callable, Dict, Any, Awaitable, cast
+
+from aiogram import Bot
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.storage.memory import DisabledEventIsolation
+from aiogram.types import TelegramObject, Update
+
+from middlewares.antiflood import get_flood_params
+from utils.state_backend import StateBackend
+
+
+class SharedStateMiddleware(FSMContextMiddleware):
+    """
+    Замена стандартного FSM-мидлваря: состояние FSM и токен антифлуда
+    читаются из общего хранилища одним запросом (пайплайном) на апдейт.
+    Результат антифлуда кладется в data["flood_allowed"].
+    """
+
+    def __init__(self, backend: StateBackend):
+        super().__init__(storage=backend.fsm, events_isolation=DisabledEventIsolation())
+        self.backend = backend
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        bot = cast(Bot, data["bot"])
+        context = self.resolve_event_context(bot, data)
+        data["fsm_storage"] = self.storage
+        if context is None:
+            return await handler(event, data)
+
+        flood = None
+        if isinstance(event, Update) and event.message is not None:
+            flood = await get_flood_params(event.message)
+
+        async with self.events_isolation.lock(key=context.key):
+            raw_state, flood_allowed = await self.backend.prefetch(context.key, flood)
+            data.update({"state": context, "raw_state": raw_state})
+            if flood_allowed is not None:
+                data["flood_allowed"] = flood_allowed
+            return await handler(event, data)
@@ -4,7 +4,10 @@ from aiogram.fsm.state import State, StatesGroup
 class SettingsStates(StatesGroup):
     # Состояния для настроек
     waiting_for_warn_limit = State()
+    waiting_for_warn_ttl = State()
     waiting_for_captcha_timeout = State()
+    waiting_for_antiflood_limit = State()
+    waiting_for_antiflood_mute = State()
     
     # Состояния для контента
     waiting_for_welcome_message = State()
@@ -0,0 +1,81 @@
+import asyncio
+
+from utils.batch_writer import BatchWriter
+from utils.tenancy import bot_scope, current_bot_id
+
+
+def make_writer(write=None, batch_size=2, buffer_limit=3) -> tuple[BatchWriter, list]:
+    written = []
+
+    async def record(rows):
+        written.append(list(rows))
+
+    return BatchWriter("test", write or record, flush_seconds=60, batch_size=batch_size,
+                       buffer_limit=buffer_limit), written
+
+
+def test_full_buffer_drops_oldest_rows():
+    writer, written = make_writer()
+    for i in range(5):
+        writer._append({"i": i})
+    assert writer.stats["dropped"] == 2
+    asyncio.run(writer.flush())
+    assert written == [[{"i": 2}, {"i": 3}], [{"i": 4}]]
+    assert (writer.stats["written"], writer.stats["batches"], writer.pending_count()) == (3, 2, 0)
+
+
+def test_rows_are_written_per_bot():
+    writes = []
+
+    async def write(rows):
+        writes.append((current_bot_id.get(), [row["i"] for row in rows]))
+
+    writer, _ = make_writer(write, batch_size=10)
+    with bot_scope(1):
+        writer._append({"i": 1})
+    with bot_scope(2):
+        writer._append({"i": 2})
+    asyncio.run(writer.flush())
+    assert sorted(writes) == [(1, [1]), (2, [2])]
+
+
+def test_failed_batch_returns_to_buffer_in_order():
+    failures = [True]
+    written = []
+
+    async def write(rows):
+        if failures.pop():
+            raise ConnectionError("БД недоступна")
+        written.extend(row["i"] for row in rows)
+
+    writer, _ = make_writer(write, batch_size=2)
+    for i in range(3):
+        writer._append({"i": i})
+    asyncio.run(writer.flush())
+    assert writer.stats["errors"] == 1 and writer.pending_count() == 3
+    failures.extend([False, False])
+    asyncio.run(writer.flush())
+    assert written == [0, 1, 2]
+
+
+def test_rows_added_during_write_are_not_lost():
+    async def scenario():
+        written = []
+
+        async def slow_write(rows):
+            if not written:
+                # Пока пишется первый пакет, буфер успевает заполниться и вытеснить старые строки
+                for i in range(10, 14):
+                    writer._append({"i": i})
+            written.extend(row["i"] for row in rows)
+
+        writer = BatchWriter("test", slow_write, flush_seconds=60, batch_size=2, buffer_limit=3)
+        writer._append({"i": 0})
+        writer._append({"i": 1})
+        await writer.flush()
+        return written, writer.stats["dropped"]
+
+    written, dropped = asyncio.run(scenario())
+    # Первый пакет целиком, затем три самых новых строки; строка 10 вытеснена
+    assert written == [0, 1, 11, 12, 13]
+    assert dropped == 1
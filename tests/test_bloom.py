@@ -0,0 +1,34 @@
+import random
+
+from utils.bloom import BloomFilter
+
+
+def test_added_keys_are_always_found():
+    bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+    keys = random.Random(1).sample(range(-10**12, 10**12), 10_000)
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+
+def test_false_positive_rate_is_close_to_error_rate():
+    bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+    for key in range(10_000):
+        bloom.add(key)
+    probes = range(10**9, 10**9 + 50_000)
+    false_positives = sum(key in bloom for key in probes)
+    assert false_positives / len(probes) < 0.02
+
+
+def test_empty_filter_contains_nothing():
+    bloom = BloomFilter(capacity=100)
+    assert not any(key in bloom for key in range(1000))
+
+
+def test_is_full_after_capacity():
+    bloom = BloomFilter(capacity=3)
+    for key in range(3):
+        bloom.add(key)
+    assert not bloom.is_full()
+    bloom.add(3)
+    assert bloom.is_full()
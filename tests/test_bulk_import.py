@@ -0,0 +1,128 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from db.models import Trigger
+from db.requests import add_stop_words, add_triggers, _create_added_index
+from utils.bulk_import import parse_stop_words, parse_triggers, iter_document_lines, BulkImportError
+import utils.bulk_import as bulk_import_module
+from conftest import FakeResult
+
+
+async def lines_of(text: str):
+    for line in text.splitlines():
+        yield line
+
+
+def test_stop_words_are_lowercased_and_deduplicated():
+    text = "# комментарий\nКазино\n\nказино\n\"ставки, бонусы\",лишнее\n  Спам  \n"
+    assert asyncio.run(parse_stop_words(lines_of(text))) == ["казино", "ставки, бонусы", "спам"]
+
+
+def test_triggers_take_last_answer_and_skip_bad_rows():
+    text = "Привет,Здравствуйте!\nпривет,<b>Добрый день</b>\nбез ответа\nправила,\"Читайте, пожалуйста\""
+    triggers, skipped = asyncio.run(parse_triggers(lines_of(text)))
+    assert triggers == {"привет": "&lt;b&gt;Добрый день&lt;/b&gt;", "правила": "Читайте, пожалуйста"}
+    assert skipped == 1
+
+
+def test_too_many_items_are_rejected(monkeypatch):
+    monkeypatch.setattr(bulk_import_module, "IMPORT_MAX_ITEMS", 2)
+    with pytest.raises(BulkImportError):
+        asyncio.run(parse_stop_words(lines_of("a\nb\nc")))
+
+
+def test_document_lines_survive_chunk_boundaries():
+    data = "\ufeffпервая\r\nвторая\nтретья".encode("utf-8")
+
+    async def stream_content(url, raise_for_status):
+        # Куски по 3 байта режут и строки, и двухбайтовые символы
+        for start in range(0, len(data), 3):
+            yield data[start:start + 3]
+
+    api = SimpleNamespace(is_local=False, file_url=lambda token, path: path)
+    bot = SimpleNamespace(token="42:TEST", session=SimpleNamespace(api=api, stream_content=stream_content))
+
+    async def get_file(file_id):
+        return SimpleNamespace(file_path="documents/file.txt")
+
+    bot.get_file = get_file
+    document = SimpleNamespace(file_id="f", file_size=len(data))
+
+    async def collect():
+        return [line async for line in iter_document_lines(bot, document)]
+
+    assert asyncio.run(collect()) == ["первая", "вторая", "третья"]
+
+
+def test_document_from_local_server_is_read_from_buffer():
+    api = SimpleNamespace(is_local=True)
+
+    async def get_file(file_id):
+        return SimpleNamespace(file_path="/var/lib/file.txt")
+
+    async def download_file(path):
+        return io.BytesIO("одна\nдве\n".encode("utf-8"))
+
+    bot = SimpleNamespace(session=SimpleNamespace(api=api), get_file=get_file, download_file=download_file)
+
+    async def collect():
+        return [line async for line in iter_document_lines(bot, SimpleNamespace(file_id="f", file_size=None))]
+
+    assert asyncio.run(collect()) == ["одна", "две"]
+
+
+def test_too_large_document_is_rejected():
+    document = SimpleNamespace(file_id="f", file_size=bulk_import_module.IMPORT_MAX_FILE_BYTES + 1)
+
+    async def collect():
+        return [line async for line in iter_document_lines(SimpleNamespace(), document)]
+
+    with pytest.raises(BulkImportError):
+        asyncio.run(collect())
+
+
+def test_stop_words_are_inserted_with_one_unnest_query(fake_db):
+    fake_db.results.append(FakeResult([(1,), (2,)]))
+    added = asyncio.run(add_stop_words(-100, ["казино", "ставки", "спам"]))
+    assert added == 2
+    insert_sql, notify_sql = fake_db.sql(0), fake_db.sql(1)
+    assert "INSERT INTO stop_words (chat_id, word) SELECT" in insert_sql
+    assert "unnest(" in insert_sql
+    assert "ON CONFLICT (chat_id, word) DO NOTHING" in insert_sql
+    assert ["казино", "ставки", "спам"] in fake_db.params(0).values()
+    # Одно уведомление кэшей на весь импорт
+    assert len(fake_db.statements) == 2 and "pg_notify" in notify_sql
+
+
+def test_import_without_new_stop_words_does_not_notify(fake_db):
+    assert asyncio.run(add_stop_words(-100, ["казино"])) == 0
+    assert len(fake_db.statements) == 1
+
+
+def test_triggers_are_inserted_with_parallel_unnest(fake_db):
+    fake_db.results.append(FakeResult([(1,)]))
+    assert asyncio.run(add_triggers(-100, {"привет": "Здравствуйте", "правила": "Читайте"})) == 1
+    sql, params = fake_db.sql(0), fake_db.params(0)
+    assert sql.count("unnest(") == 2
+    assert "ON CONFLICT (chat_id, keyword) DO NOTHING" in sql
+    assert ["привет", "правила"] in params.values() and ["Здравствуйте", "Читайте"] in params.values()
+
+
+def test_duplicates_keep_latest_row_before_unique_index(fake_db, caplog):
+    index = next(index for index in Trigger.__table__.indexes if index.unique)
+    fake_db.results.extend([FakeResult(), FakeResult(rowcount=3)])
+    asyncio.run(_create_added_index(fake_db, index, None))
+    assert "DELETE FROM triggers a USING triggers b WHERE a.chat_id = b.chat_id AND a.keyword = b.keyword " \
+           "AND a.id < b.id" in fake_db.sql(1)
+    assert "CREATE UNIQUE INDEX IF NOT EXISTS" in fake_db.sql(2)
+    assert "удалено повторов в triggers: 3" in caplog.text
+
+
+def test_existing_index_skips_dedupe(fake_db):
+    index = next(index for index in Trigger.__table__.indexes if index.unique)
+    fake_db.results.append(FakeResult([("ix",)]))
+    asyncio.run(_create_added_index(fake_db, index, None))
+    assert len(fake_db.statements) == 1
@@ -0,0 +1,75 @@
+import pytest
+
+import utils.cache as cache_module
+from utils.cache import BoundedCache, approx_size
+from utils.tenancy import bot_scope
+
+
+def test_lru_eviction_by_item_count():
+    cache = BoundedCache("test_lru", max_items=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.get("a") == 1  # "a" становится самым свежим
+    cache["c"] = 3
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_eviction_by_byte_budget():
+    cache = BoundedCache("test_bytes", max_items=100, max_bytes=approx_size("x" * 100) * 2)
+    for key in range(3):
+        cache[key] = "x" * 100
+    assert len(cache) == 2
+    assert 0 not in cache
+
+
+def test_reassignment_recounts_size():
+    cache = BoundedCache("test_resize", max_items=10)
+    cache["words"] = {"a"}
+    small = cache.stats()["bytes"]
+    cache["words"] = {"a", "b", "c", "d"}
+    assert cache.stats()["bytes"] > small
+    cache.pop("words")
+    assert cache.stats()["bytes"] == 0
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = BoundedCache("test_ttl", ttl=10)
+    cache["a"] = 1
+    now[0] += 9
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+    assert "a" not in cache
+
+
+def test_hit_and_miss_counters():
+    cache = BoundedCache("test_counters")
+    cache["a"] = 1
+    cache.get("a")
+    cache.get("b")
+    # Проверка наличия счетчики не трогает
+    assert "a" in cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_keys_are_separated_by_bot():
+    cache = BoundedCache("test_tenancy")
+    with bot_scope(1):
+        cache["settings"] = "bot 1"
+    with bot_scope(2):
+        assert cache.get("settings") is None
+        cache["settings"] = "bot 2"
+    with bot_scope(1):
+        assert cache["settings"] == "bot 1"
+
+
+def test_missing_key_raises():
+    cache = BoundedCache("test_missing")
+    with pytest.raises(KeyError):
+        cache["nope"]
+    with pytest.raises(KeyError):
+        del cache["nope"]
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import handlers.events as events
+import handlers.filters as filters
+from utils.raid import RaidGuard
+
+CHAT_ID = -100
+
+
+@pytest.fixture(autouse=True)
+def no_settings_queries(monkeypatch):
+    async def query(chat_id):
+        raise AssertionError("настройки должны браться из кэша")
+
+    monkeypatch.setattr(filters, "get_chat_settings_snapshot", query)
+    monkeypatch.setattr(events, "raid_guard", RaidGuard(threshold=3, window=60, cooldown=60))
+    filters.settings_cache.clear()
+    yield
+    filters.settings_cache.clear()
+
+
+def make_join(user_ids: list[int], answers: list):
+    async def answer(text, **kwargs):
+        answers.append(text)
+        return SimpleNamespace(message_id=len(answers))
+
+    members = [SimpleNamespace(id=user_id, mention_html=lambda: "user") for user_id in user_ids]
+    return SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID), new_chat_members=members, answer=answer)
+
+
+def test_clean_join_reads_cached_settings(monkeypatch):
+    filters.settings_cache[CHAT_ID] = ({"federation_enabled": True, "welcome_message": "Привет"}, 1)
+    checked = []
+
+    async def check(user_ids):
+        checked.extend(user_ids)
+        return set()
+
+    async def render(template, members, chat, bot):
+        return template
+
+    monkeypatch.setattr(events.global_bans, "check", check)
+    monkeypatch.setattr(events, "render_template", render)
+    answers = []
+    asyncio.run(events.new_chat_member_handler(make_join([7], answers), SimpleNamespace(id=999), log_action=None))
+    assert checked == [7]
+    assert answers == ["Привет"]
+
+
+def test_raid_joins_do_not_query_settings(monkeypatch):
+    filters.settings_cache[CHAT_ID] = ({"captcha_timeout": 60}, 1)
+    batches = []
+
+    async def raid_captcha(message, members, bot, captcha_timeout):
+        batches.append([member.id for member in members])
+
+    async def log_action(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(events, "raid_captcha", raid_captcha)
+    for user_id in range(5):
+        asyncio.run(events.new_chat_member_handler(make_join([user_id], []), SimpleNamespace(id=999),
+                                                   log_action=log_action))
+    # Рейд начинается на третьем входе (порог 3)
+    assert batches == [[2], [3], [4]]
+
+
+def test_leave_reads_cached_settings(monkeypatch):
+    filters.settings_cache[CHAT_ID] = ({"goodbye_message": "Пока"}, 1)
+
+    async def render(template, members, chat, bot):
+        return template
+
+    monkeypatch.setattr(events, "render_template", render)
+    answers = []
+
+    async def answer(text, **kwargs):
+        answers.append(text)
+
+    message = SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID), left_chat_member=SimpleNamespace(id=7),
+                              answer=answer)
+    asyncio.run(events.left_chat_member_handler(message, SimpleNamespace(id=999)))
+    assert answers == ["Пока"]
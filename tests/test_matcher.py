@@ -0,0 +1,52 @@
+import random
+
+import utils.matcher as matcher_module
+from utils.matcher import PhraseMatcher
+
+
+def naive_search(phrases, text):
+    """Самая левая фраза, из начинающихся в одной позиции - самая длинная."""
+    found = [(text.find(phrase), -len(phrase), phrase) for phrase in phrases if phrase and phrase in text]
+    return min(found)[2] if found else None
+
+
+def test_leftmost_match_wins():
+    matcher = PhraseMatcher(["казино", "ставки"])
+    assert matcher.search("лучшие ставки и казино") == "ставки"
+
+
+def test_longest_phrase_at_same_position_wins():
+    matcher = PhraseMatcher(["ab", "abcd", "abc"])
+    assert matcher.search("xxabcdx") == "abcd"
+    assert matcher.search("xxabcx") == "abc"
+    assert matcher.search("xxabx") == "ab"
+
+
+def test_special_characters_are_literal():
+    matcher = PhraseMatcher(["t.me/", "(спам)"])
+    assert matcher.search("ссылка tXme/abc") is None
+    assert matcher.search("ссылка t.me/abc") == "t.me/"
+    assert matcher.search("это (спам)!") == "(спам)"
+
+
+def test_empty_matcher_finds_nothing():
+    assert PhraseMatcher([]).search("любой текст") is None
+    assert PhraseMatcher([""]).search("любой текст") is None
+
+
+def test_matches_naive_search_on_random_phrases():
+    rng = random.Random(7)
+    for _ in range(300):
+        phrases = ["".join(rng.choices("abc", k=rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = "".join(rng.choices("abcd", k=rng.randint(0, 20)))
+        assert PhraseMatcher(phrases).search(text) == naive_search(phrases, text), (phrases, text)
+
+
+def test_falls_back_to_plain_search(monkeypatch):
+    def too_deep(phrases):
+        raise RecursionError
+
+    monkeypatch.setattr(matcher_module, "_trie_pattern", too_deep)
+    matcher = PhraseMatcher(["спам", "спамер"])
+    assert matcher.search("тут спамер") == "спамер"
+    assert matcher.search("тут реклама") is None
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import handlers.admin as admin
+from db.requests import get_moderation_events
+
+START = datetime(2026, 10, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+
+
+def make_events(count: int, first_id: int = 100):
+    return [
+        SimpleNamespace(id=first_id - i, created_at=START - timedelta(minutes=i), action="ban", target_id=7,
+                        actor_id=None, duration_seconds=None, reason=None)
+        for i in range(count)
+    ]
+
+
+def test_first_page_has_no_key_condition(fake_db):
+    asyncio.run(get_moderation_events(-100, limit=10))
+    sql = fake_db.sql()
+    assert "(moderation_events.created_at, moderation_events.id) <" not in sql
+    assert "ORDER BY moderation_events.created_at DESC, moderation_events.id DESC" in sql
+    assert "OFFSET" not in sql
+
+
+def test_next_page_seeks_by_key(fake_db):
+    asyncio.run(get_moderation_events(-100, target_id=7, before=(START, 91), limit=10))
+    sql, params = fake_db.sql(), fake_db.params()
+    assert "(moderation_events.created_at, moderation_events.id) < (" in sql
+    assert "moderation_events.target_id = " in sql
+    assert "OFFSET" not in sql
+    assert START in params.values() and 91 in params.values()
+
+
+def test_cursor_of_full_page_points_to_its_last_event(monkeypatch):
+    requested = []
+
+    async def fake_get_moderation_events(chat_id, target_id, before, limit):
+        requested.append(before)
+        return make_events(limit) if before is None else make_events(3, first_id=90)
+
+    async def is_admin(chat, user_id, bot):
+        return True
+
+    edited = []
+
+    async def edit_text(text, **kwargs):
+        edited.append((text, kwargs["reply_markup"]))
+
+    async def answer(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(admin, "get_moderation_events", fake_get_moderation_events)
+    monkeypatch.setattr(admin, "is_user_admin_silent", is_admin)
+
+    async def scenario():
+        _, keyboard = await admin.render_modlog(-100, 7)
+        next_button, = keyboard.inline_keyboard[0]
+        callback = SimpleNamespace(data=next_button.callback_data, from_user=SimpleNamespace(id=1),
+                                   message=SimpleNamespace(chat=SimpleNamespace(id=-100), edit_text=edit_text),
+                                   answer=answer)
+        await admin.callback_modlog_page(callback, bot=None)
+
+    asyncio.run(scenario())
+    last = make_events(admin.MODLOG_PAGE_SIZE)[-1]
+    # Курсор без потерь переносит время до микросекунды и ID последней записи
+    assert requested == [None, (last.created_at, last.id)]
+    text, keyboard = edited[0]
+    # Неполная страница - последняя: остается только возврат в начало
+    assert [button.text for button in keyboard.inline_keyboard[0]] == ["⏮ В начало"]
+
+
+def test_empty_log_has_no_keyboard(monkeypatch):
+    async def no_events(*args):
+        return []
+
+    monkeypatch.setattr(admin, "get_moderation_events", no_events)
+    text, keyboard = asyncio.run(admin.render_modlog(-100, None))
+    assert "Записей нет" in text and keyboard is None
+
+
+def test_page_format_marks_automatic_actions():
+    event = make_events(1)[0]
+    event.duration_seconds = 3600
+    event.reason = "<спам>"
+    line = admin.format_modlog_page([event])
+    assert "автоматически" in line
+    assert "1:00:00" in line
+    assert "&lt;спам&gt;" in line
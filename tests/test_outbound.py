@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.methods import SendMessage, DeleteMessages
+
+from utils.outbound import OutboundScheduler, TokenBucket, Priority, outbound_priority
+from utils.state_backend import FloodBucket
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(capacity=2, rate=1.0)
+    now = bucket.updated
+    assert bucket.wait_time(now) == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.wait_time(now) == pytest.approx(1.0)
+    assert bucket.wait_time(now + 0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(now + 1.0) == 0
+
+
+def test_token_bucket_does_not_exceed_capacity():
+    bucket = TokenBucket(capacity=2, rate=1.0)
+    now = bucket.updated + 100
+    bucket.wait_time(now)
+    assert bucket.tokens == 2
+
+
+def test_token_bucket_block_overrides_tokens():
+    bucket = TokenBucket(capacity=5, rate=5.0)
+    bucket.block(3)
+    assert bucket.wait_time(bucket.updated) > 2.5
+
+
+def test_flood_bucket_consumes_and_refills():
+    bucket = FloodBucket(tokens=2, updated=0.0)
+    assert [bucket.consume(2, 0.5, 0.0) for _ in range(3)] == [True, True, False]
+    assert bucket.consume(2, 0.5, 2.0)
+    assert not bucket.consume(2, 0.5, 2.0)
+
+
+def test_explicit_priority_overrides_method_default():
+    scheduler = OutboundScheduler()
+    delete = DeleteMessages(chat_id=-1, message_ids=[1, 2])
+    assert scheduler._priority(delete) == Priority.MODERATION
+    assert scheduler._priority(SendMessage(chat_id=-1, text="x")) == Priority.NORMAL
+    with outbound_priority(Priority.LOW):
+        assert scheduler._priority(delete) == Priority.LOW
+
+
+def test_waiters_are_served_by_priority():
+    async def scenario():
+        scheduler = OutboundScheduler()
+        bot = SimpleNamespace(id=1)
+        global_bucket = scheduler._global_bucket(bot)
+        global_bucket.block(0.05)
+        order = []
+
+        async def acquire(priority, name):
+            await scheduler._acquire(global_bucket, None, priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(acquire(Priority.LOW, "low")),
+                 asyncio.create_task(acquire(Priority.NORMAL, "normal")),
+                 asyncio.create_task(acquire(Priority.MODERATION, "moderation"))]
+        await asyncio.wait_for(asyncio.gather(*tasks), 2)
+        return order
+
+    assert asyncio.run(scenario()) == ["moderation", "normal", "low"]
+
+
+def test_identical_sends_coalesce_only_within_one_bot():
+    async def scenario():
+        scheduler = OutboundScheduler()
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(bot.id)
+            await asyncio.sleep(0.01)
+            return bot.id
+
+        first, second = SimpleNamespace(id=1), SimpleNamespace(id=2)
+        method = SendMessage(chat_id=-1, text="одинаковый текст")
+        results = await asyncio.gather(
+            scheduler(make_request, first, method),
+            scheduler(make_request, first, method),
+            scheduler(make_request, second, method),
+        )
+        return results, sent, scheduler.stats["coalesced"]
+
+    results, sent, coalesced = asyncio.run(scenario())
+    assert results == [1, 1, 2]
+    assert sorted(sent) == [1, 2]
+    assert coalesced == 1
+
+
+def test_rate_limit_of_one_bot_does_not_block_another():
+    async def scenario():
+        scheduler = OutboundScheduler()
+        limited, free = SimpleNamespace(id=1), SimpleNamespace(id=2)
+        scheduler._global_bucket(limited).block(60)
+
+        async def make_request(bot, method):
+            return bot.id
+
+        waiting = asyncio.create_task(scheduler(make_request, limited, SendMessage(chat_id=-1, text="a")))
+        result = await asyncio.wait_for(scheduler(make_request, free, SendMessage(chat_id=-1, text="b")), 1)
+        waiting.cancel()
+        return result
+
+    assert asyncio.run(scenario()) == 2
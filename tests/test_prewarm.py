@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+import handlers.filters as filters
+from db.requests import get_recently_active_chat_ids
+from utils.sharding import shard_for
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    for cache in (filters.settings_cache, filters.stop_words_cache, filters.triggers_cache):
+        cache.clear()
+    yield
+    for cache in (filters.settings_cache, filters.stop_words_cache, filters.triggers_cache):
+        cache.clear()
+
+
+def test_active_chats_are_filtered_by_shard_in_sql(fake_db):
+    asyncio.run(get_recently_active_chat_ids(7, 100, shard_index=1, shard_count=4))
+    sql, params = fake_db.sql(), fake_db.params()
+    assert "abs(messages.chat_id) % " in sql
+    assert 4 in params.values() and 1 in params.values()
+
+
+def test_single_process_reads_all_active_chats(fake_db):
+    asyncio.run(get_recently_active_chat_ids(7, 100))
+    assert "abs(" not in fake_db.sql()
+
+
+def test_prewarm_of_all_chats_keeps_to_own_shard(monkeypatch):
+    all_chats = [-101, -102, -103, -104, -105, -106]
+
+    async def iter_chat_settings(chat_ids, limit, shard_index, shard_count):
+        # Как и SQL-запрос: при chat_ids=None отдаются все чаты шарда
+        for chat_id in chat_ids if chat_ids is not None else all_chats:
+            if shard_for(chat_id, shard_count) == shard_index:
+                yield chat_id, {}, 1
+
+    async def iter_groups(chat_ids):
+        return
+        yield
+
+    monkeypatch.setattr(filters, "iter_chat_settings", iter_chat_settings)
+    monkeypatch.setattr(filters, "iter_stop_words_by_chat", iter_groups)
+    monkeypatch.setattr(filters, "iter_triggers_by_chat", iter_groups)
+
+    count, _ = asyncio.run(filters.prewarm_caches(None, 100, 10**6, shard_index=1, shard_count=2))
+    assert count == 3
+    assert {chat_id for chat_id in all_chats if chat_id in filters.settings_cache} == {-101, -103, -105}
+    assert filters.stop_words_cache.get(-101) == set() and filters.stop_words_cache.get(-102) is None
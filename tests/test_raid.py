@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import utils.raid as raid_module
+import handlers.callbacks as callbacks
+import handlers.events as events
+from utils.raid import RaidGuard
+
+CHAT_ID, MESSAGE_ID = -100, 50
+
+
+async def db_unavailable(*args):
+    raise ConnectionError("БД недоступна")
+
+
+async def batch_unknown(*args):
+    return None
+
+
+@pytest.fixture
+def guard(monkeypatch):
+    guard = RaidGuard(threshold=3, window=60, cooldown=60)
+    monkeypatch.setattr(callbacks, "raid_guard", guard)
+    monkeypatch.setattr(events, "raid_guard", guard)
+    return guard
+
+
+def test_memory_copy_is_used_when_batch_was_not_saved(guard, monkeypatch):
+    monkeypatch.setattr(raid_module, "add_raid_captcha_members", db_unavailable)
+    monkeypatch.setattr(raid_module, "verify_raid_captcha_member", batch_unknown)
+    monkeypatch.setattr(raid_module, "pop_raid_captcha_batch", batch_unknown)
+
+    async def scenario():
+        guard.start_batch(CHAT_ID, MESSAGE_ID, 30)
+        await guard.add_pending(CHAT_ID, MESSAGE_ID, [1, 2])
+        assert await guard.verify(CHAT_ID, MESSAGE_ID, 1) is True
+        assert await guard.verify(CHAT_ID, MESSAGE_ID, 3) is False
+        return await guard.pop_batch(CHAT_ID, MESSAGE_ID)
+
+    assert asyncio.run(scenario()) == [2]
+
+
+def test_lost_batch_is_reported_as_unknown(guard, monkeypatch):
+    monkeypatch.setattr(raid_module, "verify_raid_captcha_member", db_unavailable)
+    monkeypatch.setattr(raid_module, "pop_raid_captcha_batch", db_unavailable)
+
+    async def scenario():
+        return await guard.verify(CHAT_ID, MESSAGE_ID, 1), await guard.pop_batch(CHAT_ID, MESSAGE_ID)
+
+    assert asyncio.run(scenario()) == (None, None)
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        async def method(*args, **kwargs):
+            self.calls.append(name)
+        return method
+
+
+def make_callback(answers: list):
+    async def answer(text=None, show_alert=False):
+        answers.append(text)
+
+    return SimpleNamespace(message=SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID), message_id=MESSAGE_ID),
+                           from_user=SimpleNamespace(id=7), answer=answer)
+
+
+def test_unknown_batch_does_not_lift_restrictions(guard, monkeypatch):
+    # Пользователь замучен через /mute и нажимает кнопку капчи, пачку которой бот уже не помнит
+    monkeypatch.setattr(raid_module, "verify_raid_captcha_member", db_unavailable)
+    bot, answers = FakeBot(), []
+    asyncio.run(callbacks.callback_verify_raid(make_callback(answers), bot))
+    assert bot.calls == []
+    assert answers == ["Не удалось проверить капчу, попробуйте позже."]
+
+
+def test_pending_member_is_released(guard, monkeypatch):
+    async def verified(*args):
+        return True
+
+    monkeypatch.setattr(raid_module, "verify_raid_captcha_member", verified)
+    bot, answers = FakeBot(), []
+    asyncio.run(callbacks.callback_verify_raid(make_callback(answers), bot))
+    assert bot.calls == ["restrict_chat_member"]
+
+
+def test_lost_batch_timer_kicks_nobody_and_asks_admins(guard, monkeypatch):
+    monkeypatch.setattr(raid_module, "pop_raid_captcha_batch", batch_unknown)
+    bot = FakeBot()
+    timer = SimpleNamespace(chat_id=CHAT_ID, message_id=MESSAGE_ID)
+    asyncio.run(events.kick_raid_batch(bot, timer))
+    assert bot.calls == ["edit_message_text"]
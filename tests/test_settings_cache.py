@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import handlers.filters as filters
+from handlers.filters import settings_cache, apply_settings_change, apply_cache_event, get_settings_snapshot
+
+CHAT_ID = -100
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    settings_cache.clear()
+    yield
+    settings_cache.clear()
+
+
+def test_next_version_is_patched_in_place():
+    settings_cache[CHAT_ID] = ({"antiflood": False, "warn_limit": 3}, 4)
+    apply_settings_change(CHAT_ID, {"antiflood": True}, 5)
+    assert settings_cache[CHAT_ID] == ({"antiflood": True, "warn_limit": 3}, 5)
+
+
+def test_skipped_versions_drop_the_snapshot():
+    settings_cache[CHAT_ID] = ({"antiflood": False}, 4)
+    # Версию 5 сохранил другой инстанс, и ее изменений в кэше нет
+    apply_settings_change(CHAT_ID, {"warn_limit": 5}, 6)
+    assert CHAT_ID not in settings_cache
+
+
+def test_older_version_is_ignored():
+    settings_cache[CHAT_ID] = ({"antiflood": True}, 7)
+    apply_settings_change(CHAT_ID, {"antiflood": False}, 6)
+    assert settings_cache[CHAT_ID] == ({"antiflood": True}, 7)
+
+
+def test_change_without_snapshot_does_not_create_one():
+    apply_settings_change(CHAT_ID, {"antiflood": True}, 1)
+    assert CHAT_ID not in settings_cache
+
+
+@pytest.mark.parametrize("cached_version, event_version, kept", [
+    (5, 5, True),    # собственное изменение, уже пропатченное
+    (6, 5, True),    # запоздавшее событие
+    (4, 5, False),   # чужое изменение
+    (5, None, False),  # событие без версии
+])
+def test_settings_event_respects_versions(cached_version, event_version, kept):
+    settings_cache[CHAT_ID] = ({"antiflood": True}, cached_version)
+    apply_cache_event({"event": "settings_changed", "bot": None, "chat_id": CHAT_ID, "version": event_version})
+    assert (CHAT_ID in settings_cache) == kept
+
+
+def test_snapshot_is_loaded_once(monkeypatch):
+    loads = []
+
+    async def load(chat_id):
+        loads.append(chat_id)
+        return {"antiflood": True}, 3
+
+    monkeypatch.setattr(filters, "get_chat_settings_snapshot", load)
+
+    async def scenario():
+        first = await get_settings_snapshot(CHAT_ID)
+        second = await get_settings_snapshot(CHAT_ID)
+        return first, second
+
+    assert asyncio.run(scenario()) == (({"antiflood": True}, 3), ({"antiflood": True}, 3))
+    assert loads == [CHAT_ID]
@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+from db.requests import update_chat_settings, toggle_chat_setting
+from conftest import FakeResult
+
+
+def test_settings_are_patched_on_the_server(fake_db):
+    fake_db.results.append(FakeResult([(5,)]))
+    version = asyncio.run(update_chat_settings(-100, antiflood=True, warn_limit=5))
+    assert version == 5
+    sql = fake_db.sql(0)
+    assert "SET settings=(chats.settings || " in sql
+    assert "settings_version=(chats.settings_version + " in sql
+    assert "RETURNING chats.settings_version" in sql
+    assert {"antiflood": True, "warn_limit": 5} in fake_db.params(0).values()
+    assert fake_db.commits == 1
+
+
+def test_settings_change_is_announced_with_version(fake_db):
+    fake_db.results.append(FakeResult([(5,)]))
+    asyncio.run(update_chat_settings(-100, antiflood=True))
+    payload = next(value for value in fake_db.params(1).values() if isinstance(value, str) and value.startswith("{"))
+    event = json.loads(payload)
+    assert (event["event"], event["chat_id"], event["keys"], event["version"]) == (
+        "settings_changed", -100, ["antiflood"], 5)
+
+
+def test_missing_chat_is_not_announced(fake_db):
+    assert asyncio.run(update_chat_settings(-100, antiflood=True)) is None
+    assert len(fake_db.statements) == 1
+
+
+def test_toggle_flips_the_stored_value_in_one_statement(fake_db):
+    fake_db.results.append(FakeResult([(True, 8)]))
+    assert asyncio.run(toggle_chat_setting(-100, "antiflood")) == (True, 8)
+    sql = fake_db.sql(0)
+    assert "jsonb_set(chats.settings, " in sql
+    assert "to_jsonb(NOT coalesce(" in sql
+    assert "settings_version=(chats.settings_version + " in sql
+    assert ["antiflood"] in fake_db.params(0).values()
@@ -0,0 +1,55 @@
+from utils.simhash import simhash, NearDuplicateIndex
+
+SPAM = "Заходите в наш канал, там бесплатные ставки и бонусы каждый день, ссылка в профиле"
+
+
+def test_normalization_does_not_change_fingerprint():
+    assert simhash(SPAM) == simhash("  " + SPAM.upper().replace(",", " !!! ") + "...")
+
+
+def test_short_messages_are_not_fingerprinted():
+    assert simhash("всем привет") is None
+
+
+def test_small_edit_stays_closer_than_other_text():
+    # Хэши n-грамм зависят от PYTHONHASHSEED, поэтому сравниваем расстояния между собой
+    edited = SPAM.replace("каждый день", "каждый вечер")
+    other = "Коллеги, завтра созвон переносится на пять часов, повестка прежняя, материалы в общей папке"
+    assert (simhash(SPAM) ^ simhash(edited)).bit_count() < (simhash(SPAM) ^ simhash(other)).bit_count()
+
+
+def test_triggers_once_text_seen_in_threshold_other_chats():
+    index = NearDuplicateIndex(capacity=1000)
+    results = [index.check_and_add(SPAM, -chat, chats_threshold=3) for chat in range(1, 6)]
+    # Три первых чата только накапливают счетчик, четвертый видит текст в трех других
+    assert results == [False, False, False, True, True]
+
+
+def test_repeats_in_one_chat_never_trigger():
+    index = NearDuplicateIndex(capacity=1000)
+    assert not any(index.check_and_add(SPAM, -1, chats_threshold=3) for _ in range(500))
+    assert not index.check_and_add(SPAM, -2, chats_threshold=3)
+
+
+def test_flood_in_one_chat_keeps_buckets_small():
+    index = NearDuplicateIndex(capacity=1000)
+    for _ in range(500):
+        index.check_and_add(SPAM, -1, chats_threshold=3)
+    assert all(len(bucket) == 1 for buckets in index._buckets for bucket in buckets.values())
+
+
+def test_bucket_is_capped_by_chat_count():
+    index = NearDuplicateIndex(capacity=10_000)
+    for chat in range(1, index.BUCKET_MAX_CHATS * 2):
+        index.add(simhash(SPAM), -chat, now=0.0)
+    assert all(len(bucket) <= index.BUCKET_MAX_CHATS for buckets in index._buckets for bucket in buckets.values())
+
+
+def test_overwritten_slots_leave_the_index():
+    index = NearDuplicateIndex(capacity=4)
+    for chat in range(1, 4):
+        index.check_and_add(SPAM, -chat, chats_threshold=3)
+    # Кольцевой буфер на 4 слота вытесняет записи чатов -1..-3
+    for _ in range(4):
+        index.check_and_add("совсем другой текст про погоду на выходных и прогулки", -9, chats_threshold=3)
+    assert not index.check_and_add(SPAM, -10, chats_threshold=3)
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from aiogram.fsm.storage.base import StorageKey
+
+import utils.state_backend as state_backend_module
+from utils.state_backend import StateBackend, MemoryStateBackend, RedisStateBackend
+from utils.tenancy import bot_scope
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def make_redis_backend() -> RedisStateBackend:
+    return RedisStateBackend(fakeredis.FakeAsyncRedis())
+
+
+def storage_key(chat_id=-100, user_id=7) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=user_id)
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+@pytest.mark.parametrize("make_backend", [MemoryStateBackend, make_redis_backend])
+def test_verified_flag_is_popped_once(make_backend):
+    async def scenario():
+        backend = make_backend()
+        assert not await backend.pop_verified(-100, 7)
+        await backend.mark_verified(-100, 7)
+        assert await backend.pop_verified(-100, 7)
+        assert not await backend.pop_verified(-100, 7)
+
+    asyncio.run(scenario())
+
+
+def test_redis_flood_bucket_refills_over_time(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state_backend_module.time, "time", lambda: now[0])
+
+    async def scenario():
+        backend = make_redis_backend()
+        results = [await backend.consume_flood_token(-100, 7, 3, 1.0) for _ in range(4)]
+        assert results == [True, True, True, False]
+        # Другой пользователь считается отдельно
+        assert await backend.consume_flood_token(-100, 8, 3, 1.0)
+        now[0] += 2
+        assert [await backend.consume_flood_token(-100, 7, 3, 1.0) for _ in range(3)] == [True, True, False]
+        await backend.reset_flood(-100, 7)
+        assert await backend.consume_flood_token(-100, 7, 3, 1.0)
+
+    asyncio.run(scenario())
+
+
+def test_redis_prefetch_returns_state_and_consumes_token(monkeypatch):
+    monkeypatch.setattr(state_backend_module.time, "time", lambda: 1000.0)
+
+    async def scenario():
+        backend = make_redis_backend()
+        key = storage_key()
+        assert await backend.prefetch(key, None) == (None, None)
+        await backend.fsm.set_state(key, "SettingsStates:waiting_for_rules_text")
+        assert await backend.prefetch(key, (2, 0.1)) == ("SettingsStates:waiting_for_rules_text", True)
+        assert await backend.prefetch(key, (2, 0.1)) == ("SettingsStates:waiting_for_rules_text", True)
+        assert await backend.prefetch(key, (2, 0.1)) == ("SettingsStates:waiting_for_rules_text", False)
+
+    asyncio.run(scenario())
+
+
+def test_redis_reloads_flushed_script():
+    async def scenario():
+        backend = make_redis_backend()
+        assert await backend.consume_flood_token(-100, 7, 5, 1.0)
+        await backend.redis.script_flush()
+        assert await backend.consume_flood_token(-100, 7, 5, 1.0)
+
+    asyncio.run(scenario())
+
+
+def test_redis_keys_are_separated_by_bot():
+    async def scenario():
+        backend = make_redis_backend()
+        with bot_scope(1):
+            await backend.mark_verified(-100, 7)
+        with bot_scope(2):
+            assert not await backend.pop_verified(-100, 7)
+        with bot_scope(1):
+            assert await backend.pop_verified(-100, 7)
+
+    asyncio.run(scenario())
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import utils.tenancy as tenancy_module
+import utils.timers as timers_module
+from utils.timers import TimerService
+from utils.tenancy import bot_scope
+
+
+class FakeTimerTable:
+    """Таблица timers в памяти вместо БД."""
+
+    def __init__(self):
+        self.rows = {}
+        self.next_id = 1
+
+    async def add_timer(self, kind, chat_id, run_at, user_id=None, message_id=None):
+        timer_id = self.next_id
+        self.next_id += 1
+        self.rows[timer_id] = SimpleNamespace(id=timer_id, kind=kind, chat_id=chat_id, user_id=user_id,
+                                              message_id=message_id, run_at=run_at)
+        return timer_id
+
+    async def delete_timer(self, timer_id):
+        self.rows.pop(timer_id, None)
+
+    async def delete_timers(self, kind, chat_id, user_id):
+        for timer_id, row in list(self.rows.items()):
+            if (row.kind, row.chat_id, row.user_id) == (kind, chat_id, user_id):
+                del self.rows[timer_id]
+
+    async def get_pending_timers(self, shard_index, shard_count):
+        return sorted(self.rows.values(), key=lambda row: row.run_at)
+
+
+@pytest.fixture
+def table(monkeypatch):
+    # Режим нескольких ботов: пространство имен таймера совпадает с ID бота
+    monkeypatch.setattr(tenancy_module, "TENANCY_ENABLED", True)
+    table = FakeTimerTable()
+    for name in ("add_timer", "delete_timer", "delete_timers", "get_pending_timers"):
+        monkeypatch.setattr(timers_module, name, getattr(table, name))
+    return table
+
+
+def make_service(fired: list) -> TimerService:
+    service = TimerService()
+
+    @service.handler("test")
+    async def handle(bot, timer):
+        fired.append((bot.id, timer.chat_id, timer.user_id))
+
+    return service
+
+
+def test_timers_fire_in_time_order_and_rows_are_deleted(table):
+    async def scenario():
+        fired = []
+        service = make_service(fired)
+        bot = SimpleNamespace(id=1)
+        with bot_scope(1):
+            service.start(bot)
+            await service.schedule("test", 0.06, -1, user_id=3)
+            await service.schedule("test", 0.02, -1, user_id=1)
+            await service.schedule("test", 0.04, -1, user_id=2)
+        await asyncio.sleep(0.2)
+        await service.stop()
+        return fired
+
+    fired = asyncio.run(scenario())
+    assert [user_id for _, _, user_id in fired] == [1, 2, 3]
+    assert table.rows == {}
+
+
+def test_cancel_removes_timer_and_row(table):
+    async def scenario():
+        fired = []
+        service = make_service(fired)
+        with bot_scope(1):
+            service.start(SimpleNamespace(id=1))
+            await service.schedule("test", 0.02, -1, user_id=1)
+            await service.schedule("test", 0.02, -1, user_id=2)
+            assert await service.cancel("test", -1, 1)
+        await asyncio.sleep(0.1)
+        await service.stop()
+        return fired
+
+    fired = asyncio.run(scenario())
+    assert [user_id for _, _, user_id in fired] == [2]
+    assert table.rows == {}
+
+
+def test_pending_timers_survive_restart(table):
+    async def scenario():
+        fired = []
+        with bot_scope(1):
+            before_restart = make_service([])
+            await before_restart.schedule("test", 0.03, -1, user_id=7)
+            # Процесс "упал" до срабатывания: новый сервис загружает таймер из таблицы
+            after_restart = make_service(fired)
+            after_restart.start(SimpleNamespace(id=1))
+            assert await after_restart.load_pending() == 1
+            # Повторная загрузка не дублирует таймеры
+            assert await after_restart.load_pending() == 0
+        await asyncio.sleep(0.1)
+        await after_restart.stop()
+        return fired
+
+    assert asyncio.run(scenario()) == [(1, -1, 7)]
+    assert table.rows == {}
+
+
+def test_overdue_timers_fire_immediately_after_load(table):
+    async def scenario():
+        fired = []
+        overdue = datetime.fromtimestamp(time.time() - 60, tz=timezone.utc)
+        with bot_scope(1):
+            await table.add_timer("test", -1, overdue, user_id=5)
+            service = make_service(fired)
+            service.start(SimpleNamespace(id=1))
+            await service.load_pending()
+        await asyncio.sleep(0.05)
+        await service.stop()
+        return fired
+
+    assert asyncio.run(scenario()) == [(1, -1, 5)]
+
+
+def test_timer_of_unregistered_bot_keeps_its_row(table):
+    async def scenario():
+        fired = []
+        service = make_service(fired)
+        service.start(SimpleNamespace(id=1))
+        with bot_scope(2):
+            await service.schedule("test", 0.01, -1, user_id=9)
+        await asyncio.sleep(0.05)
+        await service.stop()
+        return fired
+
+    assert asyncio.run(scenario()) == []
+    assert len(table.rows) == 1
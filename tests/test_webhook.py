@@ -0,0 +1,68 @@
+import asyncio
+
+from aiogram import Bot
+from aiohttp.test_utils import TestServer, TestClient
+
+from utils.webhook import create_webhook_app, SECRET_HEADER
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10,
+        "date": 1700000000,
+        "chat": {"id": -100, "type": "supergroup", "title": "Чат"},
+        "from": {"id": 7, "is_bot": False, "first_name": "Иван"},
+        "text": "привет",
+    },
+}
+
+
+class RecordingDispatcher:
+    """Вместо очередей чатов запоминает поставленные апдейты."""
+
+    def __init__(self):
+        self.submitted = []
+
+    async def submit(self, bot, update):
+        self.submitted.append((bot.id, update))
+
+
+async def post(bots, dispatcher, path, secret="", **kwargs):
+    app = create_webhook_app(bots, dispatcher, path="/webhook", secret=secret)
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post(path, **kwargs)
+        return response.status
+
+
+def test_recorded_update_is_submitted():
+    dispatcher = RecordingDispatcher()
+    bot = Bot("42:TEST")
+    status = asyncio.run(post([bot], dispatcher, "/webhook", secret="s3cret", json=UPDATE,
+                              headers={SECRET_HEADER: "s3cret"}))
+    assert status == 200
+    (bot_id, update), = dispatcher.submitted
+    assert bot_id == 42
+    assert update.message.chat.id == -100 and update.message.text == "привет"
+
+
+def test_wrong_secret_is_rejected():
+    dispatcher = RecordingDispatcher()
+    status = asyncio.run(post([Bot("42:TEST")], dispatcher, "/webhook", secret="s3cret", json=UPDATE,
+                              headers={SECRET_HEADER: "wrong"}))
+    assert status == 401
+    assert dispatcher.submitted == []
+
+
+def test_malformed_update_is_rejected():
+    dispatcher = RecordingDispatcher()
+    status = asyncio.run(post([Bot("42:TEST")], dispatcher, "/webhook", data=b"{not json"))
+    assert status == 400
+    assert dispatcher.submitted == []
+
+
+def test_each_bot_has_its_own_path():
+    dispatcher = RecordingDispatcher()
+    bots = [Bot("42:TEST"), Bot("43:TEST")]
+    assert asyncio.run(post(bots, dispatcher, "/webhook/43", json=UPDATE)) == 200
+    assert asyncio.run(post(bots, dispatcher, "/webhook", json=UPDATE)) in (404, 405)
+    assert [bot_id for bot_id, _ in dispatcher.submitted] == [43]
@@ -0,0 +1,43 @@
+# utils/audit.py
+
+import os
+from datetime import datetime, timedelta, timezone
+
+from db.requests import add_moderation_events
+from utils.batch_writer import BatchWriter
+
+# Как часто записывать накопленные события и при каком размере пачки писать сразу
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+# Сколько событий держать в памяти, пока БД недоступна; сверх этого старые отбрасываются
+AUDIT_BUFFER_LIMIT = int(os.getenv("AUDIT_BUFFER_LIMIT", "50000"))
+
+
+class AuditLog(BatchWriter):
+    """
+    Журнал модерации с пакетной записью. record() только кладет событие в буфер,
+    поэтому действие модерации не ждет записи в БД. Буфер каждого бота
+    записывается одним INSERT раз в AUDIT_FLUSH_SECONDS или при наборе AUDIT_BATCH_SIZE событий.
+    """
+
+    def __init__(self, flush_seconds: float = AUDIT_FLUSH_SECONDS, batch_size: int = AUDIT_BATCH_SIZE,
+                 buffer_limit: int = AUDIT_BUFFER_LIMIT):
+        super().__init__("журнал модерации", add_moderation_events, flush_seconds, batch_size, buffer_limit)
+
+    def record(self, chat_id: int, action: str, target_id: int | None = None, actor_id: int | None = None,
+               reason: str | None = None, duration: timedelta | None = None):
+        """Добавляет событие в журнал. actor_id=None - действие самого бота."""
+        self._append({
+            "chat_id": chat_id,
+            "actor_id": actor_id,
+            "target_id": target_id,
+            "action": action,
+            "reason": reason,
+            "duration_seconds": int(duration.total_seconds()) if duration is not None else None,
+            # Время события, а не записи пачки
+            "created_at": datetime.now(timezone.utc),
+        })
+
+
+# Единый журнал модерации процесса
+audit_log = AuditLog()
@@ -0,0 +1,72 @@
+# utils/background.py
+
+import os
+import asyncio
+import logging
+import contextvars
+from typing import Any, Awaitable, Callable
+
+# Сколько задач может ждать в очереди; при переполнении новые отбрасываются
+BACKGROUND_QUEUE_LIMIT = int(os.getenv("BACKGROUND_QUEUE_LIMIT", "10000"))
+# Сколько задач выполняется одновременно (каждая держит соединение с БД)
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "4"))
+DRAIN_TIMEOUT_SECONDS = 10
+
+
+class BackgroundQueue:
+    """
+    Ограниченная очередь второстепенной работы (опыт, статистика сообщений),
+    которая выполняется параллельно с обработчиками, а не перед ними.
+    Постановка в очередь не ждет: если очередь полна, задача отбрасывается и учитывается в метриках.
+    Задача выполняется в контексте постановки (бот, приоритет исходящих запросов).
+    """
+
+    def __init__(self, name: str, limit: int = BACKGROUND_QUEUE_LIMIT, workers: int = BACKGROUND_WORKERS):
+        self.name = name
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=limit)
+        self._tasks: list[asyncio.Task] = []
+        self.stats = {"submitted": 0, "done": 0, "dropped": 0, "errors": 0}
+
+    def submit(self, func: Callable[..., Awaitable[Any]], *args) -> bool:
+        try:
+            self._queue.put_nowait((func, args, contextvars.copy_context()))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Дожидается выполнения накопленного (не дольше DRAIN_TIMEOUT_SECONDS) и останавливает воркеры."""
+        try:
+            await asyncio.wait_for(self._queue.join(), DRAIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logging.warning(f"Очередь {self.name}: не успели выполнить {self._queue.qsize()} задач")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            func, args, context = await self._queue.get()
+            try:
+                await asyncio.create_task(func(*args), context=context)
+                self.stats["done"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.error(f"Ошибка в фоновой задаче {func.__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+
+# Учет активности: опыт, профили и статистика сообщений
+bookkeeping = BackgroundQueue("bookkeeping")
@@ -0,0 +1,88 @@
+# utils/batch_writer.py
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+from utils.tenancy import current_bot_id, bot_scope
+
+
+class BatchWriter:
+    """
+    Пакетная запись строк в БД в фоне. Строки копятся в буфере своего бота
+    и записываются вызовом write(rows) раз в flush_seconds или при наборе batch_size строк.
+    Пока БД недоступна, буфер держит до buffer_limit строк, сверх этого старые отбрасываются.
+    """
+
+    def __init__(self, name: str, write: Callable[[list[dict]], Awaitable[None]],
+                 flush_seconds: float, batch_size: int, buffer_limit: int):
+        self.name = name
+        self.write = write
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.buffer_limit = buffer_limit
+        # Пространство имен бота -> строки, ожидающие записи
+        self._buffers: dict[int | None, deque[dict]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.stats = {"recorded": 0, "written": 0, "batches": 0, "dropped": 0, "errors": 0}
+
+    def _append(self, row: dict):
+        namespace = current_bot_id.get()
+        buffer = self._buffers.get(namespace)
+        if buffer is None:
+            buffer = self._buffers[namespace] = deque(maxlen=self.buffer_limit)
+        if len(buffer) == buffer.maxlen:
+            # deque с maxlen сам вытеснит самую старую строку
+            self.stats["dropped"] += 1
+        buffer.append(row)
+        self.stats["recorded"] += 1
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую запись и записывает остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        for namespace, buffer in list(self._buffers.items()):
+            while buffer:
+                # Пакет забирается до записи, чтобы вытеснение старых строк во время записи его не задело
+                batch = [buffer.popleft() for _ in range(min(self.batch_size, len(buffer)))]
+                try:
+                    with bot_scope(namespace):
+                        await self.write(batch)
+                except Exception as e:
+                    # Строки возвращаются в начало буфера до следующей попытки;
+                    # если буфер за это время заполнился, самые старые отбрасываются
+                    self.stats["errors"] += 1
+                    logging.error(f"Не удалось записать {self.name} ({len(batch) + len(buffer)} строк): {e}")
+                    overflow = len(batch) + len(buffer) - self.buffer_limit
+                    if overflow > 0:
+                        self.stats["dropped"] += overflow
+                        batch = batch[overflow:]
+                    buffer.extendleft(reversed(batch))
+                    break
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+
+    def pending_count(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
@@ -0,0 +1,48 @@
+# utils/bloom.py
+
+import math
+from hashlib import blake2b
+
+
+class BloomFilter:
+    """
+    Компактное множество целых чисел (ID пользователей) без удаления.
+    Проверка может ошибочно ответить "есть" (с вероятностью error_rate при заполнении
+    до capacity), но никогда не пропускает добавленный элемент.
+    """
+
+    __slots__ = ("capacity", "size", "hashes", "bits", "count")
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(capacity, 1)
+        # Оптимальные число бит и число хэшей для заданной вероятности ошибки
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @staticmethod
+    def _hash(key: int) -> tuple[int, int]:
+        # Двойное хэширование: k позиций из двух 64-битных половин одного хэша
+        digest = blake2b(key.to_bytes(8, "little", signed=True), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def add(self, key: int):
+        h1, h2 = self._hash(key)
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.size
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: int) -> bool:
+        h1, h2 = self._hash(key)
+        bits, size = self.bits, self.size
+        # Для отсутствующего ключа проверка обычно заканчивается на первом-втором нулевом бите
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def is_full(self) -> bool:
+        return self.count > self.capacity
@@ -0,0 +1,92 @@
+# utils/bulk_import.py
+
+import io
+import csv
+import html
+import codecs
+from typing import AsyncIterator
+
+from aiogram import Bot, types
+
+# Ограничения на загружаемый файл со стоп-словами или триггерами
+IMPORT_MAX_FILE_BYTES = 5 * 1024 * 1024
+IMPORT_MAX_ITEMS = 50_000
+# Ключевая фраза триггера хранится в String(100)
+TRIGGER_KEYWORD_MAX_LENGTH = 100
+
+
+class BulkImportError(ValueError):
+    """Файл нельзя импортировать (слишком большой, не текст и т.п.)."""
+
+
+async def iter_document_lines(bot: Bot, document: types.Document) -> AsyncIterator[str]:
+    """
+    Построчно отдает текст документа по мере скачивания, не загружая файл целиком.
+    Понимает UTF-8 с BOM и без; некорректные байты заменяются.
+    """
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_BYTES:
+        raise BulkImportError(f"Файл больше {IMPORT_MAX_FILE_BYTES // (1024 * 1024)} МБ.")
+    file = await bot.get_file(document.file_id)
+    if bot.session.api.is_local:
+        buffer = await bot.download_file(file.file_path)
+        chunks = _iter_buffer(buffer)
+    else:
+        chunks = bot.session.stream_content(url=bot.session.api.file_url(bot.token, file.file_path),
+                                            raise_for_status=True)
+
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).splitlines(keepends=True)
+        # Последняя строка может продолжиться в следующем куске
+        tail = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            yield line.rstrip("\r\n")
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def _iter_buffer(buffer: io.BytesIO, chunk_size: int = 65536):
+    while chunk := buffer.read(chunk_size):
+        yield chunk
+
+
+def _parse_row(line: str) -> list[str]:
+    # Строка CSV; обычный текстовый файл - это CSV с одной колонкой
+    return [cell.strip() for cell in next(csv.reader([line]), [])]
+
+
+async def parse_stop_words(lines: AsyncIterator[str]) -> list[str]:
+    """Стоп-слова по одному в строке (или в первой колонке CSV), без повторов, в нижнем регистре."""
+    words: dict[str, None] = {}
+    async for line in lines:
+        row = _parse_row(line)
+        if not row or not row[0] or row[0].startswith("#"):
+            continue
+        words[row[0].lower()] = None
+        if len(words) > IMPORT_MAX_ITEMS:
+            raise BulkImportError(f"В файле больше {IMPORT_MAX_ITEMS} записей.")
+    return list(words)
+
+
+async def parse_triggers(lines: AsyncIterator[str]) -> tuple[dict[str, str], int]:
+    """
+    Триггеры из CSV «фраза,ответ». Для повторяющейся фразы берется последний ответ.
+    Возвращает (фраза -> ответ, число пропущенных некорректных строк).
+    """
+    triggers: dict[str, str] = {}
+    skipped = 0
+    async for line in lines:
+        row = _parse_row(line)
+        if not row or not row[0] or row[0].startswith("#"):
+            continue
+        keyword, response = row[0].lower(), ",".join(row[1:]).strip()
+        if not any(row[1:]) or len(keyword) > TRIGGER_KEYWORD_MAX_LENGTH:
+            skipped += 1
+            continue
+        # Ответы триггеров отправляются как HTML, а в файле - обычный текст
+        triggers[keyword] = html.escape(response)
+        if len(triggers) > IMPORT_MAX_ITEMS:
+            raise BulkImportError(f"В файле больше {IMPORT_MAX_ITEMS} записей.")
+    return triggers, skipped
@@ -0,0 +1,152 @@
+# utils/cache.py
+
+import sys
+import time
+from collections import OrderedDict
+
+from utils.tenancy import scoped_key
+
+# Все созданные кэши, чтобы можно было выгрузить их метрики одним вызовом
+_registry = []
+
+_MISSING = object()
+
+
+def approx_size(obj) -> int:
+    """Грубая оценка занимаемой объектом памяти (в байтах) с учетом вложенных коллекций."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item) for item in obj)
+    return size
+
+
+class BoundedCache:
+    """
+    LRU-кэш с опциональным TTL и бюджетом памяти.
+    Ведет счетчики попаданий, промахов и вытеснений.
+
+    Значения нельзя менять на месте: после изменения объект нужно
+    заново присвоить ключу, иначе оценка размера устареет.
+    Ключи автоматически разделяются по текущему боту (utils.tenancy).
+    """
+
+    def __init__(self, name: str, max_items: int = 10_000, max_bytes: int | None = None,
+                 ttl: float | None = None, sizer=approx_size):
+        self.name = name
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizer = sizer
+        # key -> (value, expires_at, size)
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _registry.append(self)
+
+    # --- Внутренние помощники ---
+
+    def _is_expired(self, entry, now: float) -> bool:
+        return entry[1] is not None and entry[1] <= now
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict_overflow(self):
+        while self._data and (
+            len(self._data) > self.max_items
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        if self._is_expired(entry, time.monotonic()):
+            self._remove(key)
+            self.evictions += 1
+            return _MISSING
+        self._data.move_to_end(key)
+        return entry[0]
+
+    # --- Интерфейс словаря ---
+
+    def get(self, key, default=None):
+        value = self._lookup(scoped_key(key))
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        # Проверка наличия не влияет на счетчики попаданий
+        return self._lookup(scoped_key(key)) is not _MISSING
+
+    def __setitem__(self, key, value):
+        key = scoped_key(key)
+        if key in self._data:
+            self._remove(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        size = self._sizer(value)
+        self._data[key] = (value, expires_at, size)
+        self._bytes += size
+        self._evict_overflow()
+
+    def __delitem__(self, key):
+        key = scoped_key(key)
+        if self._lookup(key) is _MISSING:
+            raise KeyError(key)
+        self._remove(key)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def pop(self, key, default=None):
+        key = scoped_key(key)
+        value = self._lookup(key)
+        if value is _MISSING:
+            return default
+        self._remove(key)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def purge_expired(self) -> int:
+        """Удаляет все просроченные записи. Возвращает их количество."""
+        now = time.monotonic()
+        expired = [key for key, entry in self._data.items() if self._is_expired(entry, now)]
+        for key in expired:
+            self._remove(key)
+        self.evictions += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def get_cache_stats() -> list[dict]:
+    """Возвращает метрики всех кэшей процесса."""
+    return [cache.stats() for cache in _registry]
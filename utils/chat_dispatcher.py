@@ -0,0 +1,191 @@
+# utils/chat_dispatcher.py
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.types import Update
+
+# Сколько апдейтов обрабатывается одновременно (в разных чатах)
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "64"))
+# Сколько апдейтов может ждать в очереди всего; при превышении прием приостанавливается
+DISPATCH_QUEUE_LIMIT = int(os.getenv("DISPATCH_QUEUE_LIMIT", "10000"))
+# Сколько апдейтов может ждать в очереди одного чата; лишние отбрасываются
+DISPATCH_CHAT_QUEUE_LIMIT = int(os.getenv("DISPATCH_CHAT_QUEUE_LIMIT", "500"))
+POLLING_TIMEOUT_SECONDS = 30
+# Сколько ждать обработки оставшихся апдейтов при остановке
+DRAIN_TIMEOUT_SECONDS = 10
+MAX_BACKOFF_SECONDS = 30
+
+
+def update_chat_key(update: Update) -> int | None:
+    """Ключ очереди апдейта: ID чата, а для апдейтов без чата - ID пользователя."""
+    try:
+        event = update.event
+    except Exception:
+        return None
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        # Нажатия кнопок относятся к чату сообщения с кнопкой
+        message = getattr(event, "message", None)
+        chat = getattr(message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
+
+
+async def poll_updates(bot: Bot, allowed_updates: list[str],
+                       submit: Callable[[Bot, Update], Awaitable[Any]]):
+    """
+    Бесконечный long polling: каждый апдейт передается в submit по порядку.
+    Следующая пачка запрашивается только после того, как submit принял предыдущую.
+    """
+    get_updates = GetUpdates(timeout=POLLING_TIMEOUT_SECONDS, allowed_updates=allowed_updates)
+    request_timeout = int((bot.session.timeout or 0) + POLLING_TIMEOUT_SECONDS)
+    backoff = 1
+    try:
+        while True:
+            try:
+                updates = await bot(get_updates, request_timeout=request_timeout)
+                backoff = 1
+            except Exception as e:
+                logging.error(f"Не удалось получить апдейты: {e}. Повтор через {backoff} сек.")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+                continue
+            for update in updates:
+                await submit(bot, update)
+                get_updates.offset = update.update_id + 1
+    finally:
+        logging.info("Поллинг остановлен")
+
+
+class ChatDispatcher:
+    """
+    Обработка апдейтов с порядком внутри чата и ограниченным параллелизмом между чатами.
+    У каждого чата своя очередь; в общую очередь готовых попадают чаты, а не апдейты,
+    поэтому два апдейта одного чата никогда не обрабатываются одновременно,
+    а медленный чат занимает не больше одного воркера.
+    """
+
+    def __init__(self, dp: Dispatcher, workers: int = DISPATCH_WORKERS,
+                 queue_limit: int = DISPATCH_QUEUE_LIMIT, chat_queue_limit: int = DISPATCH_CHAT_QUEUE_LIMIT):
+        self.dp = dp
+        self.workers = workers
+        self.chat_queue_limit = chat_queue_limit
+        # Ключ - (ID бота, ID чата): у разных ботов в одном чате очереди независимы
+        self._chats: dict[tuple[int, int | None], deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._capacity = asyncio.Semaphore(queue_limit)
+        self._workers: list[asyncio.Task] = []
+        self._workflow_data: dict = {}
+        self.stats = {"received": 0, "processed": 0, "dropped": 0, "errors": 0, "max_wait_ms": 0}
+
+    def start(self, **workflow_data):
+        """Запускает воркеры. workflow_data передается в обработчики, как в start_polling."""
+        self._workflow_data = workflow_data
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS
+        while self._chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, bot: Bot, update: Update) -> bool:
+        """
+        Ставит апдейт в очередь его чата. Ждет, если общая очередь заполнена.
+        Возвращает False, если апдейт отброшен из-за переполнения очереди чата.
+        """
+        self.stats["received"] += 1
+        key = (bot.id, update_chat_key(update))
+        queue = self._chats.get(key)
+        if queue is not None and len(queue) >= self.chat_queue_limit:
+            self.stats["dropped"] += 1
+            logging.warning(f"Очередь чата {key} переполнена, апдейт {update.update_id} отброшен")
+            return False
+
+        await self._capacity.acquire()
+        queue = self._chats.get(key)
+        if queue is None:
+            # Чата нет в очереди готовых - добавляем; иначе воркер сам вернет его туда
+            queue = self._chats[key] = deque()
+            self._ready.put_nowait(key)
+        queue.append((bot, update, time.monotonic()))
+        return True
+
+    async def _process(self, bot: Bot, update: Update):
+        try:
+            response = await self.dp.feed_update(bot, update, **self._workflow_data)
+            if isinstance(response, TelegramMethod):
+                await self.dp.silent_call_request(bot=bot, result=response)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.exception(f"Ошибка при обработке апдейта {update.update_id}: {e}")
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._chats[key]
+            bot, update, enqueued_at = queue.popleft()
+            wait_ms = int((time.monotonic() - enqueued_at) * 1000)
+            self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+            try:
+                await self._process(bot, update)
+            finally:
+                self.stats["processed"] += 1
+                self._capacity.release()
+                if queue:
+                    # Следующий апдейт чата - в конец очереди готовых, чтобы не обделять другие чаты
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._chats.values())
+
+    def active_chats(self) -> int:
+        return len(self._chats)
+
+    def take_stats(self) -> dict:
+        """Возвращает метрики и сбрасывает максимум ожидания за период."""
+        stats = dict(self.stats, depth=self.queue_depth(), chats=self.active_chats())
+        self.stats["max_wait_ms"] = 0
+        return stats
+
+    @asynccontextmanager
+    async def running(self, *bots: Bot, **kwargs):
+        """Жизненный цикл как в dp.start_polling: startup, воркеры, затем shutdown и закрытие сессий."""
+        workflow_data = {"dispatcher": self.dp, "bots": bots, **self.dp.workflow_data, **kwargs}
+        workflow_data.pop("bot", None)
+        await self.dp.emit_startup(bot=bots[-1], **workflow_data)
+        self.start(**workflow_data)
+        try:
+            yield
+        finally:
+            try:
+                await self.stop()
+                await self.dp.emit_shutdown(bot=bots[-1], **workflow_data)
+            finally:
+                await asyncio.gather(*(bot.session.close() for bot in bots))
+
+    async def run_polling(self, *bots: Bot, **kwargs):
+        """
+        Аналог dp.start_polling, но апдейты раздаются по очередям чатов.
+        Пока общая очередь заполнена, новые апдейты не запрашиваются.
+        """
+        async with self.running(*bots, **kwargs):
+            logging.info(f"Запущен поллинг с очередями чатов: ботов={len(bots)}, воркеров={self.workers}")
+            allowed_updates = self.dp.resolve_used_update_types()
+            await asyncio.gather(*(poll_updates(bot, allowed_updates, self.submit) for bot in bots))
@@ -29,6 +29,12 @@ async def set_bot_commands(bot: Bot):
         BotCommand(command="unban", description="✅ Разбанить (ответом)"),
         BotCommand(command="unmute", description="🔊 Размутить (ответом)"),
         BotCommand(command="clearwarns", description="🗑️ Снять все варны (ответом)"),
+        BotCommand(command="purge", description="🧹 Удалить сообщения (ответом или диапазон ID)"),
+        BotCommand(command="gban", description="🌐 Бан во всех чатах сети (ответом)"),
+        BotCommand(command="ungban", description="🌐 Снять общий бан"),
+        BotCommand(command="modlog", description="📜 Журнал модерации"),
+        BotCommand(command="import_words", description="📥 Импорт стоп-слов из файла"),
+        BotCommand(command="import_triggers", description="📥 Импорт триггеров из CSV"),
     ]
     # ИСПРАВЛЕНИЕ: Используем правильное имя класса
     await bot.set_my_commands(commands=user_commands + admin_commands, scope=BotCommandScopeAllChatAdministrators())
@@ -0,0 +1,87 @@
+# utils/global_bans.py
+
+import os
+import logging
+
+from db.requests import get_global_banned, iter_global_bans
+from utils.bloom import BloomFilter
+from utils.tenancy import current_bot_id
+
+# На сколько записей рассчитан фильтр; при переполнении он пересобирается вдвое большим
+GLOBAL_BANS_CAPACITY = int(os.getenv("GLOBAL_BANS_CAPACITY", "100000"))
+GLOBAL_BANS_ERROR_RATE = float(os.getenv("GLOBAL_BANS_ERROR_RATE", "0.001"))
+
+
+class _BanFilter:
+    __slots__ = ("bloom", "last_id", "stale")
+
+    def __init__(self, capacity: int):
+        self.bloom = BloomFilter(capacity, GLOBAL_BANS_ERROR_RATE)
+        # Последняя загруженная запись: следующие обновления читают только новые
+        self.last_id = 0
+        self.stale = False
+
+
+class GlobalBanList:
+    """
+    Проверка вошедших по общему бан-листу. Каждый инстанс держит фильтр Блума по ID
+    забаненных (свой для каждого бота), поэтому чистые пользователи отсеиваются без запросов к БД.
+    Срабатывание фильтра подтверждается одним запросом по индексу.
+    Новые баны добавляются в фильтр по событиям LISTEN/NOTIFY, после переподключения
+    догружаются записи с ID больше последнего загруженного.
+    """
+
+    def __init__(self, capacity: int = GLOBAL_BANS_CAPACITY):
+        self.capacity = capacity
+        self._filters: dict[int | None, _BanFilter] = {}
+        self.stats = {"checks": 0, "bloom_hits": 0, "confirmed": 0}
+
+    async def refresh(self):
+        """Догружает в фильтр текущего бота записи, появившиеся после последней загрузки."""
+        namespace = current_bot_id.get()
+        ban_filter = self._filters.get(namespace)
+        if ban_filter is None:
+            ban_filter = self._filters[namespace] = _BanFilter(self.capacity)
+        ban_filter.stale = False
+        loaded = 0
+        async for ban_id, user_id in iter_global_bans(ban_filter.last_id):
+            ban_filter.bloom.add(user_id)
+            ban_filter.last_id = ban_id
+            loaded += 1
+        if ban_filter.bloom.is_full():
+            # Переполненный фильтр дает слишком много ложных срабатываний: собираем заново
+            capacity = ban_filter.bloom.capacity * 2
+            self._filters[namespace] = _BanFilter(capacity)
+            logging.info(f"Фильтр общего бан-листа пересобирается на {capacity} записей")
+            return await self.refresh()
+        return loaded
+
+    def add(self, user_id: int):
+        """Новый бан из события NOTIFY."""
+        ban_filter = self._filters.get(current_bot_id.get())
+        if ban_filter is not None:
+            ban_filter.bloom.add(user_id)
+
+    def mark_stale(self):
+        """События могли быть пропущены: перед следующей проверкой догружаем новые записи."""
+        for ban_filter in self._filters.values():
+            ban_filter.stale = True
+
+    async def check(self, user_ids: list[int]) -> set[int]:
+        """Возвращает тех из user_ids, кто в общем бан-листе."""
+        ban_filter = self._filters.get(current_bot_id.get())
+        if ban_filter is None or ban_filter.stale:
+            await self.refresh()
+            ban_filter = self._filters[current_bot_id.get()]
+        self.stats["checks"] += len(user_ids)
+        candidates = [user_id for user_id in user_ids if user_id in ban_filter.bloom]
+        if not candidates:
+            return set()
+        self.stats["bloom_hits"] += len(candidates)
+        banned = await get_global_banned(candidates)
+        self.stats["confirmed"] += len(banned)
+        return banned
+
+
+# Общий бан-лист процесса
+global_bans = GlobalBanList()
@@ -0,0 +1,135 @@
+# utils/log_digest.py
+
+import os
+import asyncio
+import logging
+
+from aiogram import Bot
+
+from utils.outbound import outbound_priority, Priority
+
+# Предел длины сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+# Через сколько секунд после первого события в буфере отправлять сводку
+DIGEST_INTERVAL_SECONDS = float(os.getenv("LOG_DIGEST_INTERVAL_SECONDS", "5"))
+SEPARATOR = "\n\n"
+
+
+def pack_digest(texts: list[str], max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Склеивает события по порядку в как можно меньшее число сообщений не длиннее max_length."""
+    chunks, current, length = [], [], 0
+    for text in texts:
+        added = len(text) + (len(SEPARATOR) if current else 0)
+        if current and length + added > max_length:
+            chunks.append(SEPARATOR.join(current))
+            current, length, added = [], 0, len(text)
+        current.append(text)
+        length += added
+    if current:
+        chunks.append(SEPARATOR.join(current))
+    return chunks
+
+
+class LogDigest:
+    """
+    Буфер событий для каждого канала логов. События склеиваются в сводки,
+    которые уходят при заполнении сообщения или через DIGEST_INTERVAL_SECONDS.
+    Отправки в один канал выполняются строго друг за другом, поэтому порядок событий сохраняется.
+    Срочные события сначала выталкивают буфер, затем отправляются сразу.
+    add() никогда не ждет отправки: бан не должен стоять за чужими логами и паузами после 429.
+    """
+
+    def __init__(self, interval: float = DIGEST_INTERVAL_SECONDS, max_length: int = MAX_MESSAGE_LENGTH):
+        self.interval = interval
+        self.max_length = max_length
+        # Ключ буфера - (бот, канал): каналы разных ботов не смешиваются
+        self._buffers: dict[tuple[Bot, int], list[str]] = {}
+        self._lengths: dict[tuple[Bot, int], int] = {}
+        self._flush_handles: dict[tuple[Bot, int], asyncio.TimerHandle] = {}
+        # Последняя отправка в каждый канал, за ней выстраиваются следующие
+        self._tails: dict[tuple[Bot, int], asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.stats = {"events": 0, "messages": 0, "urgent": 0, "errors": 0}
+
+    def _take(self, key: tuple[Bot, int]) -> list[str]:
+        """Забирает накопленные события канала и отменяет отложенную отправку."""
+        handle = self._flush_handles.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        self._lengths.pop(key, None)
+        return self._buffers.pop(key, [])
+
+    def _enqueue(self, key: tuple[Bot, int], texts: list[str], urgent_text: str | None = None) -> asyncio.Task:
+        """Ставит отправку в цепочку канала: она начнется только после предыдущей."""
+        messages = pack_digest(texts, self.max_length)
+        if urgent_text is not None:
+            messages.append(urgent_text)
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._deliver(key, messages, previous, urgent_text is not None))
+        self._tails[key] = task
+        self._tasks.add(task)
+
+        def on_done(done: asyncio.Task):
+            self._tasks.discard(done)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+        task.add_done_callback(on_done)
+        return task
+
+    async def _deliver(self, key: tuple[Bot, int], messages: list[str],
+                       previous: asyncio.Task | None, urgent: bool):
+        bot, channel_id = key
+        if previous is not None:
+            await asyncio.wait([previous])
+        # Сводки не должны отнимать лимиты у модерации и ответов в чатах
+        with outbound_priority(Priority.NORMAL if urgent else Priority.LOW):
+            for text in messages:
+                try:
+                    await bot.send_message(chat_id=channel_id, text=text, parse_mode="HTML")
+                    self.stats["messages"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logging.error(f"Не удалось отправить лог в канал {channel_id}: {e}")
+
+    async def add(self, bot: Bot, channel_id: int, text: str, urgent: bool = False):
+        self.stats["events"] += 1
+        key = (bot, channel_id)
+        if urgent:
+            self.stats["urgent"] += 1
+            self._enqueue(key, self._take(key), urgent_text=text)
+            return
+
+        buffer = self._buffers.get(key)
+        added = len(text) + len(SEPARATOR)
+        if buffer and self._lengths[key] + added > self.max_length:
+            # Сообщение заполнено: отправляем его, не дожидаясь таймера
+            self._enqueue(key, self._take(key))
+            buffer = None
+
+        if buffer is None:
+            buffer = self._buffers[key] = []
+            self._lengths[key] = 0
+            self._flush_handles[key] = asyncio.get_running_loop().call_later(self.interval, self._flush_due, key)
+        buffer.append(text)
+        self._lengths[key] += added
+
+    def _flush_due(self, key: tuple[Bot, int]):
+        self._flush_handles.pop(key, None)
+        texts = self._take(key)
+        if texts:
+            self._enqueue(key, texts)
+
+    async def flush_all(self):
+        """Отправляет все накопленное (при остановке бота)."""
+        for key in list(self._buffers):
+            self._enqueue(key, self._take(key))
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def pending_count(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+
+# Единый буфер логов процесса
+log_digest = LogDigest()
@@ -0,0 +1,67 @@
+# utils/matcher.py
+
+import re
+
+
+def _trie_pattern(phrases) -> str:
+    """
+    Регулярное выражение по префиксному дереву фраз: в каждой позиции текста проверяются
+    только фразы с подходящим началом, а не весь список. Цепочки без ветвлений
+    склеиваются в одну строку, поэтому вложенность групп растет только в точках ветвления.
+    """
+    trie: dict = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        alternatives = []
+        for char, child in sorted(node.items()):
+            if char == "":
+                continue
+            chain = char
+            while len(child) == 1 and "" not in child:
+                (char, child), = child.items()
+                chain += char
+            alternatives.append(re.escape(chain) + build(child))
+        if not alternatives:
+            return ""
+        body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        # Жадная необязательная группа: из фраз, начинающихся в одной позиции, находится самая длинная
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class PhraseMatcher:
+    """
+    Поиск любой из фраз как подстроки текста (в нижнем регистре) за один проход.
+    Собирается один раз на набор фраз чата и переиспользуется для всех его сообщений.
+    """
+
+    __slots__ = ("_pattern", "_phrases")
+
+    def __init__(self, phrases):
+        phrases = [phrase for phrase in phrases if phrase]
+        self._phrases = None
+        self._pattern = None
+        if not phrases:
+            return
+        try:
+            self._pattern = re.compile(_trie_pattern(phrases))
+        except (re.error, RecursionError):
+            # Очень длинные ветвистые фразы: ищем по одной
+            self._phrases = sorted(phrases, key=len, reverse=True)
+
+    def search(self, text_lower: str) -> str | None:
+        """Первая (самая левая, из них самая длинная) найденная фраза или None."""
+        if self._pattern is not None:
+            match = self._pattern.search(text_lower)
+            return match.group(0) if match else None
+        if self._phrases is not None:
+            for phrase in self._phrases:
+                if phrase in text_lower:
+                    return phrase
+        return None
@@ -0,0 +1,35 @@
+# utils/message_log.py
+
+import os
+from datetime import datetime, timezone
+
+from db.requests import add_message_records
+from utils.batch_writer import BatchWriter
+
+MESSAGE_LOG_FLUSH_SECONDS = float(os.getenv("MESSAGE_LOG_FLUSH_SECONDS", "1"))
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv("MESSAGE_LOG_BATCH_SIZE", "1000"))
+MESSAGE_LOG_BUFFER_LIMIT = int(os.getenv("MESSAGE_LOG_BUFFER_LIMIT", "200000"))
+
+
+class MessageLog(BatchWriter):
+    """
+    Запись (чат, автор, ID сообщения) для статистики и /purge. В отличие от опыта и профилей
+    не отключается при перегрузке: именно во время флуда /purge нужны ID всех сообщений.
+    Стоит одного добавления в буфер на сообщение, в БД уходит многострочными INSERT.
+    """
+
+    def __init__(self, flush_seconds: float = MESSAGE_LOG_FLUSH_SECONDS, batch_size: int = MESSAGE_LOG_BATCH_SIZE,
+                 buffer_limit: int = MESSAGE_LOG_BUFFER_LIMIT):
+        super().__init__("учет сообщений", add_message_records, flush_seconds, batch_size, buffer_limit)
+
+    def record(self, chat_id: int, user_id: int, message_id: int):
+        self._append({
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "message_id": message_id,
+            "timestamp": datetime.now(timezone.utc),
+        })
+
+
+# Единый учет сообщений процесса
+message_log = MessageLog()
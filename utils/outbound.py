@@ -0,0 +1,261 @@
+# utils/outbound.py
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from enum import IntEnum
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    TelegramMethod, SendMessage, DeleteMessage, DeleteMessages, RestrictChatMember,
+    BanChatMember, UnbanChatMember, GetChat, GetChatMember, GetChatMemberCount, GetChatAdministrators,
+)
+
+from utils.cache import BoundedCache
+
+# Лимиты Telegram: около 30 запросов в секунду на бота и 20 сообщений в минуту в одну группу
+GLOBAL_RPS = float(os.getenv("OUTBOUND_GLOBAL_RPS", "30"))
+GROUP_MESSAGES_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_PER_MINUTE", "20"))
+PRIVATE_MESSAGES_PER_SECOND = 1.0
+MAX_RETRIES = 3
+
+
+class Priority(IntEnum):
+    MODERATION = 0  # удаления, муты, баны
+    NORMAL = 1
+    LOW = 2         # поздравления, приветствия
+
+
+# Методы модерации по умолчанию идут первыми
+MODERATION_METHODS = (DeleteMessage, DeleteMessages, RestrictChatMember, BanChatMember, UnbanChatMember)
+# Чтение информации о чате не ограничиваем по чату
+READ_METHODS = (GetChat, GetChatMember, GetChatMemberCount, GetChatAdministrators)
+
+# None - приоритет по типу метода
+_current_priority: ContextVar[Priority | None] = ContextVar("outbound_priority", default=None)
+
+
+@contextmanager
+def outbound_priority(priority: Priority):
+    """
+    Задает приоритет для всех запросов к API внутри блока with.
+    Явный приоритет важнее приоритета по типу метода (например, массовое удаление в /purge идет как LOW).
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated", "blocked_until")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 - можно сейчас)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        blocked = self.blocked_until - now
+        missing = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(blocked, missing, 0.0)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Блокирует ведро после ответа 429 с retry_after."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Мидлварь сессии бота: все исходящие запросы проходят через общее ведро своего бота
+    и по-чатовые token bucket'ы (лимиты Telegram считаются для каждого бота отдельно). Ожидающие запросы выдаются по приоритету,
+    ответы 429 блокируют соответствующее ведро на retry_after и запрос повторяется.
+    Одинаковые одновременные sendMessage склеиваются в один запрос.
+    """
+
+    def __init__(self):
+        # ID бота -> общее ведро бота
+        self.global_buckets: dict[int, TokenBucket] = {}
+        self.chat_buckets = BoundedCache("outbound_chats", max_items=100_000, ttl=300)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.stats = {"sent": 0, "retry_after": 0, "coalesced": 0, "by_priority": {p.name: 0 for p in Priority}}
+
+    # --- Классификация запросов ---
+
+    def _priority(self, method: TelegramMethod) -> Priority:
+        priority = _current_priority.get()
+        if priority is not None:
+            return priority
+        if isinstance(method, MODERATION_METHODS):
+            return Priority.MODERATION
+        return Priority.NORMAL
+
+    def _global_bucket(self, bot: Bot) -> TokenBucket:
+        bucket = self.global_buckets.get(bot.id)
+        if bucket is None:
+            bucket = self.global_buckets[bot.id] = TokenBucket(GLOBAL_RPS, GLOBAL_RPS)
+        return bucket
+
+    def _chat_bucket(self, bot: Bot, method: TelegramMethod) -> TokenBucket | None:
+        """Ведро чата для отправки сообщений; модерация и чтение ограничены только ведром бота."""
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int) or isinstance(method, MODERATION_METHODS + READ_METHODS):
+            return None
+        key = (bot.id, chat_id)
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if chat_id > 0:
+                bucket = TokenBucket(1, PRIVATE_MESSAGES_PER_SECOND)
+            else:
+                # Небольшой запас на всплески, в среднем - лимит группы
+                bucket = TokenBucket(3, GROUP_MESSAGES_PER_MINUTE / 60)
+            self.chat_buckets[key] = bucket
+        return bucket
+
+    def _coalesce_key(self, bot: Bot, method: TelegramMethod) -> tuple | None:
+        """
+        Склеиваем только простые сообщения без кнопок и без ответа на другое сообщение,
+        и только от одного бота: сообщения разных ботов - разные сообщения.
+        """
+        if (isinstance(method, SendMessage) and method.reply_markup is None
+                and method.reply_parameters is None and method.reply_to_message_id is None):
+            return (bot.id, method.chat_id, method.text, method.parse_mode)
+        return None
+
+    # --- Выдача токенов ---
+
+    @staticmethod
+    def _wait_time(global_bucket: TokenBucket, chat_bucket: TokenBucket | None, now: float) -> float:
+        wait = global_bucket.wait_time(now)
+        if chat_bucket is not None:
+            wait = max(wait, chat_bucket.wait_time(now))
+        return wait
+
+    @staticmethod
+    def _take(global_bucket: TokenBucket, chat_bucket: TokenBucket | None):
+        global_bucket.take()
+        if chat_bucket is not None:
+            chat_bucket.take()
+
+    async def _acquire(self, global_bucket: TokenBucket, chat_bucket: TokenBucket | None, priority: Priority):
+        if not self._waiters and self._wait_time(global_bucket, chat_bucket, time.monotonic()) <= 0:
+            self._take(global_bucket, chat_bucket)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), global_bucket, chat_bucket, future))
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._wakeup.clear()
+            now = time.monotonic()
+            postponed = []
+            next_wait = None
+            # Боты, у которых кончились общие токены: их запросы подождут своей очереди
+            exhausted = set()
+            while self._waiters:
+                item = heapq.heappop(self._waiters)
+                priority, _, global_bucket, chat_bucket, future = item
+                if future.done():
+                    continue
+                if id(global_bucket) in exhausted:
+                    postponed.append(item)
+                    continue
+                wait = self._wait_time(global_bucket, chat_bucket, now)
+                if wait <= 0:
+                    self._take(global_bucket, chat_bucket)
+                    future.set_result(None)
+                    continue
+                postponed.append(item)
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+                if global_bucket.wait_time(now) > 0:
+                    exhausted.add(id(global_bucket))
+            for item in postponed:
+                heapq.heappush(self._waiters, item)
+            if self._waiters:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), next_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    # --- Основной вход ---
+
+    async def _send(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        priority = self._priority(method)
+        global_bucket = self._global_bucket(bot)
+        chat_bucket = self._chat_bucket(bot, method)
+        for attempt in range(MAX_RETRIES + 1):
+            await self._acquire(global_bucket, chat_bucket, priority)
+            try:
+                response = await make_request(bot, method)
+                self.stats["sent"] += 1
+                self.stats["by_priority"][priority.name] += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                if attempt == MAX_RETRIES:
+                    raise
+                logging.warning(f"429 на {type(method).__name__}, повтор через {e.retry_after} сек.")
+                (chat_bucket or global_bucket).block(e.retry_after)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        if getattr(method, "chat_id", None) is None and not isinstance(method, MODERATION_METHODS):
+            # getUpdates, getMe, answerCallbackQuery и т.п. не ограничиваем
+            return await make_request(bot, method)
+
+        key = self._coalesce_key(bot, method)
+        if key is None:
+            return await self._send(make_request, bot, method)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self._send(make_request, bot, method)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, помечаем его полученным
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def queue_size(self) -> int:
+        return len(self._waiters)
+
+
+# Единый планировщик исходящих запросов процесса
+outbound = OutboundScheduler()
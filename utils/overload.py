@@ -0,0 +1,88 @@
+# utils/overload.py
+
+import os
+import time
+import asyncio
+import logging
+from typing import Callable
+
+# Пороги перегрузки: задержка цикла событий и число апдейтов в очереди диспетчера
+OVERLOAD_LAG_MS = float(os.getenv("OVERLOAD_LAG_MS", "200"))
+OVERLOAD_QUEUE_DEPTH = int(os.getenv("OVERLOAD_QUEUE_DEPTH", "1000"))
+CHECK_INTERVAL_SECONDS = 0.5
+# Минимальная длительность режима перегрузки, чтобы не переключаться туда-обратно на каждом замере
+MIN_OVERLOAD_SECONDS = 5
+
+
+class OverloadController:
+    """
+    Следит за задержкой цикла событий и глубиной очередей. При превышении порогов
+    включает режим перегрузки, в котором второстепенная работа (опыт, статистика,
+    поздравления, реакции на «спасибо») отбрасывается. Модерация не отбрасывается никогда.
+    Режим выключается не раньше чем через MIN_OVERLOAD_SECONDS, когда обе величины
+    опускаются ниже половины порога.
+    """
+
+    def __init__(self, lag_ms: float = OVERLOAD_LAG_MS, queue_depth: int = OVERLOAD_QUEUE_DEPTH):
+        self.lag_threshold_ms = lag_ms
+        self.queue_threshold = queue_depth
+        self.overloaded = False
+        self.lag_ms = 0.0
+        self._queue_sources: list[Callable[[], int]] = []
+        self._task: asyncio.Task | None = None
+        self._overloaded_since = 0.0
+        self.stats = {"episodes": 0, "overloaded_seconds": 0.0, "max_lag_ms": 0.0, "shed": {}}
+
+    def add_queue_source(self, source: Callable[[], int]):
+        """Регистрирует функцию, возвращающую текущую глубину очереди."""
+        self._queue_sources.append(source)
+
+    def queue_depth(self) -> int:
+        return sum(source() for source in self._queue_sources)
+
+    def should_shed(self, kind: str) -> bool:
+        """True, если работу типа kind нужно пропустить; пропуск учитывается в метриках."""
+        if not self.overloaded:
+            return False
+        self.stats["shed"][kind] = self.stats["shed"].get(kind, 0) + 1
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._monitor())
+
+    def _update(self, lag_ms: float, depth: int):
+        self.lag_ms = lag_ms
+        self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], lag_ms)
+        now = time.monotonic()
+        if not self.overloaded and (lag_ms > self.lag_threshold_ms or depth > self.queue_threshold):
+            self.overloaded = True
+            self._overloaded_since = now
+            self.stats["episodes"] += 1
+            logging.warning(f"Перегрузка: задержка цикла {lag_ms:.0f} мс, в очереди {depth}. Второстепенная работа отключена")
+        elif (self.overloaded and now - self._overloaded_since >= MIN_OVERLOAD_SECONDS
+                and lag_ms < self.lag_threshold_ms / 2 and depth < self.queue_threshold / 2):
+            self.overloaded = False
+            self.stats["overloaded_seconds"] += now - self._overloaded_since
+            logging.warning(f"Перегрузка снята, отброшено: {self.stats['shed']}")
+
+    async def _monitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+            # Насколько позже запланированного мы проснулись - столько ждут и остальные задачи
+            lag_ms = max(loop.time() - started - CHECK_INTERVAL_SECONDS, 0) * 1000
+            self._update(lag_ms, self.queue_depth())
+
+    def take_stats(self) -> dict:
+        """Возвращает метрики и сбрасывает максимум задержки за период."""
+        stats = dict(self.stats, shed=dict(self.stats["shed"]), overloaded=self.overloaded, lag_ms=self.lag_ms)
+        if self.overloaded:
+            stats["overloaded_seconds"] += time.monotonic() - self._overloaded_since
+        self.stats["max_lag_ms"] = 0.0
+        return stats
+
+
+# Единый контроллер перегрузки процесса
+overload = OverloadController()
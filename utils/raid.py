@@ -0,0 +1,137 @@
+# utils/raid.py
+
+import os
+import time
+import logging
+from collections import deque
+
+from db.requests import add_raid_captcha_members, verify_raid_captcha_member, pop_raid_captcha_batch
+from utils.cache import BoundedCache
+
+# Рейд: RAID_JOIN_THRESHOLD входов за RAID_WINDOW_SECONDS секунд
+RAID_JOIN_THRESHOLD = int(os.getenv("RAID_JOIN_THRESHOLD", "10"))
+RAID_WINDOW_SECONDS = float(os.getenv("RAID_WINDOW_SECONDS", "60"))
+# Режим рейда держится столько секунд после последнего всплеска входов
+RAID_COOLDOWN_SECONDS = float(os.getenv("RAID_COOLDOWN_SECONDS", "300"))
+
+
+class RaidState:
+    """Состояние чата: время последних входов и открытые пачки общей капчи."""
+
+    __slots__ = ("joins", "raid_until", "open_message_id", "open_until", "pending")
+
+    def __init__(self, threshold: int):
+        # Храним не больше threshold меток: этого достаточно, чтобы узнать темп входов
+        self.joins = deque(maxlen=threshold)
+        self.raid_until = 0.0
+        self.open_message_id: int | None = None
+        self.open_until = 0.0
+        # ID сообщения общей капчи -> пользователи, которые должны ее пройти
+        self.pending: dict[int, set[int]] = {}
+
+
+class RaidGuard:
+    """
+    Детектор рейдов по темпу входов в чат. Во время рейда вместо капчи на каждого
+    вошедшего бот публикует одно общее сообщение с капчей на пачку вошедших
+    и кикает не прошедших ее одним таймером на пачку.
+    Состав пачек хранится в таблице raid_captcha_members, поэтому переживает перезапуск
+    вместе с таймером; копия в памяти нужна на случай недоступности БД.
+    """
+
+    def __init__(self, threshold: int = RAID_JOIN_THRESHOLD, window: float = RAID_WINDOW_SECONDS,
+                 cooldown: float = RAID_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        # Состояние меняется на месте; записи живут, пока в чате идут входы
+        self._states = BoundedCache("raid", max_items=10_000, ttl=cooldown * 2)
+        self.stats = {"raids": 0, "batches": 0, "joins_in_raid": 0}
+
+    def _state(self, chat_id: int) -> RaidState:
+        state = self._states.get(chat_id)
+        if state is None:
+            state = RaidState(self.threshold)
+        # Переприсваиваем, чтобы продлить TTL записи
+        self._states[chat_id] = state
+        return state
+
+    def register_joins(self, chat_id: int, count: int) -> tuple[bool, bool]:
+        """Учитывает вход count участников. Возвращает (идет ли рейд, начался ли он только что)."""
+        now = time.monotonic()
+        state = self._state(chat_id)
+        state.joins.extend([now] * count)
+        started = False
+        if len(state.joins) == self.threshold and now - state.joins[0] <= self.window:
+            started = state.raid_until <= now
+            if started:
+                self.stats["raids"] += 1
+            state.raid_until = now + self.cooldown
+        in_raid = state.raid_until > now
+        if in_raid:
+            self.stats["joins_in_raid"] += count
+        return in_raid, started
+
+    def open_batch(self, chat_id: int) -> int | None:
+        """ID сообщения общей капчи, к которой еще можно добавлять вошедших, или None."""
+        state = self._state(chat_id)
+        if state.open_message_id is not None and state.open_until > time.monotonic():
+            return state.open_message_id
+        return None
+
+    def start_batch(self, chat_id: int, message_id: int, open_seconds: float):
+        state = self._state(chat_id)
+        state.open_message_id = message_id
+        state.open_until = time.monotonic() + open_seconds
+        state.pending[message_id] = set()
+        self.stats["batches"] += 1
+
+    async def add_pending(self, chat_id: int, message_id: int, user_ids: list[int]):
+        self._state(chat_id).pending.setdefault(message_id, set()).update(user_ids)
+        try:
+            await add_raid_captcha_members(chat_id, message_id, user_ids)
+        except Exception as e:
+            logging.error(f"Не удалось сохранить пачку капчи рейда в чате {chat_id}: {e}")
+
+    async def verify(self, chat_id: int, message_id: int, user_id: int) -> bool | None:
+        """
+        Отмечает прохождение общей капчи. False - пользователь не ждет этой капчи,
+        None - пачка неизвестна ни БД, ни этому процессу.
+        """
+        state = self._states.get(chat_id)
+        pending = state.pending.get(message_id) if state is not None else None
+        try:
+            verified = await verify_raid_captcha_member(chat_id, message_id, user_id)
+        except Exception as e:
+            logging.error(f"Не удалось проверить капчу рейда в БД, используем память: {e}")
+            verified = None
+        if verified is None and pending is not None:
+            # Пачку не удалось сохранить в БД, но этот процесс ее помнит
+            verified = user_id in pending
+        if pending is not None:
+            pending.discard(user_id)
+        return verified
+
+    async def pop_batch(self, chat_id: int, message_id: int) -> list[int] | None:
+        """
+        Забирает пачку при срабатывании таймера: все, кто в ней остался, капчу не прошли.
+        None - пачка неизвестна ни БД, ни этому процессу.
+        """
+        state = self._states.get(chat_id)
+        pending = None
+        if state is not None:
+            if state.open_message_id == message_id:
+                state.open_message_id = None
+            pending = state.pending.pop(message_id, None)
+        try:
+            user_ids = await pop_raid_captcha_batch(chat_id, message_id)
+        except Exception as e:
+            logging.error(f"Не удалось забрать пачку капчи рейда из БД, используем память: {e}")
+            user_ids = None
+        if user_ids is None and pending is not None:
+            return list(pending)
+        return user_ids
+
+
+# Единый детектор рейдов процесса
+raid_guard = RaidGuard()
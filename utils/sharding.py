@@ -0,0 +1,135 @@
+# utils/sharding.py
+
+import os
+import sys
+import asyncio
+import logging
+import secrets
+from contextlib import asynccontextmanager
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from utils.chat_dispatcher import update_chat_key, DISPATCH_QUEUE_LIMIT
+from utils.webhook import bot_path
+
+# Число процессов-воркеров; 1 - без шардирования, все в одном процессе
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+# Номер шарда задается фронтом при запуске воркера; у фронта и одиночного процесса его нет
+SHARD_INDEX = int(os.environ["SHARD_INDEX"]) if os.getenv("SHARD_INDEX") else None
+# Воркер i принимает апдейты от фронта на 127.0.0.1:SHARD_BASE_PORT+i
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8100"))
+SHARD_PATH = "/shard"
+RESTART_DELAY_SECONDS = 1
+MAX_FORWARD_BACKOFF_SECONDS = 5
+
+
+def shard_for(key: int | None, count: int = SHARD_COUNT) -> int:
+    """Номер шарда для ID чата (или пользователя). Та же формула используется в SQL."""
+    return abs(key) % count if key is not None else 0
+
+
+def is_front() -> bool:
+    return SHARD_COUNT > 1 and SHARD_INDEX is None
+
+
+class ShardRouter:
+    """
+    Фронт шардированного запуска. Запускает SHARD_COUNT процессов-воркеров (тот же main.py
+    в режиме вебхука на локальном порту) и пересылает каждый апдейт воркеру по хэшу чата.
+    У каждого шарда одна очередь и одна задача пересылки, поэтому порядок апдейтов чата
+    сохраняется, а кэши и антифлуд чата живут только в его воркере.
+    """
+
+    def __init__(self, dp: Dispatcher, count: int = SHARD_COUNT, base_port: int = SHARD_BASE_PORT,
+                 queue_limit: int = DISPATCH_QUEUE_LIMIT):
+        self.dp = dp
+        self.count = count
+        self.base_port = base_port
+        self._secret = secrets.token_urlsafe(32)
+        self._queues = [asyncio.Queue(maxsize=queue_limit) for _ in range(count)]
+        self._processes: list[asyncio.subprocess.Process | None] = [None] * count
+        self._tasks: list[asyncio.Task] = []
+        self._bots: list[Bot] = []
+        self.stats = {"forwarded": [0] * count, "retries": 0, "restarts": 0}
+
+    async def submit(self, bot: Bot, update: Update):
+        """Ставит апдейт в очередь его шарда; ждет, если очередь заполнена."""
+        await self._queues[shard_for(update_chat_key(update), self.count)].put((bot, update))
+
+    def _worker_env(self, index: int) -> dict:
+        return dict(
+            os.environ,
+            SHARD_INDEX=str(index),
+            RUN_MODE="webhook",
+            WEBHOOK_SET="0",
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_PORT=str(self.base_port + index),
+            WEBHOOK_PATH=SHARD_PATH,
+            WEBHOOK_SECRET=self._secret,
+        )
+
+    async def _supervise(self, index: int):
+        """Держит воркер запущенным: при падении перезапускает его."""
+        script = os.path.abspath(sys.argv[0])
+        while True:
+            process = await asyncio.create_subprocess_exec(sys.executable, script, env=self._worker_env(index))
+            self._processes[index] = process
+            logging.info(f"Запущен воркер шарда {index}, pid={process.pid}")
+            code = await process.wait()
+            self.stats["restarts"] += 1
+            logging.error(f"Воркер шарда {index} завершился с кодом {code}, перезапуск")
+            await asyncio.sleep(RESTART_DELAY_SECONDS)
+
+    async def _forward(self, index: int, session: aiohttp.ClientSession):
+        base_url = f"http://127.0.0.1:{self.base_port + index}"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self._secret, "Content-Type": "application/json"}
+        queue = self._queues[index]
+        while True:
+            bot, update = await queue.get()
+            # Воркер принимает апдейты каждого бота по его пути, как вебхук
+            url = base_url + bot_path(SHARD_PATH, bot, self._bots)
+            body = update.model_dump_json(exclude_none=True)
+            backoff = 0.1
+            # Повторяем, пока воркер не примет апдейт (например, пока он перезапускается),
+            # следующие апдейты шарда ждут, чтобы не нарушить порядок
+            while True:
+                try:
+                    async with session.post(url, data=body, headers=headers) as response:
+                        if response.status == 200:
+                            break
+                        if response.status == 400:
+                            logging.error(f"Воркер шарда {index} отклонил апдейт {update.update_id}")
+                            break
+                        raise RuntimeError(f"HTTP {response.status}")
+                except Exception as e:
+                    self.stats["retries"] += 1
+                    logging.debug(f"Шард {index} недоступен ({e}), повтор через {backoff} сек.")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_FORWARD_BACKOFF_SECONDS)
+            self.stats["forwarded"][index] += 1
+
+    @asynccontextmanager
+    async def running(self, *bots: Bot, **kwargs):
+        """Запускает воркеры и пересылку; при выходе останавливает воркеры."""
+        self._bots = list(bots)
+        session = aiohttp.ClientSession()
+        self._tasks = [asyncio.create_task(self._supervise(i)) for i in range(self.count)]
+        self._tasks += [asyncio.create_task(self._forward(i, session)) for i in range(self.count)]
+        logging.info(f"Фронт запущен: шардов={self.count}")
+        try:
+            yield
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            for process in self._processes:
+                if process is not None and process.returncode is None:
+                    process.terminate()
+            await asyncio.gather(*(p.wait() for p in self._processes if p is not None), return_exceptions=True)
+            await session.close()
+            await asyncio.gather(*(bot.session.close() for bot in bots))
+
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
@@ -0,0 +1,167 @@
+# utils/simhash.py
+
+import re
+import sys
+import time
+from array import array
+from functools import lru_cache
+
+FINGERPRINT_BITS = 64
+_MASK64 = (1 << FINGERPRINT_BITS) - 1
+
+# Счетчики по битам складываем в "дорожках" по 16 бит внутри одного большого int:
+# одно сложение вместо 64, а 16 бит хватает на 65535 признаков.
+_LANE_BITS = 16
+_LANE_MASK = (1 << _LANE_BITS) - 1
+# Байт -> его 8 бит, разнесенные по 8 дорожкам
+_SPREAD_BYTE = [
+    sum(((b >> i) & 1) << (i * _LANE_BITS) for i in range(8))
+    for b in range(256)
+]
+
+_TOKEN_RE = re.compile(r"\w+")
+# Отпечаток считается по первым словам текста: стоимость проверки не растет с длиной сообщения,
+# а счетчики в дорожках не переполняются
+MAX_FINGERPRINT_WORDS = 200
+
+
+# Набор n-грамм ограничен, поэтому разложенные хэши выгодно кэшировать
+@lru_cache(maxsize=100_000)
+def _spread_token(token: str) -> int:
+    h = hash(token) & _MASK64
+    spread = 0
+    for k in range(8):
+        spread |= _SPREAD_BYTE[(h >> (8 * k)) & 0xFF] << (8 * k * _LANE_BITS)
+    return spread
+
+
+@lru_cache(maxsize=100_000)
+def _spread_word(word: str, shingle_size: int) -> tuple[int, int]:
+    """Сумма разложенных n-грамм слова, дополненного пробелами, и их число."""
+    padded = f" {word} "
+    count = max(len(padded) - shingle_size + 1, 0)
+    return sum(_spread_token(padded[i:i + shingle_size]) for i in range(count)), count
+
+
+def simhash(text: str, min_words: int = 5, shingle_size: int = 3) -> int | None:
+    """
+    Считает 64-битный SimHash по символьным n-граммам слов нормализованного текста
+    (регистр, пунктуация и лишние пробелы не влияют на отпечаток).
+    n-граммы считаются внутри слов (с пробелами по краям), поэтому вклад слова кэшируется
+    и на сообщение приходится по одному поиску в кэше на слово.
+    Для слишком коротких сообщений возвращает None: на них много ложных совпадений.
+    Хэш n-грамм зависит от PYTHONHASHSEED, поэтому отпечатки сравнимы только внутри процесса.
+    """
+    words = _TOKEN_RE.findall(text.lower())
+    if len(words) < min_words:
+        return None
+
+    lanes = shingles_count = 0
+    for word in words[:MAX_FINGERPRINT_WORDS]:
+        spread, count = _spread_word(word, shingle_size)
+        lanes += spread
+        shingles_count += count
+
+    # Дорожки - это 64 беззнаковых 16-битных счетчика подряд
+    half = shingles_count / 2
+    counters = array("H", lanes.to_bytes(FINGERPRINT_BITS * _LANE_BITS // 8, "little"))
+    if sys.byteorder == "big":
+        counters.byteswap()
+    return sum(1 << i for i, counter in enumerate(counters) if counter > half)
+
+
+class NearDuplicateIndex:
+    """
+    Кольцевой буфер последних отпечатков с индексом по полосам (banding).
+
+    Отпечаток делится на BANDS полос по 16 бит, кандидатов ищем только
+    в BANDS корзинах, без попарного сравнения. При расстоянии до BANDS - 1
+    совпадение полосы гарантировано, при большем - вероятностно: для волны
+    спама из многих копий этого достаточно. Память фиксирована: старые
+    записи перезаписываются по кругу.
+
+    В корзине хранится только последний слот каждого чата, а число чатов в корзине
+    ограничено BUCKET_MAX_CHATS: флуд одним текстом в одном чате не раздувает
+    корзину, и проверка стоит не больше BANDS * BUCKET_MAX_CHATS сравнений.
+    """
+
+    BANDS = 4
+    BAND_BITS = FINGERPRINT_BITS // BANDS
+    BAND_MASK = (1 << BAND_BITS) - 1
+    BUCKET_MAX_CHATS = 64
+
+    __slots__ = ("capacity", "window", "max_distance", "_fingerprints", "_timestamps",
+                 "_chat_ids", "_next_slot", "_buckets")
+
+    def __init__(self, capacity: int = 50_000, window_seconds: float = 600, max_distance: int = 7):
+        self.capacity = capacity
+        self.window = window_seconds
+        self.max_distance = max_distance
+        self._fingerprints = [0] * capacity
+        self._timestamps = [0.0] * capacity
+        self._chat_ids = [0] * capacity
+        self._next_slot = 0
+        # Для каждой полосы: значение полосы -> {чат: его последний слот} (в порядке добавления)
+        self._buckets = [{} for _ in range(self.BANDS)]
+
+    def _bands(self, fingerprint: int):
+        for band in range(self.BANDS):
+            yield band, (fingerprint >> (band * self.BAND_BITS)) & self.BAND_MASK
+
+    def _evict_slot(self, slot: int):
+        if self._timestamps[slot] == 0.0:
+            return
+        chat_id = self._chat_ids[slot]
+        for band, value in self._bands(self._fingerprints[slot]):
+            bucket = self._buckets[band].get(value)
+            # Слот мог быть уже замещен более новым сообщением того же чата
+            if bucket is not None and bucket.get(chat_id) == slot:
+                del bucket[chat_id]
+                if not bucket:
+                    del self._buckets[band][value]
+
+    def count_similar_chats(self, fingerprint: int, chat_id: int, limit: int, now: float) -> int:
+        """Считает (до limit) другие чаты, где за окно встречался похожий текст."""
+        oldest = now - self.window
+        chats = set()
+        checked = set()
+        for band, value in self._bands(fingerprint):
+            for other_chat, slot in self._buckets[band].get(value, {}).items():
+                if slot in checked:
+                    continue
+                checked.add(slot)
+                if (other_chat != chat_id and other_chat not in chats
+                        and self._timestamps[slot] >= oldest
+                        and (self._fingerprints[slot] ^ fingerprint).bit_count() <= self.max_distance):
+                    chats.add(other_chat)
+                    if len(chats) >= limit:
+                        return len(chats)
+        return len(chats)
+
+    def add(self, fingerprint: int, chat_id: int, now: float):
+        slot = self._next_slot
+        self._evict_slot(slot)
+        self._fingerprints[slot] = fingerprint
+        self._timestamps[slot] = now
+        self._chat_ids[slot] = chat_id
+        for band, value in self._bands(fingerprint):
+            bucket = self._buckets[band].setdefault(value, {})
+            # Переставляем чат в конец, чтобы при переполнении вытеснялись давно молчавшие чаты
+            bucket.pop(chat_id, None)
+            bucket[chat_id] = slot
+            if len(bucket) > self.BUCKET_MAX_CHATS:
+                del bucket[next(iter(bucket))]
+        self._next_slot = (slot + 1) % self.capacity
+
+    def check_and_add(self, text: str, chat_id: int, chats_threshold: int) -> bool:
+        """
+        Индексирует сообщение и возвращает True, если такой же (почти) текст
+        за окно уже появлялся как минимум в chats_threshold других чатах.
+        """
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return False
+        now = time.monotonic()
+        similar = self.count_similar_chats(fingerprint, chat_id, chats_threshold, now)
+        self.add(fingerprint, chat_id, now)
+        return similar >= chats_threshold
@@ -0,0 +1,210 @@
+# utils/state_backend.py
+
+import os
+import time
+import logging
+from abc import ABC, abstractmethod
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from utils.cache import BoundedCache
+from utils.tenancy import current_bot_id
+
+try:
+    from redis.asyncio import Redis
+    from redis.exceptions import NoScriptError
+    from aiogram.fsm.storage.redis import RedisStorage
+except ImportError:
+    Redis = None
+
+# Сколько живет отметка о пройденной капче (с запасом покрывает максимальный таймаут)
+VERIFIED_TTL_SECONDS = 3600
+# Сколько хранится ведро антифлуда молчащего пользователя
+FLOOD_TTL_SECONDS = 300
+
+
+class FloodBucket:
+    """Token bucket одного пользователя в чате: два числа вместо списка меток времени."""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def consume(self, capacity: float, refill_per_second: float, now: float) -> bool:
+        """Списывает токен за сообщение. Возвращает False, если токенов не осталось (флуд)."""
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * refill_per_second)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class StateBackend(ABC):
+    """
+    Общее состояние бота: FSM, окна антифлуда и отметки о пройденной капче.
+    prefetch() за один проход достает состояние FSM и заодно списывает токен
+    антифлуда, чтобы на апдейт приходилось не больше одного обращения к хранилищу.
+    """
+
+    fsm: BaseStorage
+
+    @abstractmethod
+    async def prefetch(self, key: StorageKey, flood: tuple[float, float] | None) -> tuple[str | None, bool | None]:
+        """
+        Возвращает (состояние FSM, разрешено ли сообщение антифлудом).
+        flood - (емкость, пополнение в секунду) или None, если антифлуд не нужен.
+        """
+
+    @abstractmethod
+    async def consume_flood_token(self, chat_id: int, user_id: int, capacity: float, refill_per_second: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def reset_flood(self, chat_id: int, user_id: int):
+        ...
+
+    @abstractmethod
+    async def mark_verified(self, chat_id: int, user_id: int):
+        ...
+
+    @abstractmethod
+    async def pop_verified(self, chat_id: int, user_id: int) -> bool:
+        ...
+
+    async def close(self):
+        await self.fsm.close()
+
+
+class MemoryStateBackend(StateBackend):
+    """Состояние в памяти процесса: подходит для одного инстанса."""
+
+    def __init__(self):
+        self.fsm = MemoryStorage()
+        # Ведро меняется на месте, его размер постоянен
+        self._buckets = BoundedCache("antiflood", max_items=200_000, ttl=FLOOD_TTL_SECONDS)
+        self._verified = BoundedCache("verified_users", max_items=100_000, ttl=VERIFIED_TTL_SECONDS)
+
+    async def prefetch(self, key, flood):
+        allowed = None
+        if flood is not None:
+            allowed = await self.consume_flood_token(key.chat_id, key.user_id, *flood)
+        return await self.fsm.get_state(key), allowed
+
+    async def consume_flood_token(self, chat_id, user_id, capacity, refill_per_second):
+        now = time.monotonic()
+        bucket = self._buckets.get((chat_id, user_id))
+        if bucket is None:
+            bucket = FloodBucket(capacity, now)
+            self._buckets[(chat_id, user_id)] = bucket
+        return bucket.consume(capacity, refill_per_second, now)
+
+    async def reset_flood(self, chat_id, user_id):
+        self._buckets.pop((chat_id, user_id))
+
+    async def mark_verified(self, chat_id, user_id):
+        self._verified[(chat_id, user_id)] = True
+
+    async def pop_verified(self, chat_id, user_id):
+        return bool(self._verified.pop((chat_id, user_id)))
+
+
+# Token bucket целиком на стороне Redis: чтение, пересчет и запись за одну команду
+FLOOD_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 't', 'u')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return allowed
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """Состояние в Redis (или любом сервере с протоколом Redis), общее для всех инстансов."""
+
+    def __init__(self, redis: "Redis", prefix: str = "tgm"):
+        self.redis = redis
+        self.fsm = RedisStorage(redis=self.redis)
+        self.prefix = prefix
+        self._flood_sha: str | None = None
+
+    def _namespace(self) -> str:
+        namespace = current_bot_id.get()
+        return self.prefix if namespace is None else f"{self.prefix}:{namespace}"
+
+    def _flood_key(self, chat_id: int, user_id: int) -> str:
+        return f"{self._namespace()}:flood:{chat_id}:{user_id}"
+
+    def _verified_key(self, chat_id: int, user_id: int) -> str:
+        return f"{self._namespace()}:verified:{chat_id}:{user_id}"
+
+    def _flood_args(self, chat_id, user_id, capacity, refill_per_second):
+        return self._flood_key(chat_id, user_id), capacity, refill_per_second, time.time(), FLOOD_TTL_SECONDS
+
+    async def _execute(self, build_pipeline):
+        """Выполняет пайплайн; если Redis забыл скрипт (перезапуск), загружает его и повторяет."""
+        if self._flood_sha is None:
+            self._flood_sha = await self.redis.script_load(FLOOD_SCRIPT)
+        try:
+            return await build_pipeline().execute()
+        except NoScriptError:
+            logging.warning("Redis потерял скрипт антифлуда, загружаем заново")
+            self._flood_sha = await self.redis.script_load(FLOOD_SCRIPT)
+            return await build_pipeline().execute()
+
+    async def prefetch(self, key, flood):
+        state_key = self.fsm.key_builder.build(key, "state")
+
+        def build_pipeline():
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(state_key)
+            if flood is not None:
+                pipe.evalsha(self._flood_sha, 1, *self._flood_args(key.chat_id, key.user_id, *flood))
+            return pipe
+
+        results = await self._execute(build_pipeline)
+        state = results[0].decode("utf-8") if isinstance(results[0], bytes) else results[0]
+        allowed = bool(results[1]) if flood is not None else None
+        return state, allowed
+
+    async def consume_flood_token(self, chat_id, user_id, capacity, refill_per_second):
+        def build_pipeline():
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.evalsha(self._flood_sha, 1, *self._flood_args(chat_id, user_id, capacity, refill_per_second))
+            return pipe
+        return bool((await self._execute(build_pipeline))[0])
+
+    async def reset_flood(self, chat_id, user_id):
+        await self.redis.delete(self._flood_key(chat_id, user_id))
+
+    async def mark_verified(self, chat_id, user_id):
+        await self.redis.set(self._verified_key(chat_id, user_id), 1, ex=VERIFIED_TTL_SECONDS)
+
+    async def pop_verified(self, chat_id, user_id):
+        return await self.redis.getdel(self._verified_key(chat_id, user_id)) is not None
+
+
+def create_state_backend(redis_url: str | None) -> StateBackend:
+    """Redis, если задан REDIS_URL, иначе память процесса."""
+    if not redis_url:
+        return MemoryStateBackend()
+    if Redis is None:
+        raise RuntimeError("Для REDIS_URL нужен пакет redis: pip install redis")
+    return RedisStateBackend(Redis.from_url(redis_url))
+
+
+# Общее хранилище процесса
+state_backend = create_state_backend(os.getenv("REDIS_URL"))
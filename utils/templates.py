@@ -0,0 +1,102 @@
+# utils/templates.py
+
+import re
+import html
+from functools import lru_cache
+
+from aiogram import Bot, types
+
+PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+# Плейсхолдеры, относящиеся к пользователю (при пакетном рендере объединяются через запятую)
+USER_FIELDS = ("user_mention", "user_name", "first_name", "username", "user_id")
+CHAT_FIELDS = ("chat_title", "member_count")
+KNOWN_FIELDS = frozenset(USER_FIELDS + CHAT_FIELDS)
+
+# Подсказка для админов в меню настроек
+PLACEHOLDERS_HELP = (
+    "Доступные переменные: <code>{user_mention}</code>, <code>{user_name}</code>, "
+    "<code>{first_name}</code>, <code>{username}</code>, <code>{user_id}</code>, "
+    "<code>{chat_title}</code>, <code>{member_count}</code>."
+)
+
+
+class CompiledTemplate:
+    """Шаблон, разобранный на литералы и имена полей. Рендер - одна склейка строк."""
+
+    __slots__ = ("parts", "fields")
+
+    def __init__(self, parts: tuple, fields: frozenset):
+        # parts: литералы на четных позициях, имена полей на нечетных
+        self.parts = parts
+        self.fields = fields
+
+    def render(self, values: dict) -> str:
+        if not self.fields:
+            return self.parts[0]
+        parts = self.parts
+        return "".join(
+            part if i % 2 == 0 else values.get(part, "{" + part + "}")
+            for i, part in enumerate(parts)
+        )
+
+
+@lru_cache(maxsize=4096)
+def compile_template(template: str) -> CompiledTemplate:
+    """
+    Разбирает шаблон один раз. Кэш по тексту шаблона: после изменения
+    настройки новый текст просто скомпилируется заново.
+    Неизвестные плейсхолдеры остаются в тексте как есть.
+    """
+    parts = []
+    literal_start = 0
+    for match in PLACEHOLDER_RE.finditer(template):
+        name = match.group(1)
+        if name not in KNOWN_FIELDS:
+            continue
+        parts.append(template[literal_start:match.start()])
+        parts.append(name)
+        literal_start = match.end()
+    parts.append(template[literal_start:])
+    fields = frozenset(parts[1::2])
+    return CompiledTemplate(tuple(parts), fields)
+
+
+_USER_FORMATTERS = {
+    "user_mention": lambda user: user.mention_html(),
+    "user_name": lambda user: html.escape(user.full_name),
+    "first_name": lambda user: html.escape(user.first_name),
+    "username": lambda user: f"@{user.username}" if user.username else html.escape(user.full_name),
+    "user_id": lambda user: str(user.id),
+}
+
+
+def user_values(template: CompiledTemplate, users: list[types.User]) -> dict:
+    """Значения используемых шаблоном полей пользователя. Для нескольких - через запятую."""
+    return {
+        field: ", ".join(formatter(user) for user in users)
+        for field, formatter in _USER_FORMATTERS.items()
+        if field in template.fields
+    }
+
+
+async def chat_values(template: CompiledTemplate, chat: types.Chat, bot: Bot) -> dict:
+    """Значения полей чата. Число участников запрашивается, только если шаблон его использует."""
+    values = {"chat_title": html.escape(chat.title or "")}
+    if "member_count" in template.fields:
+        try:
+            values["member_count"] = str(await bot.get_chat_member_count(chat.id))
+        except Exception:
+            values["member_count"] = "?"
+    return values
+
+
+async def render_template(template: str, users: list[types.User], chat: types.Chat, bot: Bot) -> str:
+    """Рендерит шаблон для одного или сразу нескольких пользователей (одним сообщением)."""
+    compiled = compile_template(template)
+    if not compiled.fields:
+        return compiled.render({})
+    values = user_values(compiled, users)
+    if not compiled.fields.isdisjoint(CHAT_FIELDS):
+        values.update(await chat_values(compiled, chat, bot))
+    return compiled.render(values)
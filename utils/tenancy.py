@@ -0,0 +1,43 @@
+# utils/tenancy.py
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Несколько ботов в одном процессе: BOT_TOKENS=token1,token2. Данные каждого бота
+# живут в своей схеме Postgres (bot_<id>), кэши и пул соединений общие.
+# С одним BOT_TOKEN все работает как раньше, в схеме по умолчанию.
+TENANCY_ENABLED = bool(os.getenv("BOT_TOKENS"))
+
+# Бот, в контексте которого выполняется текущий код (None - схема по умолчанию)
+current_bot_id: ContextVar[int | None] = ContextVar("current_bot_id", default=None)
+
+
+def get_bot_tokens() -> list[str]:
+    tokens = [token.strip() for token in os.getenv("BOT_TOKENS", "").split(",") if token.strip()]
+    return tokens or [os.getenv("BOT_TOKEN")]
+
+
+def bot_namespace(bot_id: int) -> int | None:
+    """Пространство имен бота: его ID в режиме нескольких ботов, иначе None."""
+    return bot_id if TENANCY_ENABLED else None
+
+
+def schema_for(namespace: int | None) -> str | None:
+    return f"bot_{namespace}" if namespace is not None else None
+
+
+@contextmanager
+def bot_scope(namespace: int | None):
+    """Выполняет блок от имени бота: его схема в БД и его ключи в кэшах."""
+    token = current_bot_id.set(namespace)
+    try:
+        yield
+    finally:
+        current_bot_id.reset(token)
+
+
+def scoped_key(key):
+    """Ключ кэша с учетом текущего бота: одинаковые ID чатов разных ботов не пересекаются."""
+    namespace = current_bot_id.get()
+    return key if namespace is None else (namespace, key)
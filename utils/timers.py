@@ -0,0 +1,171 @@
+# utils/timers.py
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, NamedTuple
+
+from aiogram import Bot
+
+from db.requests import add_timer, delete_timer, delete_timers, get_pending_timers
+from utils.sharding import SHARD_COUNT, SHARD_INDEX
+from utils.tenancy import current_bot_id, bot_scope, bot_namespace
+
+
+class TimerEntry(NamedTuple):
+    run_at: float
+    id: int
+    kind: str
+    chat_id: int
+    user_id: int | None
+    message_id: int | None
+    # Пространство имен бота, чей это таймер (см. utils.tenancy)
+    bot_id: int | None = None
+
+
+TimerHandler = Callable[[Bot, TimerEntry], Awaitable[None]]
+
+
+class TimerService:
+    """
+    Один планировщик на весь процесс вместо задачи с asyncio.sleep на каждый таймер.
+    Таймеры хранятся в min-куче по времени срабатывания и дублируются в таблицу
+    timers, поэтому после перезапуска загружаются заново через load_pending().
+    Одна куча обслуживает всех ботов процесса: таймер выполняется от имени своего бота.
+    """
+
+    def __init__(self):
+        self.bots: dict[int | None, Bot] = {}
+        self._handlers: dict[str, TimerHandler] = {}
+        self._heap: list[TimerEntry] = []
+        # (бот, ID таймера): ID уникальны только внутри схемы одного бота
+        self._cancelled: set[tuple[int | None, int]] = set()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+        # Отрицательные ID для таймеров, которые не удалось сохранить в БД
+        self._local_ids = itertools.count(-1, -1)
+
+    def handler(self, kind: str):
+        """Декоратор: регистрирует обработчик для таймеров типа kind."""
+        def decorator(func: TimerHandler) -> TimerHandler:
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    def _push(self, entry: TimerEntry):
+        heapq.heappush(self._heap, entry)
+        self._wakeup.set()
+
+    async def schedule(self, kind: str, delay: float, chat_id: int,
+                       user_id: int | None = None, message_id: int | None = None) -> int:
+        """Планирует действие через delay секунд. Возвращает ID таймера."""
+        run_at = time.time() + delay
+        try:
+            timer_id = await add_timer(
+                kind, chat_id, datetime.fromtimestamp(run_at, tz=timezone.utc), user_id, message_id
+            )
+        except Exception as e:
+            logging.error(f"Не удалось сохранить таймер {kind} в БД, он не переживет перезапуск: {e}")
+            timer_id = next(self._local_ids)
+        self._push(TimerEntry(run_at, timer_id, kind, chat_id, user_id, message_id, current_bot_id.get()))
+        return timer_id
+
+    async def cancel(self, kind: str, chat_id: int, user_id: int) -> bool:
+        """Отменяет таймеры типа kind для пользователя в чате."""
+        found = False
+        namespace = current_bot_id.get()
+        for entry in self._heap:
+            if (entry.kind == kind and entry.chat_id == chat_id and entry.user_id == user_id
+                    and entry.bot_id == namespace):
+                self._cancelled.add((namespace, entry.id))
+                found = True
+        if found:
+            await delete_timers(kind, chat_id, user_id)
+        return found
+
+    async def load_pending(self) -> int:
+        """Загружает из БД таймеры, не выполненные до перезапуска (при шардировании - только своих чатов)."""
+        namespace = current_bot_id.get()
+        known_ids = {entry.id for entry in self._heap if entry.bot_id == namespace}
+        loaded = 0
+        rows = await get_pending_timers(SHARD_INDEX or 0, SHARD_COUNT if SHARD_INDEX is not None else 1)
+        for row in rows:
+            if row.id in known_ids:
+                continue
+            self._push(TimerEntry(
+                row.run_at.timestamp(), row.id, row.kind, row.chat_id, row.user_id, row.message_id, namespace
+            ))
+            loaded += 1
+        return loaded
+
+    def start(self, bot: Bot):
+        """Регистрирует бота (можно вызывать для каждого бота) и запускает планировщик."""
+        self.bots[bot_namespace(bot.id)] = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _fire(self, entry: TimerEntry):
+        bot = self.bots.get(entry.bot_id)
+        if bot is None:
+            # Бот убран из конфигурации: строку не удаляем, таймер выполнится, когда бот вернется
+            logging.error(f"Таймер {entry.kind} ({entry.id}) принадлежит незарегистрированному боту "
+                          f"{entry.bot_id}, пропускаем его")
+            return
+        handler = self._handlers.get(entry.kind)
+        with bot_scope(entry.bot_id):
+            try:
+                if handler is None:
+                    logging.error(f"Нет обработчика для таймера типа {entry.kind}")
+                else:
+                    await handler(bot, entry)
+            except Exception as e:
+                logging.error(f"Ошибка при выполнении таймера {entry.kind} ({entry.id}): {e}")
+            finally:
+                if entry.id > 0:
+                    try:
+                        await delete_timer(entry.id)
+                    except Exception as e:
+                        logging.error(f"Не удалось удалить выполненный таймер {entry.id}: {e}")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0].run_at <= now:
+                entry = heapq.heappop(self._heap)
+                if (entry.bot_id, entry.id) in self._cancelled:
+                    self._cancelled.discard((entry.bot_id, entry.id))
+                    continue
+                task = asyncio.create_task(self._fire(entry))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            timeout = self._heap[0].run_at - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def pending_count(self) -> int:
+        return len(self._heap)
+
+
+# Единый планировщик процесса
+timers = TimerService()
+
+
+@timers.handler("delete_message")
+async def _delete_message(bot: Bot, timer: TimerEntry):
+    try:
+        await bot.delete_message(timer.chat_id, timer.message_id)
+    except Exception:
+        pass # Сообщение уже могли удалить вручную
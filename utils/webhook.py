@@ -0,0 +1,87 @@
+# utils/webhook.py
+
+import os
+import hmac
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.types import Update
+
+from utils.chat_dispatcher import ChatDispatcher
+
+# Публичный адрес бота (https://example.com), к нему добавляется WEBHOOK_PATH
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Сколько одновременных соединений Telegram открывает к боту (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Типы апдейтов через запятую; по умолчанию - те, на которые есть обработчики
+WEBHOOK_ALLOWED_UPDATES = [t.strip() for t in os.getenv("WEBHOOK_ALLOWED_UPDATES", "").split(",") if t.strip()]
+# WEBHOOK_SET=0 - не вызывать setWebhook (для локальной проверки записанными апдейтами)
+WEBHOOK_SET = os.getenv("WEBHOOK_SET", "1") == "1"
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def bot_path(base: str, bot: Bot, bots: list[Bot]) -> str:
+    """Путь вебхука бота: у единственного бота - base, у нескольких - base/<ID бота>."""
+    return base if len(bots) == 1 else f"{base}/{bot.id}"
+
+
+def create_webhook_app(bots: list[Bot], dispatcher: ChatDispatcher, path: str = WEBHOOK_PATH,
+                       secret: str = WEBHOOK_SECRET) -> web.Application:
+    """
+    aiohttp-приложение, принимающее апдейты всех ботов. Ответ 200 отдается сразу после
+    постановки апдейта в очередь чата, не дожидаясь обработчиков.
+    """
+
+    def make_handler(bot: Bot):
+        async def handle_update(request: web.Request) -> web.Response:
+            if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+                return web.Response(status=401)
+            try:
+                update = Update.model_validate(await request.json(), context={"bot": bot})
+            except Exception as e:
+                logging.warning(f"Некорректный апдейт в вебхуке: {e}")
+                return web.Response(status=400)
+            # Если очередь заполнена, ждем места: соединение Telegram остается занятым,
+            # и он сам снижает темп в пределах max_connections
+            await dispatcher.submit(bot, update)
+            return web.Response()
+        return handle_update
+
+    app = web.Application()
+    for bot in bots:
+        app.router.add_post(bot_path(path, bot, bots), make_handler(bot))
+    return app
+
+
+async def run_webhook(bots: list[Bot], dispatcher: ChatDispatcher, **kwargs):
+    """
+    Запускает HTTP-сервер вебхука и регистрирует его в Telegram для каждого бота.
+    dispatcher - ChatDispatcher или ShardRouter фронта (нужны submit, running и dp).
+    """
+    app = create_webhook_app(bots, dispatcher)
+    runner = web.AppRunner(app)
+    async with dispatcher.running(*bots, **kwargs):
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            if WEBHOOK_SET:
+                allowed_updates = WEBHOOK_ALLOWED_UPDATES or dispatcher.dp.resolve_used_update_types()
+                for bot in bots:
+                    await bot.set_webhook(
+                        url=WEBHOOK_URL.rstrip("/") + bot_path(WEBHOOK_PATH, bot, bots),
+                        secret_token=WEBHOOK_SECRET or None,
+                        max_connections=WEBHOOK_MAX_CONNECTIONS,
+                        allowed_updates=allowed_updates,
+                        drop_pending_updates=True,
+                    )
+            logging.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, ботов: {len(bots)}")
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()